@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# Benchmark of tag chip updates.
+#
+# Shows N tags, then adds and removes single tags the way editing does, and
+# times each update until it is laid out and painted.  Compares `TagChipView'
+# with the previous approach, kept here with its flow layout, of rebuilding
+# a widget, layout, label, button and two style sheets per tag on every
+# change.  Also counts the QObjects each approach keeps alive, and times
+# laying out a thousand chips again as the window is resized across several
+# widths.  Runs offscreen.
+#
+# Usage (from `v2/'): python3 -m benchmarks.chip_view_bench [--tags N]
+#                         [--resize-tags 1000] [--widths 300,600,900,1200]
+import argparse
+import os
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PySide6.QtCore import Qt, QMargins, QObject, QPoint, QRect, QSize
+from PySide6.QtWidgets import (
+    QApplication,
+    QHBoxLayout,
+    QLabel,
+    QLayout,
+    QLayoutItem,
+    QPushButton,
+    QScrollArea,
+    QSizePolicy,
+    QVBoxLayout,
+    QWidget
+)
+
+from tag_chips import TagChipView
+
+
+class LegacyFlowLayout(QLayout):
+    """ The flow layout the chips were laid out in before `TagChipView'. """
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self._item_list = []
+        if parent is not None:
+            self.setContentsMargins(QMargins(0, 0, 0, 0))
+
+    def __del__(self) -> None:
+        item = self.takeAt(0)
+        while item:
+            item = self.takeAt(0)
+
+    def addItem(self, item) -> None:
+        self._item_list.append(item)
+
+    def count(self) -> int:
+        return len(self._item_list)
+
+    def itemAt(self, index: int) -> QLayoutItem:
+        if 0 <= index < len(self._item_list):
+            return self._item_list[index]
+        return None
+
+    def takeAt(self, index: int) -> QLayoutItem:
+        if 0 <= index < len(self._item_list):
+            return self._item_list.pop(index)
+        return None
+
+    def expandingDirections(self) -> Qt.Orientation:
+        return Qt.Orientation(0)
+
+    def hasHeightForWidth(self) -> bool:
+        return True
+
+    def heightForWidth(self, width) -> int:
+        height = self._do_layout(QRect(0, 0, width, 0), True)
+        return height
+
+    def setGeometry(self, rect) -> None:
+        super().setGeometry(rect)
+        self._do_layout(rect, False)
+
+    def sizeHint(self) -> QSize:
+        return self.minimumSize()
+
+    def minimumSize(self) -> QSize:
+        size = QSize()
+
+        for item in self._item_list:
+            size = size.expandedTo(item.minimumSize())
+
+        size += QSize(2 * self.contentsMargins().top(),
+                      2 * self.contentsMargins().top())
+        return size
+
+    def _do_layout(self, rect: QRect, test_only: bool) -> int:
+        x = rect.x()
+        y = rect.y()
+        line_height = 0
+        spacing = self.spacing()
+
+        for item in self._item_list:
+            style = item.widget().style()
+            layout_spacing_x = style.layoutSpacing(
+                QSizePolicy.PushButton,
+                QSizePolicy.PushButton,
+                Qt.Orientation.Horizontal
+            )
+            layout_spacing_y = style.layoutSpacing(
+                QSizePolicy.PushButton, QSizePolicy.PushButton, Qt.Vertical
+            )
+            space_x = spacing + layout_spacing_x
+            space_y = spacing + layout_spacing_y
+            next_x = x + item.sizeHint().width() + space_x
+            if next_x - space_x > rect.right() and line_height > 0:
+                x = rect.x()
+                y = y + line_height + space_y
+                next_x = x + item.sizeHint().width() + space_x
+                line_height = 0
+
+            if not test_only:
+                item.setGeometry(QRect(QPoint(x, y), item.sizeHint()))
+
+            x = next_x
+            line_height = max(line_height, item.sizeHint().height())
+
+        return y + line_height - rect.y()
+
+
+class LegacyChips(QScrollArea):
+    def __init__(self) -> None:
+        super().__init__()
+        self.setWidgetResizable(True)
+        self.scroll_widget = QWidget(self)
+        self.scroll_layout = LegacyFlowLayout(self.scroll_widget)
+        self.setWidget(self.scroll_widget)
+
+    def set_tags(self, tags: list[str]) -> None:
+        for i in reversed(range(self.scroll_layout.count())):
+            widget = self.scroll_layout.itemAt(i).widget()
+            if widget:
+                widget.deleteLater()
+        for tag in tags:
+            tag_layout = QHBoxLayout()
+            tag_layout.addWidget(QLabel(tag))
+            delete_button = QPushButton("X")
+            delete_button.setFixedSize(20, 20)
+            delete_button.setStyleSheet("""
+              QPushButton {
+                border: 1px solid black;
+                border-radius: 5px;
+              }
+              QPushButton:hover {
+                background-color: dimgray
+              }
+              QPushButton:pressed {
+                background-color: white
+              }
+            """)
+            tag_layout.addWidget(delete_button)
+            tag_container = QWidget()
+            tag_container.setLayout(tag_layout)
+            tag_container.setStyleSheet("""
+                background-color: gray;
+                color:            black;
+                border-radius:    10px;
+            """)
+            self.scroll_layout.addWidget(tag_container)
+
+
+def run(app: QApplication, view: QWidget, tags: list[str], edits: int) -> None:
+    window = QWidget()
+    QVBoxLayout(window).addWidget(view)
+    window.resize(600, 400)
+    window.show()
+
+    start = time.perf_counter()
+    view.set_tags(tags)
+    app.processEvents()
+    initial = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(edits):
+        view.set_tags([*tags, f'new tag {i}'])
+        app.processEvents()
+        view.set_tags(tags)
+        app.processEvents()
+    edit = (time.perf_counter() - start) / (2 * edits)
+
+    objects = len(window.findChildren(QObject))
+    print(f'{type(view).__name__:>12}, {len(tags):5} tags: '
+          f'show {initial * 1000:8.1f} ms, '
+          f'edit {edit * 1000:8.2f} ms, {objects} QObjects')
+    window.close()
+    window.deleteLater()
+    app.processEvents()
+
+
+def resize(
+        app: QApplication,
+        view: QWidget,
+        tags: list[str],
+        widths: list[int],
+        rounds: int
+) -> None:
+    """ Time relaying out `tags' in `view' at each of `widths'. """
+    window = QWidget()
+    QVBoxLayout(window).addWidget(view)
+    window.resize(widths[-1], 400)
+    window.show()
+    view.set_tags(tags)
+    app.processEvents()
+
+    timings = []
+    for width in widths:
+        start = time.perf_counter()
+        for i in range(rounds):
+            # Alternate with a neighbouring width so each round relays out.
+            window.resize(width + i % 2, 400)
+            app.processEvents()
+        timings.append((time.perf_counter() - start) / rounds)
+
+    print(f'{type(view).__name__:>12}, {len(tags):5} tags, resize: '
+          + ', '.join(f'{width} px {seconds * 1000:.1f} ms'
+                      for width, seconds in zip(widths, timings)))
+    window.close()
+    window.deleteLater()
+    app.processEvents()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tags', type=int, default=200)
+    parser.add_argument('--edits', type=int, default=5)
+    parser.add_argument('--many', type=int, default=5000,
+                        help='tags for a second run of the chip view alone, '
+                             'the widgets take minutes at this scale')
+    parser.add_argument('--resize-tags', type=int, default=1000)
+    parser.add_argument('--widths', default='300,600,900,1200',
+                        help='comma separated window widths to resize to')
+    parser.add_argument('--rounds', type=int, default=10,
+                        help='resizes timed at each width')
+    args = parser.parse_args()
+    widths = [int(width) for width in args.widths.split(',')]
+
+    app = QApplication([])
+    tags = [f'tag number {i * 7919 % 10007}' for i in range(args.many)]
+    run(app, LegacyChips(), tags[:args.tags], args.edits)
+    run(app, TagChipView("X"), tags[:args.tags], args.edits * 20)
+    run(app, TagChipView("X"), tags, args.edits * 20)
+    resize_tags = tags[:args.resize_tags]
+    resize(app, LegacyChips(), resize_tags, widths, args.rounds)
+    resize(app, TagChipView("X"), resize_tags, widths, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
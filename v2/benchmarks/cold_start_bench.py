@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# Benchmark of tagger cold starts under different ONNX Runtime settings.
+#
+# Each combination of thread counts and graph optimization level is run in a
+# fresh process, which loads the model, optionally warms it up, then tags an
+# image: the time to those first tags is what a user waits for after
+# starting the app.  The same image is then tagged a few more times for the
+# steady state time per image.  Runs with the optimized graph cache read a
+# graph cached by a previous run (one is made first if needed), runs
+# without it optimize the graph again.
+#
+# Usage (from `v2/'): python3 -m benchmarks.cold_start_bench IMAGE
+#                         [-m MODEL] [--intra-op-threads 0,1,4]
+#                         [--inter-op-threads 0] [--graph-optimization all]
+import argparse
+import itertools
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+def child(config: dict) -> dict:
+    """ One cold start, in a fresh process. """
+    start = time.perf_counter()
+    from tagger.tagger import Tagger
+    imported = time.perf_counter()
+    tagger = Tagger(
+        config['model'],
+        use_cpu=config['cpu'],
+        intra_op_threads=config['intra_op_threads'],
+        inter_op_threads=config['inter_op_threads'],
+        graph_optimization=config['graph_optimization'],
+        cache_optimized_model=config['cache']
+    )
+    interrogator = tagger.interrogator
+    interrogator.load()
+    loaded = time.perf_counter()
+    if config['warm_up']:
+        interrogator.warm_up()
+    warm = time.perf_counter()
+    tagger.tag_image(config['image'])
+    first = time.perf_counter()
+    steady = []
+    for _ in range(config['repeat']):
+        begin = time.perf_counter()
+        tagger.tag_image(config['image'])
+        steady.append(time.perf_counter() - begin)
+    return {
+        'import': imported - start,
+        'load': loaded - imported,
+        'session': interrogator.load_timings['session'],
+        'warm_up': warm - loaded,
+        'first_tags': first - warm,
+        'steady': statistics.median(steady) if steady else None
+    }
+
+
+def run_child(config: dict) -> dict:
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.cold_start_bench',
+         '--child', json.dumps(config)],
+        stdout=subprocess.PIPE, check=True, text=True
+    )
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    # Including the interpreter's own start up.
+    result['process'] = time.perf_counter() - start
+    return result
+
+
+def integers(text: str) -> list[int]:
+    return [int(value) for value in text.split(',')]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('image', nargs='?')
+    parser.add_argument('-m', '--model', default='wd14-convnextv2.v1')
+    parser.add_argument('--cpu', action='store_true',
+                        help='only use the CPU execution provider')
+    parser.add_argument('--intra-op-threads', type=integers, default=[0],
+                        help='comma separated counts to try, 0 for the '
+                             'default')
+    parser.add_argument('--inter-op-threads', type=integers, default=[0])
+    parser.add_argument('--graph-optimization', default='all',
+                        help='comma separated levels to try')
+    parser.add_argument('--no-warm-up', action='store_true')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='images tagged after the first, for the steady '
+                             'state')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(child(json.loads(args.child))))
+        return
+    if args.image is None:
+        parser.error('an image to tag is required')
+
+    print(f'{"intra":>5} {"inter":>5} {"graph":>8} {"cache":>5}  '
+          f'{"process":>8} {"load":>7} {"session":>7} {"warm-up":>7} '
+          f'{"first":>7} {"steady":>7}')
+    for intra, inter, level, cache in itertools.product(
+            args.intra_op_threads,
+            args.inter_op_threads,
+            args.graph_optimization.split(','),
+            (False, True)):
+        if cache and level == 'disable':
+            # Nothing is optimized, so nothing is cached.
+            continue
+        config = {
+            'model': args.model,
+            'cpu': args.cpu,
+            'image': args.image,
+            'intra_op_threads': intra,
+            'inter_op_threads': inter,
+            'graph_optimization': level,
+            'cache': cache,
+            'warm_up': not args.no_warm_up,
+            'repeat': args.repeat
+        }
+        if cache:
+            # Make sure the graph is cached, by a run which is not timed.
+            run_child({**config, 'repeat': 0})
+        r = run_child(config)
+        print(f'{intra:>5} {inter:>5} {level:>8} {"yes" if cache else "no":>5}'
+              f'  {r["process"]:7.2f}s {r["load"]:6.2f}s '
+              f'{r["session"]:6.2f}s {r["warm_up"]:6.2f}s '
+              f'{r["first_tags"]:6.2f}s '
+              f'{r["steady"] * 1000 if r["steady"] else 0:5.0f}ms')
+
+
+if __name__ == '__main__':
+    main()
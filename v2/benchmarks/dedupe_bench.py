@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# Benchmark of near duplicate detection.
+#
+# Search: N random 64 bit hashes with planted near duplicates, every pair
+# within distance k found by multi-index hashing (`dedupe.hamming_pairs')
+# against comparing all pairs, which is checked to find the same pairs on a
+# subset and extrapolated (it is quadratic) to N.
+#
+# Hashing, given a directory of images: reduced size decodes against full
+# decodes, then a pool of worker processes against a single one.
+#
+# Usage (from `v2/'): python3 -m benchmarks.dedupe_bench [--hashes N]
+#                         [--distance K] [--images DIR] [--workers J]
+import argparse
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from dedupe import hamming_pairs, popcount
+from image_hash import dhash, hash_files, open_reduced, phash
+
+
+def planted_hashes(n: int, rng: np.random.Generator) -> np.ndarray:
+    """ Random hashes, a tenth copies of others with a few bits flipped. """
+    hashes = rng.integers(0, 2 ** 63, size=n, dtype=np.int64).view(np.uint64)
+    hashes = hashes * np.uint64(2) + rng.integers(0, 2, n).astype(np.uint64)
+    copies = rng.choice(n, n // 10, replace=False)
+    sources = rng.integers(0, n, n // 10)
+    for copy, source in zip(copies, sources):
+        flips = rng.choice(64, rng.integers(1, 9), replace=False)
+        mask = sum(1 << int(bit) for bit in flips)
+        hashes[copy] = hashes[source] ^ np.uint64(mask)
+    return np.unique(hashes)
+
+
+def all_pairs(hashes: np.ndarray, distance: int) -> np.ndarray:
+    found = []
+    for i in range(len(hashes) - 1):
+        j = np.flatnonzero(popcount(hashes[i] ^ hashes[i + 1:]) <= distance)
+        found.append(np.stack([np.full(len(j), i), i + 1 + j], axis=1))
+    return np.concatenate(found)
+
+
+def bench_search(n: int, subset: int, distance: int) -> None:
+    hashes = planted_hashes(n, np.random.default_rng(0))
+    sample = hashes[:subset]
+    start = time.perf_counter()
+    expected = all_pairs(sample, distance)
+    brute = time.perf_counter() - start
+    assert np.array_equal(hamming_pairs(sample, distance), expected), \
+        'pairs differ'
+
+    start = time.perf_counter()
+    pairs = hamming_pairs(hashes, distance)
+    indexed = time.perf_counter() - start
+    estimate = brute * (len(hashes) / len(sample)) ** 2
+    print(f'{len(hashes)} hashes, distance {distance}: {len(pairs)} pairs')
+    print(f'  all pairs: {brute:8.2f} s for {len(sample)}, '
+          f'~{estimate:.0f} s for {len(hashes)}')
+    print(f'  indexed:   {indexed:8.2f} s')
+
+
+def full_decode_hashes(path: str) -> tuple[int, int]:
+    with Image.open(path) as image:
+        image = image.convert('L')
+    return dhash(image), phash(image)
+
+
+def bench_hashing(directory: str, files: int, workers: int) -> None:
+    names = sorted(
+        name for name in os.listdir(directory)
+        if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp'))
+    )[:files]
+    paths = [os.path.join(directory, name) for name in names]
+
+    start = time.perf_counter()
+    for path in paths:
+        full_decode_hashes(path)
+    full = time.perf_counter() - start
+    start = time.perf_counter()
+    for path in paths:
+        image = open_reduced(path)
+        dhash(image), phash(image)
+    reduced = time.perf_counter() - start
+    print(f'{len(paths)} images: full decode {full / len(paths) * 1000:.2f} '
+          f'ms, reduced decode {reduced / len(paths) * 1000:.2f} ms each')
+
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    chunks = [names[i:i + 128] for i in range(0, len(names), 128)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn')) as pool:
+        list(pool.map(hash_files, [directory] * len(chunks), chunks))
+    pooled = time.perf_counter() - start
+    print(f'  {workers} processes: {pooled:.2f} s including start up, '
+          f'{reduced:.2f} s in one ({os.cpu_count()} CPUs)')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hashes', type=int, default=100000)
+    parser.add_argument('--subset', type=int, default=10000,
+                        help='hashes compared all pairwise')
+    parser.add_argument('--distance', type=int, default=6)
+    parser.add_argument('--images', default=None,
+                        help='directory of images to time hashing on')
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    bench_search(args.hashes, args.subset, args.distance)
+    if args.images:
+        bench_hashing(args.images, args.files, args.workers)
+
+
+if __name__ == '__main__':
+    main()
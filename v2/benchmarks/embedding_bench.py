@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# Benchmark of similar image search over tagger embeddings.
+#
+# N synthetic embeddings in clusters, like images of a dataset sharing
+# subjects, are added to an `EmbeddingIndex' in batches the way the bulk
+# tagger adds them, then the index is trained.  Queries are answered by the
+# IVF lists (`EmbeddingIndex.search') and by scoring every vector of the
+# memory-mapped matrix, which also gives the recall of the former.
+#
+# Usage (from `v2/'): python3 -m benchmarks.embedding_bench [--images N]
+#                         [--dimension D] [--queries Q] [--nprobe P]
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from tagger.embeddings import EmbeddingIndex
+
+
+def clustered(
+        n: int,
+        centres: np.ndarray,
+        projection: np.ndarray,
+        rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Points around random `centres' of a latent space of few dimensions,
+    projected to the embedding's: real embeddings vary along far fewer
+    directions than they have, and isotropic noise in all of them would make
+    every point of a cluster about as near as the others.
+    """
+    latent = centres[rng.integers(0, len(centres), n)]
+    latent = latent + 0.5 * rng.normal(size=latent.shape)
+    noise = rng.normal(size=(n, projection.shape[1]))
+    return (latent @ projection + 0.1 * noise).astype(np.float32)
+
+
+def exact_search(index: EmbeddingIndex, query: np.ndarray, k: int) -> list:
+    """ Every live vector scored, as a search without lists does it. """
+    vectors = index.vectors()
+    query = query / np.linalg.norm(query)
+    scores = np.concatenate([
+        vectors[i:i + index.CHUNK_ROWS].astype(np.float32) @ query
+        for i in range(0, len(vectors), index.CHUNK_ROWS)
+    ])
+    scores[~index.alive] = -np.inf
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [index.names[row] for row in top.tolist()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=200000)
+    parser.add_argument('--dimension', type=int, default=1024)
+    parser.add_argument('--clusters', type=int, default=2000,
+                        help='subjects the synthetic images are drawn from')
+    parser.add_argument('--latent', type=int, default=32,
+                        help='dimensions the synthetic images vary along')
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--nprobe', type=int, default=EmbeddingIndex.NPROBE)
+    parser.add_argument('--batch', type=int, default=4096,
+                        help='embeddings generated and added at once')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centres = rng.normal(size=(args.clusters, args.latent))
+    projection = rng.normal(size=(args.latent, args.dimension))
+    projection /= np.sqrt(args.latent)
+    with tempfile.TemporaryDirectory() as directory:
+        index = EmbeddingIndex(directory)
+        queries = []
+        start = time.perf_counter()
+        for first in range(0, args.images, args.batch):
+            count = min(args.batch, args.images - first)
+            vectors = clustered(count, centres, projection, rng)
+            index.add(
+                [f'{i:07}.jpg' for i in range(first, first + count)],
+                [(i, i) for i in range(first, first + count)],
+                vectors
+            )
+            queries.append(vectors[:max(1, args.queries * count
+                                        // args.images)])
+        index.save()
+        added = time.perf_counter() - start
+        start = time.perf_counter()
+        index.train()
+        trained = time.perf_counter() - start
+        print(f'{len(index)} embeddings of {args.dimension} dimensions: '
+              f'added in {added:.1f} s, trained {len(index.centroids)} '
+              f'lists in {trained:.1f} s')
+
+        start = time.perf_counter()
+        index = EmbeddingIndex.open(directory)
+        opened = time.perf_counter() - start
+        print(f'  opened in {opened * 1000:.0f} ms')
+
+        queries = np.concatenate(queries)[:args.queries]
+        # Fault the vectors in once, so both searches read from memory.
+        exact_search(index, queries[0], args.k)
+        ivf_time = exact_time = 0.0
+        hits = 0
+        for query in queries:
+            start = time.perf_counter()
+            found = index.search(query, args.k, args.nprobe)
+            ivf_time += time.perf_counter() - start
+            start = time.perf_counter()
+            expected = exact_search(index, query, args.k)
+            exact_time += time.perf_counter() - start
+            hits += len({name for name, _ in found} & set(expected))
+        print(f'  exact scan: {exact_time / len(queries) * 1000:7.1f} ms '
+              f'per query')
+        print(f'  IVF, nprobe {args.nprobe}: '
+              f'{ivf_time / len(queries) * 1000:7.1f} ms per query, '
+              f'recall@{args.k} {hits / (len(queries) * args.k):.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# Benchmark of ensemble tagging against its models run one after another.
+#
+# The same images are tagged by each model alone, with the whole thread
+# budget, and then by the ensemble of them, which decodes each image once,
+# shares tensors between models preprocessing alike and runs the models
+# concurrently with a share of the budget each.  Each model is loaded and
+# warmed up before it is timed.
+#
+# Usage (from `v2/'): python3 -m benchmarks.ensemble_bench IMAGE_DIR
+#                         -m MODEL -m MODEL [--merge mean] [--threads 0]
+#                         [--images 64]
+import argparse
+import time
+from pathlib import Path
+
+from tagger.bulk import find_images
+from tagger.ensemble import MERGE_RULES
+from tagger.interrogators import interrogators
+from tagger.tagger import Tagger
+
+
+def timed(tagger: Tagger, paths: list[Path], batch_size: int) -> float:
+    """ Seconds per image tagging `paths' after loading and warming up. """
+    tagger.interrogator.load()
+    tagger.interrogator.warm_up()
+    start = time.perf_counter()
+    tagger.tag_images(paths, batch_size=batch_size)
+    return (time.perf_counter() - start) / len(paths)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('images', type=Path)
+    parser.add_argument('-m', '--model', action='append', required=True,
+                        choices=sorted(interrogators))
+    parser.add_argument('--merge', choices=MERGE_RULES, default='mean')
+    parser.add_argument('--cpu', action='store_true',
+                        help='only use the CPU execution provider')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='intra-op thread budget, 0 for one per core')
+    parser.add_argument('--images', dest='count', type=int, default=64)
+    parser.add_argument('-b', '--batch-size', type=int, default=8)
+    args = parser.parse_args()
+    if len(args.model) < 2:
+        parser.error('an ensemble needs at least two models')
+
+    paths = list(find_images(args.images))[:args.count]
+    if not paths:
+        parser.error(f'no images in {args.images}')
+    options = {'use_cpu': args.cpu, 'intra_op_threads': args.threads}
+    alone = {}
+    for model in args.model:
+        alone[model] = timed(Tagger(model, **options), paths, args.batch_size)
+        # Loaded again by the ensemble, with its share of the threads.
+        interrogators[model].unload()
+    ensemble = timed(
+        Tagger(args.model, merge_rule=args.merge, **options),
+        paths, args.batch_size
+    )
+
+    print(f'{len(paths)} images, ms per image:')
+    for model, seconds in alone.items():
+        print(f'  {model:>40} {seconds * 1000:8.1f}')
+    print(f'  {"one after another":>40} '
+          f'{sum(alone.values()) * 1000:8.1f}')
+    print(f'  {"ensemble (" + args.merge + ")":>40} {ensemble * 1000:8.1f}')
+
+
+if __name__ == '__main__':
+    main()
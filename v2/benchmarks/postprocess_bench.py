@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Microbenchmark of per-image tag post-processing.
+#
+# Compares the previous pandas/dict based path (copy the tag table, build a
+# dict over the whole vocabulary, sort it, filter against a list of excludes)
+# with `Interrogator.postprocess_confidences', and times the redundancy filter
+# of `tagger/tag_groups.json' on top.  No model is needed; labels and
+# confidences are synthetic but sized like the WD14 taggers, with the tags of
+# the bundled tag groups among them.
+#
+# Usage (from `v2/'): python3 -m benchmarks.postprocess_bench [--tags N]
+import argparse
+import timeit
+
+import numpy as np
+
+from tagger.interrogator import Interrogator, WaifuDiffusionInterrogator
+from tagger.tag_groups import TagGroups
+from tagger.tagger import add_escaped_tags
+
+
+def legacy(table, confidences, excludes) -> dict:
+    tags = table[:][['name']]
+    tags['confidents'] = confidences
+    tags = dict(tags[4:].values)
+    return Interrogator.postprocess_tags(
+        tags,
+        threshold=0.35,
+        escape_tag=True,
+        replace_underscore=True,
+        exclude_tags=excludes
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tags', type=int, default=10_000)
+    parser.add_argument('--excludes', type=int, default=30)
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args()
+
+    import pandas as pd  # Only needed to reproduce the old code path.
+    rng = np.random.default_rng(0)
+    names = [f'tag_{i}' for i in range(args.tags)]
+    groups = TagGroups.load()
+    grouped = [
+        tag.replace(' ', '_') for _, tags, _ in groups.groups for tag in tags
+    ]
+    names[-len(grouped):] = grouped
+    table = pd.DataFrame({'name': names, 'category': 0})
+    confidences = (rng.random(args.tags) ** 60).astype(np.float32)
+
+    interrogator = WaifuDiffusionInterrogator('bench', repo_id='')
+    interrogator.set_labels(names, rating_count=4)
+
+    # The GUI passes the current tags as a list, with escaped variants added.
+    excludes = list(add_escaped_tags(
+        [f'tag {i}' for i in range(4, 4 + args.excludes)]
+    ))
+
+    redundancy = groups.compile(interrogator.tag_names)
+    # An image already tagged with a hair colour and a background.
+    have = ['blue hair', 'white background', *sorted(excludes)[:10]]
+
+    old = legacy(table, confidences, excludes)
+    new = interrogator.postprocess_confidences(
+        confidences,
+        threshold=0.35,
+        escape_tag=True,
+        replace_underscore=True,
+        exclude_tags=excludes
+    )
+    assert list(old) == list(new), 'results differ'
+
+    for label, fn in (
+        ('pandas + dict', lambda: legacy(table, confidences, excludes)),
+        ('vectorized', lambda: interrogator.postprocess_confidences(
+            confidences,
+            threshold=0.35,
+            escape_tag=True,
+            replace_underscore=True,
+            exclude_tags=excludes
+        )),
+        ('+ redundancy', lambda: interrogator.postprocess_confidences(
+            confidences,
+            threshold=0.35,
+            escape_tag=True,
+            replace_underscore=True,
+            exclude_tags=excludes,
+            exclude_mask=redundancy.exclusion_mask(
+                have, confidences[4:], 0.35
+            )
+        )),
+    ):
+        seconds = min(timeit.repeat(fn, number=args.number, repeat=5))
+        print(f'{label:>14}: {seconds / args.number * 1e6:9.1f} us/image')
+    print(f'{len(new)} of {args.tags - 4} tags kept')
+
+
+if __name__ == '__main__':
+    main()
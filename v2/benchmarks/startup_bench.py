@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Measures GUI startup: time spent importing `main.py' and time until the
+# main window is first painted.  Models load in the background and are not
+# part of either number.
+#
+# Usage (from `v2/'): python3 -m benchmarks.startup_bench [--runs N]
+#                         [--max-imports MS] [--max-first-paint MS]
+# Exits non-zero when a budget is exceeded, so it can guard against
+# regressions such as a heavy module being imported eagerly again.
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+TIMING_PATTERN = re.compile(
+    r'startup: imports ([\d.]+) ms, first paint ([\d.]+) ms'
+)
+
+
+def measure(main: Path, env: dict) -> tuple[float, float]:
+    result = subprocess.run(
+        [sys.executable, str(main)],
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120
+    )
+    match = TIMING_PATTERN.search(result.stderr)
+    if match is None:
+        raise RuntimeError(f'no timing reported:\n{result.stderr}')
+    return float(match.group(1)), float(match.group(2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-imports', type=float, default=None,
+                        help='fail if the median import time exceeds this (ms)')
+    parser.add_argument('--max-first-paint', type=float, default=None,
+                        help='fail if the median first paint exceeds this (ms)')
+    args = parser.parse_args()
+
+    main_path = Path(__file__).resolve().parent.parent / 'main.py'
+    env = dict(os.environ, TAGGUI_STARTUP_TIMING='exit')
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    imports, paints = zip(*(measure(main_path, env) for _ in range(args.runs)))
+    median_imports = statistics.median(imports)
+    median_paint = statistics.median(paints)
+    print(f'imports:     {median_imports:8.1f} ms (median of {args.runs})')
+    print(f'first paint: {median_paint:8.1f} ms (median of {args.runs})')
+
+    failed = False
+    if args.max_imports is not None and median_imports > args.max_imports:
+        print(f'imports exceed budget of {args.max_imports} ms')
+        failed = True
+    if args.max_first_paint is not None and median_paint > args.max_first_paint:
+        print(f'first paint exceeds budget of {args.max_first_paint} ms')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
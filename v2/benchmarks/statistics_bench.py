@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Benchmark of the tag statistics engine.
+#
+# Fills a catalog in a temporary directory with a synthetic dataset, tags
+# drawn from a Zipf-like distribution like real booru tags, then times
+# building the statistics from the catalog, loading them from the disk cache,
+# the queries behind the statistics panel and recommendation ranking, and an
+# incremental update after a save.  Filling the catalog is the slow part.
+#
+# Usage (from `v2/'): python3 -m benchmarks.statistics_bench \
+#     [--images N] [--tags N] [--per-image N]
+import argparse
+import os
+import resource
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from catalog import Catalog, ImageRecord
+from tag_statistics import TagStatistics
+
+
+def fill(catalog: Catalog, images: int, tags: int, per_image: int) -> None:
+    rng = np.random.default_rng(0)
+    weights = 1 / np.arange(1, tags + 1)
+    weights /= weights.sum()
+    names = [f'tag_{i}' for i in range(tags)]
+    chunk = 10_000
+    for start in range(0, images, chunk):
+        records = []
+        for i in range(start, min(start + chunk, images)):
+            count = rng.integers(per_image // 2, per_image * 3 // 2 + 1)
+            drawn = np.unique(rng.choice(tags, count, p=weights))
+            records.append(ImageRecord(
+                f'{i:07d}.jpg', (1, 1), (1, None), None,
+                [names[t] for t in drawn], None
+            ))
+        with catalog._lock, catalog._db:
+            catalog._write(records)
+
+
+def timed(label: str, fn, number: int = 1):
+    start = time.perf_counter()
+    for _ in range(number):
+        result = fn()
+    seconds = (time.perf_counter() - start) / number
+    print(f'{label:>24}: {seconds * 1000:9.1f} ms')
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=200_000)
+    parser.add_argument('--tags', type=int, default=15_000)
+    parser.add_argument('--per-image', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        catalog = Catalog(root, os.path.join(root, 'catalog.sqlite'))
+        start = time.perf_counter()
+        fill(catalog, args.images, args.tags, args.per_image)
+        print(f'filled catalog in {time.perf_counter() - start:.1f} s')
+
+        stats = timed('build from catalog',
+                      lambda: TagStatistics.from_catalog(catalog))
+        print(f'{stats.image_count} images, {len(stats.vocabulary)} tags, '
+              f'{stats.matrix.nnz} tag assignments')
+        cache_path = Path(root) / 'statistics.npz'
+        timed('save cache', lambda: stats.save(cache_path))
+        timed('load cache', lambda: TagStatistics.load(cache_path))
+
+        counts = timed('tag counts', stats.tag_counts)
+        common, rare = counts[0][0], counts[-1][0]
+        stats.csc()
+        timed('co-occurring, common', lambda: stats.cooccurring(common, 500),
+              number=10)
+        timed('co-occurring, rare', lambda: stats.cooccurring(rare, 500),
+              number=10)
+        given = [tag for tag, _ in counts[:20]]
+        candidates = [tag for tag, _ in counts[100:150]]
+        timed('rank 50 suggestions', lambda: stats.rank(given, candidates),
+              number=10)
+        timed('update one image',
+              lambda: stats.update_image('0000000.jpg', given))
+        catalog.close()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'peak memory {peak:.0f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+import os
+import sys
+import json
+import time
+import hashlib
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Iterator, TextIO
+
+from util import IMAGE_EXTENSIONS, atomic_write_text, split_tags
+
+
+class TagOperation():
+    """ An edit applied to the tag list of every sidecar. """
+    def may_change(self, text: str) -> bool:
+        """
+        Cheap test on the raw sidecar text, False means `apply' would leave
+        the tags untouched so the file does not need to be parsed.
+        """
+        return True
+
+    def apply(self, tags: list[str]) -> list[str]:
+        raise NotImplementedError
+
+
+class Rename(TagOperation):
+    def __init__(self, old: str, new: str) -> None:
+        self.old = old
+        self.new = new
+
+    def may_change(self, text: str) -> bool:
+        return self.old in text
+
+    def apply(self, tags: list[str]) -> list[str]:
+        if self.old not in tags:
+            return tags
+        renamed = []
+        for tag in tags:
+            tag = self.new if tag == self.old else tag
+            # Renaming onto an existing tag merges the two.
+            if tag not in renamed:
+                renamed.append(tag)
+        return renamed
+
+    def __str__(self) -> str:
+        return f'rename {self.old!r} to {self.new!r}'
+
+
+class Delete(TagOperation):
+    def __init__(self, tag: str) -> None:
+        self.tag = tag
+
+    def may_change(self, text: str) -> bool:
+        return self.tag in text
+
+    def apply(self, tags: list[str]) -> list[str]:
+        if self.tag not in tags:
+            return tags
+        return [tag for tag in tags if tag != self.tag]
+
+    def __str__(self) -> str:
+        return f'delete {self.tag!r}'
+
+
+class AddIf(TagOperation):
+    """ Append `tag' to sidecars having all of `required', or to all. """
+    def __init__(self, tag: str, required: Iterable[str] = ()) -> None:
+        self.tag = tag
+        self.required = list(required)
+
+    def may_change(self, text: str) -> bool:
+        return all(tag in text for tag in self.required)
+
+    def apply(self, tags: list[str]) -> list[str]:
+        if self.tag in tags or not all(t in tags for t in self.required):
+            return tags
+        return [*tags, self.tag]
+
+    def __str__(self) -> str:
+        if not self.required:
+            return f'add {self.tag!r}'
+        return f'add {self.tag!r} if {", ".join(map(repr, self.required))}'
+
+
+class MoveToFront(TagOperation):
+    def __init__(self, tag: str) -> None:
+        self.tag = tag
+
+    def may_change(self, text: str) -> bool:
+        return self.tag in text
+
+    def apply(self, tags: list[str]) -> list[str]:
+        if not tags or tags[0] == self.tag or self.tag not in tags:
+            return tags
+        return [self.tag, *(tag for tag in tags if tag != self.tag)]
+
+    def __str__(self) -> str:
+        return f'move {self.tag!r} to the front'
+
+
+def find_sidecars(root: str, recursive: bool = False) -> Iterator[str]:
+    """ `.txt' files under `root' which belong to an image. """
+    try:
+        with os.scandir(root) as it:
+            entries = list(it)
+    except OSError as e:
+        print(f'Skipping {root}: {e}', file=sys.stderr)
+        return
+    images = {
+        os.path.splitext(entry.name)[0]
+        for entry in entries
+        if entry.name.lower().endswith(IMAGE_EXTENSIONS)
+    }
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if recursive and not entry.name.startswith('.'):
+                yield from find_sidecars(entry.path, recursive)
+        elif (entry.name.endswith('.txt')
+                and entry.name[:-len('.txt')] in images):
+            yield entry.path
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+class Change():
+    def __init__(
+            self,
+            path: str,
+            before: str,
+            tags_before: list[str],
+            tags_after: list[str]
+    ) -> None:
+        self.path = path
+        self.before = before
+        self.after = ', '.join(tags_after)
+        self.added = set(tags_after).difference(tags_before)
+        self.removed = set(tags_before).difference(tags_after)
+
+
+class Summary():
+    """ What a run changed, or would change for a dry run. """
+    # Changed files kept as examples for the dry run report.
+    EXAMPLES = 10
+
+    def __init__(self) -> None:
+        self.scanned = 0
+        self.changed = 0
+        self.failed = 0
+        self.added: Counter[str] = Counter()
+        self.removed: Counter[str] = Counter()
+        self.examples: list[Change] = []
+
+    def record(self, change: Change) -> None:
+        self.changed += 1
+        self.added.update(change.added)
+        self.removed.update(change.removed)
+        if len(self.examples) < self.EXAMPLES:
+            self.examples.append(change)
+
+    def report(self, out: TextIO = sys.stdout, root: str = '') -> None:
+        for change in self.examples:
+            print(f'{os.path.relpath(change.path, root or None)}:', file=out)
+            before = change.before.rstrip('\n')
+            print(f'  - {before}', file=out)
+            print(f'  + {change.after}', file=out)
+        for tag, count in self.removed.most_common():
+            print(f'-{count}\t{tag}', file=out)
+        for tag, count in self.added.most_common():
+            print(f'+{count}\t{tag}', file=out)
+        print(f'{self.changed} of {self.scanned} sidecars changed'
+              + (f', {self.failed} failed' if self.failed else ''), file=out)
+
+
+class BulkTagEditor():
+    """
+    Applies tag operations to every sidecar under a root.
+
+    Files are streamed through a thread pool in chunks: workers read and
+    rewrite sidecars, each changed file is replaced atomically.  Before a
+    chunk's files are replaced their previous contents are appended to an
+    undo journal (JSON lines of path, old text and a digest of the new
+    text), so `undo' can revert the batch and skips files edited since.
+    """
+    CHUNK_SIZE = 256
+
+    def __init__(
+            self,
+            root: str,
+            recursive: bool = False,
+            workers: int = 8
+    ) -> None:
+        self.root = root
+        self.recursive = recursive
+        self.workers = max(1, workers)
+
+    @staticmethod
+    def _edit(operations: list[TagOperation], paths: list[str]) -> list:
+        """ Changes for a chunk of sidecars, `(path, error)' on failure. """
+        results = []
+        for path in paths:
+            try:
+                with open(path, 'r') as f:
+                    before = f.read()
+            except (OSError, ValueError) as e:
+                # Undecodable sidecars fail alone, not the whole batch.
+                results.append((path, e))
+                continue
+            if not any(op.may_change(before) for op in operations):
+                results.append(None)
+                continue
+            tags = split_tags(before.replace('\n', ' '))
+            edited = tags
+            for op in operations:
+                edited = op.apply(edited)
+            results.append(
+                Change(path, before, tags, edited) if edited != tags else None
+            )
+        return results
+
+    @staticmethod
+    def _write(changes: list[Change]) -> list[tuple[str, Exception]]:
+        errors = []
+        for change in changes:
+            try:
+                atomic_write_text(change.path, change.after)
+            except OSError as e:
+                errors.append((change.path, e))
+        return errors
+
+    def _chunks(self) -> Iterator[list[str]]:
+        chunk = []
+        for path in find_sidecars(self.root, self.recursive):
+            chunk.append(path)
+            if len(chunk) >= self.CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def run(
+            self,
+            operations: list[TagOperation],
+            dry_run: bool = False,
+            journal_path: str = None
+    ) -> Summary:
+        summary = Summary()
+        # Sidecar paths are built by joining onto the root.
+        prefix = os.path.join(self.root, '')
+        writes: list[Future] = []
+        journal = None
+        if not dry_run:
+            journal_path = journal_path or default_journal_path(self.root)
+            os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+            journal = open(journal_path, 'w', encoding='utf-8')
+            journal.write(json.dumps({
+                'root': os.path.abspath(self.root),
+                'operations': [str(op) for op in operations]
+            }) + '\n')
+
+        def collect(edits: Future) -> None:
+            changes = []
+            for result in edits.result():
+                summary.scanned += 1
+                if isinstance(result, tuple):
+                    print(f'Failed to read {result[0]}: {result[1]}',
+                          file=sys.stderr)
+                    summary.failed += 1
+                elif result is not None:
+                    summary.record(result)
+                    changes.append(result)
+            if journal is None or not changes:
+                return
+            for change in changes:
+                journal.write(json.dumps({
+                    'path': change.path[len(prefix):],
+                    'before': change.before,
+                    'after': text_digest(change.after)
+                }) + '\n')
+            # Journal first, so every replaced file can be restored.
+            journal.flush()
+            writes.append(pool.submit(self._write, changes))
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                in_flight: list[Future] = []
+                for chunk in self._chunks():
+                    in_flight.append(pool.submit(self._edit, operations, chunk))
+                    if len(in_flight) >= self.workers * 2:
+                        collect(in_flight.pop(0))
+                while in_flight:
+                    collect(in_flight.pop(0))
+                for future in writes:
+                    for path, error in future.result():
+                        print(f'Failed to write {path}: {error}',
+                              file=sys.stderr)
+                        summary.failed += 1
+        finally:
+            if journal is not None:
+                journal.close()
+                if summary.changed == 0:
+                    os.unlink(journal_path)
+        return summary
+
+
+def default_journal_path(root: str) -> str:
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(root, '.taggui-journal', f'{stamp}.jsonl')
+
+
+def _restore(root: str, entries: list[dict]) -> tuple[int, int]:
+    restored = skipped = 0
+    for entry in entries:
+        path = os.path.join(root, entry['path'])
+        try:
+            with open(path, 'r') as sidecar:
+                current = sidecar.read()
+        except (OSError, ValueError):
+            current = None
+        if current is None or text_digest(current) != entry['after']:
+            print(f'Skipping {path}, changed since', file=sys.stderr)
+            skipped += 1
+            continue
+        try:
+            atomic_write_text(path, entry['before'])
+        except OSError as e:
+            print(f'Failed to restore {path}: {e}', file=sys.stderr)
+            skipped += 1
+            continue
+        restored += 1
+    return restored, skipped
+
+
+def undo(journal_path: str, workers: int = 8) -> tuple[int, int]:
+    """
+    Revert the batch recorded in a journal.  Files whose contents no longer
+    match what the batch wrote are left alone.  Returns the numbers of
+    restored and skipped files, those failing to be written included.
+    """
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        root = json.loads(f.readline())['root']
+        entries = [json.loads(line) for line in f]
+    size = BulkTagEditor.CHUNK_SIZE
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        counts = list(pool.map(
+            lambda i: _restore(root, entries[i:i + size]),
+            range(0, len(entries), size)
+        ))
+    return sum(c[0] for c in counts), sum(c[1] for c in counts)
+
+
+def main(argv: list[str] = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Edit the tags of every .txt sidecar under a directory. '
+                    'Renames run first, then deletions, additions and moves '
+                    'to the front.'
+    )
+    parser.add_argument('root', nargs='?',
+                        help='dataset directory')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='descend into subdirectories')
+    parser.add_argument('--rename', nargs=2, action='append', default=[],
+                        metavar=('OLD', 'NEW'))
+    parser.add_argument('--delete', action='append', default=[],
+                        metavar='TAG')
+    parser.add_argument('--add', action='append', default=[], metavar='TAG',
+                        help='add a tag, only where all --if tags are present')
+    parser.add_argument('--if', dest='required', action='append', default=[],
+                        metavar='TAG')
+    parser.add_argument('--front', action='append', default=[],
+                        metavar='TAG', help='move a tag to the front')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='only report what would change')
+    parser.add_argument('-j', '--workers', type=int, default=8)
+    parser.add_argument('--journal', default=None,
+                        help='undo journal to write (default: '
+                             'ROOT/.taggui-journal/TIMESTAMP.jsonl)')
+    parser.add_argument('--undo', metavar='JOURNAL', default=None,
+                        help='revert the batch recorded in a journal')
+    args = parser.parse_args(argv)
+
+    if args.undo is not None:
+        restored, skipped = undo(args.undo, args.workers)
+        print(f'Restored {restored} sidecars, skipped {skipped}')
+        return
+    if args.root is None:
+        parser.error('a dataset directory is required')
+
+    operations: list[TagOperation] = []
+    operations += [Rename(old, new) for old, new in args.rename]
+    operations += [Delete(tag) for tag in args.delete]
+    operations += [AddIf(tag, args.required) for tag in args.add]
+    operations += [MoveToFront(tag) for tag in args.front]
+    if not operations:
+        parser.error('no operation given')
+
+    editor = BulkTagEditor(args.root, args.recursive, args.workers)
+    summary = editor.run(operations, args.dry_run, args.journal)
+    summary.report(root=args.root)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,513 @@
+import os
+import sys
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+
+import imagesize
+from PySide6.QtCore import QThread, Signal, QObject
+
+from directory_scanner import IMAGE_EXTENSIONS
+from util import sidecar_paths, read_sidecar, split_tags
+
+CATALOG_NAME = '.taggui.sqlite'
+SCHEMA_VERSION = 2
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    tags_mtime INTEGER,
+    caption_mtime INTEGER,
+    caption TEXT
+);
+CREATE TABLE IF NOT EXISTS tags (
+    image_id INTEGER NOT NULL REFERENCES images (id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (image_id, tag)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tags_by_tag ON tags (tag, image_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hashes (
+    image_id INTEGER PRIMARY KEY REFERENCES images (id) ON DELETE CASCADE,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    dhash INTEGER NOT NULL,
+    phash INTEGER NOT NULL
+);
+'''
+
+
+def catalog_path(root: str) -> str:
+    """
+    The catalog lives in the dataset root, or in the cache directory when
+    the root is not writable.
+    """
+    if os.access(root, os.W_OK):
+        return os.path.join(root, CATALOG_NAME)
+    from tagger.cache import default_cache_dir
+    key = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()
+    directory = default_cache_dir() / 'catalogs'
+    directory.mkdir(parents=True, exist_ok=True)
+    return str(directory / f'{key}.sqlite')
+
+
+class ImageRecord():
+    """ What the catalog knows about one image, read off the GUI thread. """
+    def __init__(
+            self,
+            name: str,
+            stat: tuple[int, int],
+            sidecar_mtimes: tuple[int | None, int | None],
+            dimensions: tuple[int, int] | None,
+            tags: list[str],
+            caption: str | None
+    ) -> None:
+        self.name = name
+        self.stat = stat
+        self.sidecar_mtimes = sidecar_mtimes
+        self.dimensions = dimensions
+        self.tags = tags
+        self.caption = caption
+
+
+def read_record(
+        root: str,
+        name: str,
+        stat: tuple[int, int],
+        sidecar_mtimes: tuple[int | None, int | None],
+        known: tuple | None
+) -> ImageRecord:
+    """
+    Dimensions and sidecars of an image, `known' is its current catalog row
+    (size, mtime, tags mtime, caption mtime, width, height) if any.
+    """
+    path = os.path.join(root, name)
+    tags_path, caption_path = sidecar_paths(path)
+    dimensions = None
+    if known is not None and known[0:2] == stat and known[4] is not None:
+        # Only the sidecars changed, keep the dimensions.
+        dimensions = known[4:6]
+    else:
+        try:
+            dimensions = imagesize.get(path)
+        except (OSError, ValueError):
+            pass
+        if dimensions is not None and dimensions[0] < 0:
+            dimensions = None
+    return ImageRecord(
+        name,
+        stat,
+        sidecar_mtimes,
+        dimensions,
+        split_tags(_read_sidecar(tags_path)) if sidecar_mtimes[0] else [],
+        _read_sidecar(caption_path) if sidecar_mtimes[1] else None
+    )
+
+
+def _read_sidecar(path: str) -> str | None:
+    """
+    `read_sidecar', or None for a sidecar that can not be read or is not
+    UTF-8, which is left out until it changes.
+    """
+    try:
+        return read_sidecar(path)
+    except (OSError, ValueError) as e:
+        print(f'Skipping {path}: {e}', file=sys.stderr)
+        return None
+
+
+def read_records(root: str, jobs: list[tuple]) -> list[ImageRecord]:
+    return [read_record(root, *job) for job in jobs]
+
+
+class Catalog():
+    """
+    SQLite index of the images of a dataset root: size, mtime, dimensions,
+    tags and caption of each.  `sync' brings it up to date with the disk by
+    comparing modification times, only images and sidecars which changed are
+    read again.  `update' records a save directly.  Perceptual hashes of the
+    images are kept too once computed (see `dedupe').
+
+    All methods may be called from any thread.
+    """
+    def __init__(self, root: str, path: str = None) -> None:
+        self.root = root
+        self.path = path or catalog_path(root)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('PRAGMA synchronous = NORMAL')
+        self._db.execute('PRAGMA foreign_keys = ON')
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            # Only derived data is stored, rebuild instead of migrating.
+            self._db.executescript(
+                'DROP TABLE IF EXISTS tags; DROP TABLE IF EXISTS hashes; '
+                'DROP TABLE IF EXISTS images; DROP TABLE IF EXISTS meta;'
+            )
+        self._db.executescript(SCHEMA)
+        self._db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _scan(self) -> dict[str, tuple[int, int]]:
+        """ (size, mtime) of every file in the root, by name. """
+        files = {}
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        st = entry.stat()
+                        files[entry.name] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue
+        return files
+
+    # Below this many images to read the pool costs more than it saves.
+    PARALLEL_THRESHOLD = 1024
+    CHUNK_SIZE = 256
+
+    def sync(
+            self,
+            workers: int = 8,
+            should_stop: Callable[[], bool] = None
+    ) -> int:
+        """
+        Reconcile the catalog with the root, returns the number of images
+        added, changed or removed.  A large import ends early, keeping its
+        progress, once `should_stop' returns True.
+        """
+        files = self._scan()
+        with self._lock:
+            known = {
+                row[0]: row[1:] for row in self._db.execute(
+                    'SELECT name, size, mtime, tags_mtime, caption_mtime, '
+                    'width, height FROM images'
+                )
+            }
+
+        stale = []
+        for name, stat in files.items():
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            base = os.path.splitext(name)[0]
+            tags_stat = files.get(f'{base}.txt')
+            caption_stat = files.get(f'{base}.caption')
+            sidecar_mtimes = (
+                tags_stat and tags_stat[1],
+                caption_stat and caption_stat[1]
+            )
+            row = known.get(name)
+            if row is None or row[0:2] != stat or row[2:4] != sidecar_mtimes:
+                stale.append((name, stat, sidecar_mtimes, row))
+        removed = [
+            name for name in known
+            if name not in files
+        ]
+        if not stale and not removed:
+            return 0
+
+        if removed:
+            self.remove(removed)
+        written = 0
+        if len(stale) >= self.PARALLEL_THRESHOLD and workers > 1:
+            # An initial import is dominated by reading many small files,
+            # overlap the reads and commit chunk by chunk, so progress is
+            # kept and visible to queries while the import runs.
+            size = self.CHUNK_SIZE
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    pool.submit(read_records, self.root, stale[i:i + size])
+                    for i in range(0, len(stale), size)
+                ]
+                for future in futures:
+                    if should_stop is not None and should_stop():
+                        # The next sync picks up the rest.
+                        pool.shutdown(cancel_futures=True)
+                        break
+                    records = future.result()
+                    with self._lock, self._db:
+                        self._write(records)
+                    written += len(records)
+        else:
+            records = read_records(self.root, stale)
+            with self._lock, self._db:
+                self._write(records)
+            written = len(records)
+        return written + len(removed)
+
+    def _bump_generation(self) -> None:
+        self._db.execute(
+            "INSERT INTO meta (key, value) VALUES ('generation', 1) "
+            'ON CONFLICT (key) DO UPDATE SET value = value + 1'
+        )
+
+    def generation(self) -> int:
+        """ Counter increased by every change, to validate derived data. """
+        rows = self._query("SELECT value FROM meta WHERE key = 'generation'")
+        return rows[0][0] if rows else 0
+
+    def _write(self, records: list[ImageRecord]) -> None:
+        self._bump_generation()
+        self._db.executemany(
+            'INSERT INTO images (name, size, mtime, width, height, '
+            'tags_mtime, caption_mtime, caption) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET size = excluded.size, '
+            'mtime = excluded.mtime, width = excluded.width, '
+            'height = excluded.height, tags_mtime = excluded.tags_mtime, '
+            'caption_mtime = excluded.caption_mtime, '
+            'caption = excluded.caption',
+            ((record.name, *record.stat, *(record.dimensions or (None, None)),
+              *record.sidecar_mtimes, record.caption) for record in records)
+        )
+        ids = [
+            self._db.execute(
+                'SELECT id FROM images WHERE name = ?', (record.name,)
+            ).fetchone()[0]
+            for record in records
+        ]
+        self._db.executemany(
+            'DELETE FROM tags WHERE image_id = ?',
+            ((image_id,) for image_id in ids)
+        )
+        self._db.executemany(
+            'INSERT INTO tags (image_id, tag, position) VALUES (?, ?, ?)',
+            (
+                (image_id, tag, i)
+                for image_id, record in zip(ids, records)
+                for i, tag in enumerate(record.tags)
+            )
+        )
+
+    def update(self, name: str) -> None:
+        """ Reread one image and its sidecars, e.g. right after a save. """
+        path = os.path.join(self.root, name)
+        tags_path, caption_path = sidecar_paths(path)
+
+        def stat(path):
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            return st.st_size, st.st_mtime_ns
+
+        image_stat = stat(path)
+        if image_stat is None:
+            self.remove([name])
+            return
+        sidecar_mtimes = tuple(
+            s and s[1] for s in (stat(tags_path), stat(caption_path))
+        )
+        with self._lock:
+            known = self._db.execute(
+                'SELECT size, mtime, tags_mtime, caption_mtime, width, height '
+                'FROM images WHERE name = ?', (name,)
+            ).fetchone()
+        record = read_record(self.root, name, image_stat, sidecar_mtimes, known)
+        with self._lock, self._db:
+            self._write([record])
+
+    def remove(self, names: Iterable[str]) -> None:
+        with self._lock, self._db:
+            self._bump_generation()
+            self._db.executemany(
+                'DELETE FROM images WHERE name = ?',
+                ((name,) for name in names)
+            )
+
+    def _query(self, sql: str, parameters: tuple = ()) -> list:
+        with self._lock:
+            return self._db.execute(sql, parameters).fetchall()
+
+    def tag_postings(self) -> tuple[int, list, list]:
+        """
+        Consistent snapshot for building derived indexes: the generation,
+        `(id, name)' of every image by id, and `(tag, ids)' per tag where ids
+        is a comma separated string of image ids.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT value FROM meta WHERE key = 'generation'"
+            ).fetchall()
+            images = self._db.execute(
+                'SELECT id, name FROM images ORDER BY id'
+            ).fetchall()
+            postings = self._db.execute(
+                'SELECT tag, group_concat(image_id) FROM tags GROUP BY tag'
+            ).fetchall()
+        return rows[0][0] if rows else 0, images, postings
+
+    def image_count(self) -> int:
+        return self._query('SELECT COUNT(*) FROM images')[0][0]
+
+    def tag_counts(self) -> list[tuple[str, int]]:
+        """ Every tag with the number of images having it, most used first. """
+        return self._query(
+            'SELECT tag, COUNT(*) AS n FROM tags GROUP BY tag '
+            'ORDER BY n DESC, tag'
+        )
+
+    def tag_count(self, tag: str) -> int:
+        return self._query(
+            'SELECT COUNT(*) FROM tags WHERE tag = ?', (tag,)
+        )[0][0]
+
+    def images_with_tag(self, tag: str) -> list[str]:
+        return [row[0] for row in self._query(
+            'SELECT name FROM images JOIN tags ON tags.image_id = images.id '
+            'WHERE tag = ? ORDER BY name', (tag,)
+        )]
+
+    def images_without_tags(self) -> list[str]:
+        return [row[0] for row in self._query(
+            'SELECT name FROM images WHERE NOT EXISTS '
+            '(SELECT 1 FROM tags WHERE tags.image_id = images.id) '
+            'ORDER BY name'
+        )]
+
+    def images_without_caption(self) -> list[str]:
+        return [row[0] for row in self._query(
+            "SELECT name FROM images WHERE caption IS NULL OR caption = '' "
+            'ORDER BY name'
+        )]
+
+    def tags(self, name: str) -> list[str]:
+        return [row[0] for row in self._query(
+            'SELECT tag FROM tags JOIN images ON tags.image_id = images.id '
+            'WHERE name = ? ORDER BY position', (name,)
+        )]
+
+    def image_stats(self) -> list[tuple[str, int, int]]:
+        """ `(name, size, mtime)' of every image, by name. """
+        return self._query('SELECT name, size, mtime FROM images ORDER BY name')
+
+    def images_without_hashes(self) -> list[str]:
+        """ Images with no perceptual hashes, or hashes of an older file. """
+        return [row[0] for row in self._query(
+            'SELECT name FROM images LEFT JOIN hashes '
+            'ON hashes.image_id = images.id WHERE hashes.image_id IS NULL '
+            'OR hashes.size != images.size OR hashes.mtime != images.mtime '
+            'ORDER BY name'
+        )]
+
+    def set_hashes(self, hashes: list[tuple[str, tuple, int, int]]) -> None:
+        """
+        Record `(name, (size, mtime), dhash, phash)' of images, the stat
+        being that of the file which was hashed.
+        """
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT INTO hashes (image_id, size, mtime, dhash, phash) '
+                'SELECT id, ?, ?, ?, ? FROM images WHERE name = ? '
+                'ON CONFLICT (image_id) DO UPDATE SET size = excluded.size, '
+                'mtime = excluded.mtime, dhash = excluded.dhash, '
+                'phash = excluded.phash',
+                ((*stat, dhash, phash, name)
+                 for name, stat, dhash, phash in hashes)
+            )
+
+    def image_hashes(self) -> list[tuple]:
+        """
+        `(name, width, height, size, dhash, phash)' of every image whose
+        hashes are current, by name.
+        """
+        return self._query(
+            'SELECT name, width, height, images.size, dhash, phash '
+            'FROM images JOIN hashes ON hashes.image_id = images.id '
+            'WHERE hashes.size = images.size AND hashes.mtime = images.mtime '
+            'ORDER BY name'
+        )
+
+
+class CatalogWorker(QThread):
+    """
+    Keeps the catalog of the current directory in sync in the background.
+    Requests are coalesced, only the most recent catalog is synced.
+    """
+    catalogSynced = Signal(str, int)
+
+    def __init__(self, parent: QObject = None) -> None:
+        super().__init__(parent)
+        self._condition = threading.Condition()
+        self._pending: Catalog | None = None
+        self._stopping = False
+
+    def sync(self, catalog: Catalog) -> None:
+        with self._condition:
+            self._pending = catalog
+            self._condition.notify()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopping = True
+            self._pending = None
+            self._condition.notify()
+
+    def _should_stop(self) -> bool:
+        return self._stopping
+
+    def _next(self) -> Catalog | None:
+        with self._condition:
+            while self._pending is None and not self._stopping:
+                self._condition.wait()
+            catalog, self._pending = self._pending, None
+            return catalog
+
+    def run(self) -> None:
+        while (catalog := self._next()) is not None:
+            try:
+                changed = catalog.sync(should_stop=self._should_stop)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Failed to update catalog of {catalog.root}: {e}",
+                      file=sys.stderr)
+                continue
+            self.catalogSynced.emit(catalog.root, changed)
+
+
+def main(argv: list[str] = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Query the catalog of a dataset directory, updating it '
+                    'first.'
+    )
+    parser.add_argument('root', help='dataset directory')
+    query = parser.add_mutually_exclusive_group()
+    query.add_argument('--tag', help='list images having this tag')
+    query.add_argument('--untagged', action='store_true',
+                       help='list images without tags')
+    query.add_argument('--no-caption', action='store_true',
+                       help='list images without a caption')
+    args = parser.parse_args(argv)
+
+    catalog = Catalog(args.root)
+    catalog.sync()
+    if args.tag is not None:
+        print('\n'.join(catalog.images_with_tag(args.tag)))
+    elif args.untagged:
+        print('\n'.join(catalog.images_without_tags()))
+    elif args.no_caption:
+        print('\n'.join(catalog.images_without_caption()))
+    else:
+        print(f'{catalog.image_count()} images')
+        for tag, count in catalog.tag_counts():
+            print(f'{count}\t{tag}')
+    catalog.close()
+
+if __name__ == "__main__":
+    main()
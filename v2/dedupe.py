@@ -0,0 +1,275 @@
+import os
+import sys
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from typing import Callable
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+from catalog import Catalog
+from image_hash import hash_files
+
+HASH_KINDS = ('phash', 'dhash')
+# Bits two hashes may differ by and still be near duplicates.
+DEFAULT_DISTANCE = 6
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0f0f0f0f0f0f0f0f)
+_H01 = np.uint64(0x0101010101010101)
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """ Number of set bits of each 64 bit integer. """
+    x = np.asarray(values, dtype=np.uint64)
+    x = x - ((x >> np.uint64(1)) & _M1)
+    x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+    x = (x + (x >> np.uint64(4))) & _M4
+    return (x * _H01) >> np.uint64(56)
+
+
+def _flip_masks(bits: int, radius: int) -> np.ndarray:
+    """ Every mask of `bits' bits with at most `radius' of them set. """
+    masks = [0]
+    for r in range(1, radius + 1):
+        masks += [sum(1 << b for b in c) for c in combinations(range(bits), r)]
+    return np.array(masks, dtype=np.uint64)
+
+
+def _chunk_count(n: int, distance: int) -> int:
+    """
+    Chunks to split hashes in: more chunks mean fewer keys to probe per
+    chunk but more candidates per key.  Roughly minimizes the work of both,
+    chunks are kept to 21 bits at most for their bucket tables.
+    """
+    def cost(m):
+        width = 64 // m
+        probes = sum(math.comb(width, r) for r in range(distance // m + 1))
+        return m * probes * (1 + n / 2 ** width)
+    return min(range(3, 9), key=cost)
+
+
+def hamming_pairs(hashes: np.ndarray, distance: int) -> np.ndarray:
+    """
+    Every pair `(i, j)', i < j, of 64 bit `hashes' differing by at most
+    `distance' bits, as a (pairs, 2) array.
+
+    Multi-index hashing instead of comparing all pairs: split in m chunks,
+    two hashes within `distance' have a chunk within `distance // m' of
+    each other.  Hashes are bucketed by each chunk, each bucket within that
+    many bits of a hash's is looked up, and only the candidates found are
+    compared in full.  Equal hashes all pair with each other, pass unique
+    ones.
+    """
+    hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+    n = len(hashes)
+    if n < 2 or distance <= 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    m = _chunk_count(n, distance)
+    radius = distance // m
+    found = []
+    for c in range(m):
+        low, high = 64 * c // m, 64 * (c + 1) // m
+        keys = (hashes >> np.uint64(low)) & np.uint64((1 << (high - low)) - 1)
+        keys = keys.astype(np.int64)
+        # Work in key order: probes then read the tables nearly in order.
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        sorted_hashes = hashes[order]
+        # Start of each key's bucket, and the end of the last.
+        buckets = np.searchsorted(
+            sorted_keys, np.arange((1 << (high - low)) + 1)
+        )
+        for mask in _flip_masks(high - low, radius).astype(np.int64):
+            probes = sorted_keys ^ mask
+            start = buckets[probes]
+            counts = buckets[probes + 1] - start
+            p = np.flatnonzero(counts)
+            if len(p) == 0:
+                continue
+            # Expand each bucket found into candidate pairs, a pair is
+            # found from both sides so keep one.
+            start, counts = start[p], counts[p]
+            q = (
+                np.repeat(start - np.cumsum(counts) + counts, counts)
+                + np.arange(int(counts.sum()))
+            )
+            p = np.repeat(p, counts)
+            keep = p < q
+            p, q = p[keep], q[keep]
+            close = popcount(sorted_hashes[p] ^ sorted_hashes[q]) <= distance
+            i, j = order[p[close]], order[q[close]]
+            found.append(np.minimum(i, j) * n + np.maximum(i, j))
+    if not found:
+        return np.zeros((0, 2), dtype=np.int64)
+    keys = np.unique(np.concatenate(found))
+    return np.stack([keys // n, keys % n], axis=1)
+
+
+def duplicate_groups(hashes: np.ndarray, distance: int) -> list[np.ndarray]:
+    """
+    Indices of `hashes' grouped by closeness, groups of two or more only.
+    Closeness is transitive here: a chain of near duplicates is one group.
+    """
+    unique, inverse = np.unique(
+        np.asarray(hashes, dtype=np.uint64), return_inverse=True
+    )
+    pairs = hamming_pairs(unique, distance)
+    graph = sp.coo_matrix(
+        (np.ones(len(pairs), dtype=bool), (pairs[:, 0], pairs[:, 1])),
+        shape=(len(unique), len(unique))
+    )
+    _, labels = connected_components(graph, directed=False)
+    labels = labels[inverse.ravel()]
+    order = np.argsort(labels, kind='stable')
+    boundaries = np.flatnonzero(np.diff(labels[order])) + 1
+    return [
+        group for group in np.split(order, boundaries) if len(group) > 1
+    ]
+
+
+class DuplicateImage():
+    """ An image of a group of near duplicates. """
+    def __init__(
+            self,
+            name: str,
+            width: int | None,
+            height: int | None,
+            size: int
+    ) -> None:
+        self.name = name
+        self.width = width
+        self.height = height
+        self.size = size
+
+    @property
+    def pixels(self) -> int:
+        return (self.width or 0) * (self.height or 0)
+
+
+# Below this many images to hash starting worker processes costs more
+# than it saves.
+PARALLEL_THRESHOLD = 256
+CHUNK_SIZE = 128
+
+
+def update_hashes(
+        catalog: Catalog,
+        workers: int = None,
+        should_stop: Callable[[], bool] = None,
+        progress: Callable[[int, int], None] = None
+) -> int:
+    """
+    Hash the catalog's images which have no current hashes, in a pool of
+    `workers' processes.  Returns the number of images hashed; hashes are
+    committed chunk by chunk, so stopping early once `should_stop' returns
+    True keeps them.
+    """
+    names = catalog.images_without_hashes()
+    if not names:
+        return 0
+    workers = workers or os.cpu_count() or 1
+    chunks = [
+        names[i:i + CHUNK_SIZE] for i in range(0, len(names), CHUNK_SIZE)
+    ]
+    done = 0
+    if progress is not None:
+        progress(done, len(names))
+    if len(names) < PARALLEL_THRESHOLD or workers <= 1:
+        results = (hash_files(catalog.root, chunk) for chunk in chunks)
+        pool = None
+    else:
+        # Forking a process which runs Qt threads is unsafe, spawn workers.
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        futures = [
+            pool.submit(hash_files, catalog.root, chunk) for chunk in chunks
+        ]
+        results = (future.result() for future in futures)
+    try:
+        for chunk, hashes in zip(chunks, results):
+            catalog.set_hashes(hashes)
+            done += len(chunk)
+            if progress is not None:
+                progress(done, len(names))
+            if should_stop is not None and should_stop():
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return done
+
+
+def find_duplicates(
+        catalog: Catalog,
+        distance: int = DEFAULT_DISTANCE,
+        kind: str = 'phash'
+) -> list[list[DuplicateImage]]:
+    """
+    Groups of near duplicate images among those with current hashes, the
+    largest groups first.  Each group starts with the image to keep: the
+    one with the most pixels, then the largest file.
+    """
+    rows = catalog.image_hashes()
+    if not rows:
+        return []
+    column = {'dhash': 4, 'phash': 5}[kind]
+    hashes = np.array([row[column] for row in rows], dtype=np.int64)
+    groups = []
+    for indices in duplicate_groups(hashes.view(np.uint64), distance):
+        images = [DuplicateImage(*rows[i][:4]) for i in indices]
+        images.sort(key=lambda image: (-image.pixels, -image.size, image.name))
+        groups.append(images)
+    groups.sort(key=lambda group: (-len(group), group[0].name))
+    return groups
+
+
+def main(argv: list[str] = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='List groups of near duplicate images of a directory, '
+                    'the image to keep first.  Hashes are stored in the '
+                    'directory\'s catalog, so only new or changed images are '
+                    'hashed again.'
+    )
+    parser.add_argument('root', help='dataset directory')
+    parser.add_argument('-k', '--distance', type=int,
+                        default=DEFAULT_DISTANCE,
+                        help='bits hashes may differ by (default: '
+                             '%(default)s)')
+    parser.add_argument('--hash', choices=HASH_KINDS, default='phash')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='hashing processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+
+    catalog = Catalog(args.root)
+    try:
+        catalog.sync()
+
+        def progress(done, total):
+            print(f'\rHashing {done}/{total}', end='', file=sys.stderr)
+
+        if update_hashes(catalog, args.workers, progress=progress):
+            print(file=sys.stderr)
+        groups = find_duplicates(catalog, args.distance, args.hash)
+    finally:
+        catalog.close()
+
+    for group in groups:
+        for i, image in enumerate(group):
+            print(f'{"keep" if i == 0 else "dup "}  {image.name}  '
+                  f'{image.width}x{image.height}  {image.size} bytes')
+        print()
+    duplicates = sum(len(group) - 1 for group in groups)
+    print(f'{len(groups)} groups, {duplicates} duplicates', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,12 @@
 import sys
+import os
+import threading
+import traceback
+from collections import deque, OrderedDict
 from pathlib import Path
+from typing import Callable
 
 from PIL import Image
-from transformers import BlipProcessor, BlipForConditionalGeneration
 
 from PySide6.QtCore import QThread, Signal, QObject
 from PySide6.QtWidgets import (
@@ -18,6 +22,9 @@ from PySide6.QtWidgets import (
 
 class Describer():
     def __init__(self) -> None:
+        # `transformers' (and with it `torch') takes seconds to import, so
+        # only pay for it once a describer is actually created.
+        from transformers import BlipProcessor, BlipForConditionalGeneration
         self.processor = BlipProcessor.from_pretrained(
             "Salesforce/blip-image-captioning-base"
         )
@@ -25,11 +32,23 @@ class Describer():
             "Salesforce/blip-image-captioning-base"
         )
 
-    def describe_image(self, image_path: str|Path) -> str:
+    def describe_image(
+            self,
+            image_path: str|Path,
+            should_stop: Callable[[], bool] = None
+    ) -> str:
+        """
+        Caption an image.  `should_stop' is polled between generation steps,
+        returning True aborts generation early (the partial caption is
+        returned and should be discarded by the caller).
+        """
         if not isinstance(image_path, Path):
             image_path = Path(image_path)
         image = Image.open(image_path)
         inputs = self.processor(images=image, return_tensors="pt")
+        stopping_criteria = None
+        if should_stop is not None:
+            stopping_criteria = self._stopping_criteria(should_stop)
         outputs = self.model.generate(
             **inputs,
             min_length=32,
@@ -37,34 +56,126 @@ class Describer():
             num_beams=3,
             repetition_penalty=1.1,
             do_sample=True,
-            num_return_sequences=1
+            num_return_sequences=1,
+            stopping_criteria=stopping_criteria
         )
         caption = self.processor.decode(outputs[0], skip_special_tokens=True)
         return caption
 
+    @staticmethod
+    def _stopping_criteria(should_stop: Callable[[], bool]):
+        import torch
+        from transformers import StoppingCriteria, StoppingCriteriaList
+
+        class Interrupt(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return torch.full(
+                    (input_ids.shape[0],),
+                    should_stop(),
+                    dtype=torch.bool,
+                    device=input_ids.device
+                )
+
+        return StoppingCriteriaList([Interrupt()])
+
 class DescriptionWorker(QThread):
-    descriptionGenerated = Signal(str)
+    """
+    Single long lived captioning thread.  Loads the model, then works through
+    a small bounded queue of image paths.  A new request supersedes everything
+    queued before it and interrupts a generation that is still running for a
+    different image.  Prefetches are only queued behind it while there is
+    room.
+    """
+    modelLoaded = Signal()
+    loadFailed = Signal(str)
+    descriptionGenerated = Signal(str, str)
 
-    def __init__(
-            self,
-            describer: Describer,
-            image_path: str|Path,
-            parent: QObject = None
-    ) -> None:
+    def __init__(self, max_pending: int = 8, parent: QObject = None) -> None:
         super().__init__(parent)
-        self.describer = describer
-        self.image_path = image_path
+        self.describer = None
+        self._condition = threading.Condition()
+        self._pending = deque(maxlen=max_pending)
+        self._active = None
+        self._cancelled = False
+        self._stopping = False
+
+    def request(self, path: Path) -> None:
+        with self._condition:
+            self._pending.clear()
+            if self._active == path and not self._cancelled:
+                # Already being generated.
+                return
+            self._pending.append(path)
+            self._cancelled = True
+            self._condition.notify()
+
+    def prefetch(self, paths: list[Path]) -> None:
+        with self._condition:
+            for path in paths:
+                if len(self._pending) >= self._pending.maxlen:
+                    break
+                if path != self._active and path not in self._pending:
+                    self._pending.append(path)
+            self._condition.notify()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopping = True
+            self._cancelled = True
+            self._pending.clear()
+            self._condition.notify()
+
+    def _should_stop(self) -> bool:
+        return self._cancelled or self._stopping
+
+    def _next_request(self):
+        with self._condition:
+            self._active = None
+            while not self._pending and not self._stopping:
+                self._condition.wait()
+            if self._stopping:
+                return None
+            self._active = self._pending.popleft()
+            self._cancelled = False
+            return self._active
 
     def run(self) -> None:
-        description = self.describer.describe_image(self.image_path)
-        self.descriptionGenerated.emit(description)
+        try:
+            self.describer = Describer()
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            self.loadFailed.emit(str(e))
+            return
+        self.modelLoaded.emit()
+
+        while (path := self._next_request()) is not None:
+            try:
+                description = self.describer.describe_image(
+                    path,
+                    should_stop=self._should_stop
+                )
+            except Exception as e:
+                print(f"Failed to describe {path}: {e}", file=sys.stderr)
+                continue
+            with self._condition:
+                if self._cancelled:
+                    continue
+            self.descriptionGenerated.emit(str(path), description)
 
 
 class DescriptionRecommendationWidget(QWidget):
+    # Number of generated captions kept in memory.
+    CAPTION_CACHE_SIZE = 64
+
     def __init__(self, parent: QObject = None) -> None:
         super().__init__(parent)
-        self.describer = Describer()
         self.description = ""
+        # path -> (image mtime, caption) for current and prefetched images.
+        self.captions: OrderedDict[str, tuple[int, str]] = OrderedDict()
+        # Image whose caption we are waiting for, captions for any other
+        # image are stale and dropped.
+        self.current_path = None
+        self.model_ready = False
 
         self.main_layout = QVBoxLayout(self)
         self.setLayout(self.main_layout)
@@ -73,19 +184,82 @@ class DescriptionRecommendationWidget(QWidget):
         self.description_text = QTextEdit()
         self.description_text.setReadOnly(True)
         self.main_layout.addWidget(self.description_text)
+        self.description_text.setPlainText("Loading captioning model...")
+        self.description_text.setStyleSheet("color: gray")
+
+        # One captioning thread for the lifetime of the widget.
+        self.worker = DescriptionWorker(parent=self)
+        self.worker.modelLoaded.connect(self.on_model_loaded)
+        self.worker.loadFailed.connect(self.on_model_failed)
+        self.worker.descriptionGenerated.connect(self.on_description_generated)
+        self.worker.start()
+
+    def shutdown(self) -> None:
+        """ Stop the worker, interrupting any running generation. """
+        self.worker.stop()
+        self.worker.wait()
+
+    def on_model_loaded(self) -> None:
+        self.model_ready = True
+        if self.current_path is not None:
+            self.description_text.setPlainText("Generating description...")
+        else:
+            self.description_text.setPlainText("")
+
+    def on_model_failed(self, message: str) -> None:
+        self.description_text.setPlainText(
+            f"Failed to load captioning model: {message}"
+        )
 
     def set_image(self, path: str|Path) -> None:
         if not isinstance(path, Path):
             path = Path(path)
-
-        # Start a description generation thread
-        self.worker = DescriptionWorker(self.describer, path, parent=self)
-        self.worker.descriptionGenerated.connect(self.set_description)
-        self.worker.start()
+        self.current_path = path
+        cached = self.cached_caption(path)
+        if cached is not None:
+            self.set_description(cached)
+            return
+        if not self.worker.isRunning():
+            return
+        self.worker.request(path)
         self.description = ""
-        self.description_text.setPlainText("Generating description...")
+        if self.model_ready:
+            self.description_text.setPlainText("Generating description...")
         self.description_text.setStyleSheet("color: gray")
 
+    def prefetch(self, paths: list[str|Path]) -> None:
+        """ Queue captions for images the user is likely to view next. """
+        paths = [Path(path) for path in paths]
+        paths = [path for path in paths if self.cached_caption(path) is None]
+        if paths and self.worker.isRunning():
+            self.worker.prefetch(paths)
+
+    def cached_caption(self, path: Path) -> str | None:
+        cached = self.captions.get(str(path))
+        if cached is None:
+            return None
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if cached[0] != mtime:
+            del self.captions[str(path)]
+            return None
+        self.captions.move_to_end(str(path))
+        return cached[1]
+
+    def on_description_generated(self, path: str, description: str) -> None:
+        try:
+            self.captions[path] = (os.stat(path).st_mtime_ns, description)
+            self.captions.move_to_end(path)
+            while len(self.captions) > self.CAPTION_CACHE_SIZE:
+                self.captions.popitem(last=False)
+        except OSError:
+            pass
+        if self.current_path is None or Path(path) != self.current_path:
+            return
+        self.set_description(description)
+
     def set_description(self, description: str) -> None:
         self.description = description
         self.update_description()
@@ -0,0 +1,114 @@
+import os
+import sys
+import threading
+
+from PySide6.QtCore import QThread, Signal, QObject
+
+from util import IMAGE_EXTENSIONS
+
+
+class DirectoryScanner(QThread):
+    """
+    Lists the images of a directory off the GUI thread.
+
+    A full scan reports names in batches as `scandir' finds them: the very
+    first image on its own so it can be shown right away, then batches of
+    doubling size.  A rescan compares the directory against the names the
+    caller already knows and only reports what was added and removed.
+
+    Every scan carries a generation number, results of a superseded scan are
+    not emitted and should be ignored by the receiver.
+    """
+    imagesFound = Signal(int, list)
+    scanFinished = Signal(int)
+    imagesChanged = Signal(int, list, list)
+
+    FIRST_BATCH_SIZE = 64
+    MAX_BATCH_SIZE = 8192
+
+    def __init__(self, parent: QObject = None) -> None:
+        super().__init__(parent)
+        self._condition = threading.Condition()
+        # (generation, directory, known names or None for a full scan)
+        self._job = None
+        self.generation = 0
+        self._stopping = False
+
+    def scan(self, directory: str) -> int:
+        """ Start a full scan, returns its generation. """
+        with self._condition:
+            self.generation += 1
+            self._job = (self.generation, directory, None)
+            self._condition.notify()
+            return self.generation
+
+    def rescan(self, directory: str, known: set[str]) -> None:
+        """ Diff `directory' against `known' names, in the current generation. """
+        with self._condition:
+            self._job = (self.generation, directory, set(known))
+            self._condition.notify()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopping = True
+            self._job = None
+            self._condition.notify()
+
+    def _is_current(self, generation: int) -> bool:
+        return generation == self.generation and not self._stopping
+
+    def _next_job(self):
+        with self._condition:
+            while self._job is None and not self._stopping:
+                self._condition.wait()
+            job, self._job = self._job, None
+            return job
+
+    def run(self) -> None:
+        while (job := self._next_job()) is not None:
+            generation, directory, known = job
+            try:
+                if known is None:
+                    self._scan(generation, directory)
+                else:
+                    self._rescan(generation, directory, known)
+            except OSError as e:
+                print(f"Failed to scan {directory}: {e}", file=sys.stderr)
+                if known is None and self._is_current(generation):
+                    self.scanFinished.emit(generation)
+
+    @staticmethod
+    def _image_names(directory: str):
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield entry.name
+
+    def _scan(self, generation: int, directory: str) -> None:
+        batch = []
+        batch_size = 1
+        for name in self._image_names(directory):
+            if not self._is_current(generation):
+                return
+            batch.append(name)
+            if len(batch) >= batch_size:
+                self.imagesFound.emit(generation, batch)
+                batch = []
+                batch_size = min(
+                    max(batch_size * 2, self.FIRST_BATCH_SIZE),
+                    self.MAX_BATCH_SIZE
+                )
+        if not self._is_current(generation):
+            return
+        if batch:
+            self.imagesFound.emit(generation, batch)
+        self.scanFinished.emit(generation)
+
+    def _rescan(self, generation: int, directory: str, known: set[str]) -> None:
+        found = set(self._image_names(directory))
+        if not self._is_current(generation):
+            return
+        added = sorted(found - known)
+        removed = sorted(known - found)
+        if added or removed:
+            self.imagesChanged.emit(generation, added, removed)
@@ -0,0 +1,263 @@
+import os
+import sys
+import sqlite3
+import threading
+from concurrent.futures import BrokenExecutor
+
+from PySide6.QtCore import Qt, QObject, QSize, QThread, Signal
+from PySide6.QtGui import QIcon, QPixmap
+from PySide6.QtWidgets import (
+    QComboBox,
+    QHBoxLayout,
+    QLabel,
+    QListView,
+    QListWidget,
+    QListWidgetItem,
+    QMessageBox,
+    QPushButton,
+    QSpinBox,
+    QSplitter,
+    QVBoxLayout,
+    QWidget
+)
+
+from catalog import Catalog
+from settings import get_setting, set_setting
+from thumbnail_grid import ThumbnailCache
+
+
+class DuplicatesWorker(QThread):
+    """
+    Hashes the images of a catalog which have no current perceptual hashes,
+    then groups near duplicates, in the background.  Only the most recent
+    request is served, a new one interrupts hashing.
+    """
+    progress = Signal(str, int, int)
+    duplicatesFound = Signal(str, object)
+
+    def __init__(self, parent: QObject = None) -> None:
+        super().__init__(parent)
+        self._condition = threading.Condition()
+        self._pending: tuple[Catalog, int, str] | None = None
+        self._stopping = False
+
+    def find(self, catalog: Catalog, distance: int, kind: str) -> None:
+        with self._condition:
+            self._pending = (catalog, distance, kind)
+            self._condition.notify()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopping = True
+            self._pending = None
+            self._condition.notify()
+
+    def _should_stop(self) -> bool:
+        with self._condition:
+            return self._stopping or self._pending is not None
+
+    def _next(self) -> tuple[Catalog, int, str] | None:
+        with self._condition:
+            while self._pending is None and not self._stopping:
+                self._condition.wait()
+            job, self._pending = self._pending, None
+            return job
+
+    def run(self) -> None:
+        while (job := self._next()) is not None:
+            catalog, distance, kind = job
+            # numpy and scipy are slow to import, keep them off startup.
+            from dedupe import find_duplicates, update_hashes
+            try:
+                # Hash every image, even if the first sync is still running.
+                catalog.sync(should_stop=self._should_stop)
+                update_hashes(
+                    catalog,
+                    should_stop=self._should_stop,
+                    progress=lambda done, total: self.progress.emit(
+                        catalog.root, done, total
+                    )
+                )
+                if self._should_stop():
+                    continue
+                groups = find_duplicates(catalog, distance, kind)
+            except (OSError, sqlite3.Error, BrokenExecutor) as e:
+                print(f"Failed to find duplicates in {catalog.root}: {e}",
+                      file=sys.stderr)
+                continue
+            self.duplicatesFound.emit(catalog.root, groups)
+
+
+class DuplicatesWidget(QWidget):
+    """
+    Groups of near duplicate images to review.  The images of the selected
+    group are shown side by side, checked images are deleted along with
+    their sidecars.  The image to keep, first of its group, starts unchecked
+    and the others checked.
+    """
+    findRequested = Signal(int, str)
+    deleteRequested = Signal(list)
+    imageActivated = Signal(str)
+    THUMBNAIL_SIZE = 192
+
+    def __init__(self, parent: QWidget = None) -> None:
+        super().__init__(parent)
+        self.directory = ''
+        self.groups = []
+        # Names of the images to delete, across all groups.
+        self.checked: set[str] = set()
+        self.thumbnails = ThumbnailCache.shared()
+
+        self.main_layout = QVBoxLayout(self)
+        self.controls_layout = QHBoxLayout()
+        self.controls_layout.addWidget(QLabel("Max distance", self))
+        self.distance_spin = QSpinBox(self)
+        self.distance_spin.setRange(0, 12)
+        self.distance_spin.setValue(get_setting('duplicate_distance'))
+        self.distance_spin.setToolTip(
+            "Bits the perceptual hashes of two images may differ by"
+        )
+        self.controls_layout.addWidget(self.distance_spin)
+        self.hash_combo = QComboBox(self)
+        self.hash_combo.addItem("pHash", 'phash')
+        self.hash_combo.addItem("dHash", 'dhash')
+        self.hash_combo.setCurrentIndex(
+            max(self.hash_combo.findData(get_setting('duplicate_hash')), 0)
+        )
+        self.controls_layout.addWidget(self.hash_combo)
+        self.find_button = QPushButton("Find duplicates", self)
+        self.find_button.clicked.connect(self.on_find)
+        self.controls_layout.addWidget(self.find_button)
+        self.status = QLabel(self)
+        self.controls_layout.addWidget(self.status, 1)
+        self.main_layout.addLayout(self.controls_layout)
+
+        self.splitter = QSplitter(Qt.Horizontal, self)
+        self.main_layout.addWidget(self.splitter)
+        self.group_list = QListWidget(self)
+        self.group_list.currentRowChanged.connect(self.on_group_selected)
+        self.splitter.addWidget(self.group_list)
+        self.image_list = QListWidget(self)
+        self.image_list.setViewMode(QListView.ViewMode.IconMode)
+        self.image_list.setResizeMode(QListView.ResizeMode.Adjust)
+        self.image_list.setMovement(QListView.Movement.Static)
+        self.image_list.setIconSize(
+            QSize(self.THUMBNAIL_SIZE, self.THUMBNAIL_SIZE)
+        )
+        self.image_list.setGridSize(
+            QSize(self.THUMBNAIL_SIZE + 32, self.THUMBNAIL_SIZE + 56)
+        )
+        self.image_list.setWordWrap(True)
+        self.image_list.itemChanged.connect(self.on_item_changed)
+        self.image_list.itemActivated.connect(
+            lambda item: self.imageActivated.emit(item.data(Qt.UserRole))
+        )
+        self.splitter.addWidget(self.image_list)
+        self.splitter.setStretchFactor(0, 1)
+        self.splitter.setStretchFactor(1, 3)
+
+        self.delete_button = QPushButton(self)
+        self.delete_button.clicked.connect(self.on_delete)
+        self.main_layout.addWidget(self.delete_button)
+        self.update_delete_button()
+
+    def on_find(self) -> None:
+        distance = self.distance_spin.value()
+        kind = self.hash_combo.currentData()
+        set_setting('duplicate_distance', distance)
+        set_setting('duplicate_hash', kind)
+        self.status.setText("Looking for duplicates...")
+        self.findRequested.emit(distance, kind)
+
+    def set_status(self, text: str) -> None:
+        self.status.setText(text)
+
+    def set_progress(self, done: int, total: int) -> None:
+        self.status.setText(f"Hashing images: {done}/{total}")
+
+    def set_groups(self, directory: str, groups: list) -> None:
+        self.directory = directory
+        self.groups = groups
+        self.checked = {
+            image.name for group in groups for image in group[1:]
+        }
+        self._fill_groups(0)
+
+    def remove_images(self, names: list[str]) -> None:
+        """ Forget deleted images, and groups left with a single image. """
+        names = set(names)
+        self.checked -= names
+        self.groups = [
+            group for group in (
+                [image for image in group if image.name not in names]
+                for group in self.groups
+            )
+            if len(group) > 1
+        ]
+        self._fill_groups(self.group_list.currentRow())
+
+    def _fill_groups(self, row: int) -> None:
+        duplicates = sum(len(group) - 1 for group in self.groups)
+        self.status.setText(
+            f"{len(self.groups)} groups, {duplicates} duplicates"
+            if self.groups else
+            "No duplicates found" if self.directory else ""
+        )
+        self.group_list.blockSignals(True)
+        self.group_list.clear()
+        for group in self.groups:
+            self.group_list.addItem(f"{len(group)} images: {group[0].name}")
+        self.group_list.blockSignals(False)
+        row = min(max(row, 0), len(self.groups) - 1)
+        self.group_list.setCurrentRow(row)
+        self.on_group_selected(row)
+
+    def on_group_selected(self, row: int) -> None:
+        self.image_list.blockSignals(True)
+        self.image_list.clear()
+        if 0 <= row < len(self.groups):
+            for image in self.groups[row]:
+                path = os.path.join(self.directory, image.name)
+                thumbnail = self.thumbnails.load(path, self.THUMBNAIL_SIZE)
+                item = QListWidgetItem(
+                    QIcon(QPixmap.fromImage(thumbnail)),
+                    f"{image.name}\n{image.width}x{image.height}, "
+                    f"{image.size // 1024} KiB"
+                )
+                item.setToolTip(image.name)
+                item.setData(Qt.UserRole, image.name)
+                item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+                item.setCheckState(
+                    Qt.Checked if image.name in self.checked
+                    else Qt.Unchecked
+                )
+                self.image_list.addItem(item)
+        self.image_list.blockSignals(False)
+        self.update_delete_button()
+
+    def on_item_changed(self, item: QListWidgetItem) -> None:
+        name = item.data(Qt.UserRole)
+        if item.checkState() == Qt.Checked:
+            self.checked.add(name)
+        else:
+            self.checked.discard(name)
+        self.update_delete_button()
+
+    def update_delete_button(self) -> None:
+        self.delete_button.setText(
+            f"Delete {len(self.checked)} checked images"
+        )
+        self.delete_button.setEnabled(bool(self.checked))
+
+    def on_delete(self) -> None:
+        if not self.checked:
+            return
+        answer = QMessageBox.question(
+            self,
+            "Delete duplicates",
+            f"Delete {len(self.checked)} images, across all groups, and "
+            f"their .txt and .caption files?",
+            QMessageBox.Yes | QMessageBox.Cancel
+        )
+        if answer == QMessageBox.Yes:
+            self.deleteRequested.emit(sorted(self.checked))
@@ -1,90 +0,0 @@
-from PySide6.QtWidgets import QLayout, QSizePolicy, QLayoutItem
-from PySide6.QtCore import Qt, QRect, QSize, QMargins, QPoint
-
-class FlowLayout(QLayout):
-    def __init__(self, parent=None) -> None:
-        super().__init__(parent)
-        self._item_list = []
-        if parent is not None:
-            self.setContentsMargins(QMargins(0, 0, 0, 0))
-
-    def __del__(self) -> None:
-        item = self.takeAt(0)
-        while item:
-            item = self.takeAt(0)
-
-    def addItem(self, item) -> None:
-        self._item_list.append(item)
-
-    def count(self) -> int:
-        return len(self._item_list)
-
-    def itemAt(self, index: int) -> QLayoutItem:
-        if 0 <= index < len(self._item_list):
-            return self._item_list[index]
-        return None
-
-    def takeAt(self, index: int) -> QLayoutItem:
-        if 0 <= index < len(self._item_list):
-            return self._item_list.pop(index)
-        return None
-
-    def expandingDirections(self) -> Qt.Orientation:
-        return Qt.Orientation(0)
-
-    def hasHeightForWidth(self) -> bool:
-        return True
-
-    def heightForWidth(self, width) -> int:
-        height = self._do_layout(QRect(0, 0, width, 0), True)
-        return height
-
-    def setGeometry(self, rect) -> None:
-        super(FlowLayout, self).setGeometry(rect)
-        self._do_layout(rect, False)
-
-    def sizeHint(self) -> QSize:
-        return self.minimumSize()
-
-    def minimumSize(self) -> QSize:
-        size = QSize()
-
-        for item in self._item_list:
-            size = size.expandedTo(item.minimumSize())
-
-        size += QSize(2 * self.contentsMargins().top(),
-                      2 * self.contentsMargins().top())
-        return size
-
-    def _do_layout(self, rect: QRect, test_only: bool) -> int:
-        x = rect.x()
-        y = rect.y()
-        line_height = 0
-        spacing = self.spacing()
-
-        for item in self._item_list:
-            style = item.widget().style()
-            layout_spacing_x = style.layoutSpacing(
-                QSizePolicy.PushButton,
-                QSizePolicy.PushButton,
-                Qt.Orientation.Horizontal
-            )
-            layout_spacing_y = style.layoutSpacing(
-                QSizePolicy.PushButton, QSizePolicy.PushButton, Qt.Vertical
-            )
-            space_x = spacing + layout_spacing_x
-            space_y = spacing + layout_spacing_y
-            next_x = x + item.sizeHint().width() + space_x
-            if next_x - space_x > rect.right() and line_height > 0:
-                x = rect.x()
-                y = y + line_height + space_y
-                next_x = x + item.sizeHint().width() + space_x
-                line_height = 0
-
-            if not test_only:
-                item.setGeometry(QRect(QPoint(x, y), item.sizeHint()))
-
-            x = next_x
-            line_height = max(line_height, item.sizeHint().height())
-
-        return y + line_height - rect.y()
@@ -0,0 +1,101 @@
+import os
+import sys
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# Images are decoded at about this size, JPEGs directly by the decoder.
+DECODE_SIZE = 64
+# pHash keeps the lowest 8 x 8 frequencies of a 32 x 32 DCT.
+PHASH_SIZE = 32
+HASH_SIZE = 8
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """ Orthonormal DCT-II matrix, `D @ x' transforms the columns of `x'. """
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    d = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    d[0] /= np.sqrt(2)
+    return d.astype(np.float32)
+
+
+_DCT = _dct_matrix(PHASH_SIZE)[:HASH_SIZE]
+
+
+def _to_int(bits: np.ndarray) -> int:
+    """
+    64 booleans as a signed 64 bit integer, the form SQLite stores; the
+    sign does not matter to Hamming distances.
+    """
+    return int(np.packbits(bits.ravel()).view('>i8')[0])
+
+
+def dhash(image: Image.Image) -> int:
+    """ Difference hash: whether each pixel is brighter than its left. """
+    pixels = np.asarray(
+        image.resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR),
+        dtype=np.int16
+    )
+    return _to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(image: Image.Image) -> int:
+    """
+    Perceptual hash: whether each of the lowest frequencies of the image's
+    DCT is above their median.
+    """
+    pixels = np.asarray(
+        image.resize((PHASH_SIZE, PHASH_SIZE), Image.BILINEAR),
+        dtype=np.float32
+    )
+    low = _DCT @ pixels @ _DCT.T
+    # The DC term is the mean brightness, leave it out of the median.
+    return _to_int(low > np.median(low.ravel()[1:]))
+
+
+def open_reduced(path: str) -> Image.Image:
+    """ Grayscale image decoded at about `DECODE_SIZE', upright. """
+    with Image.open(path) as image:
+        # JPEGs are decoded at 1/2, 1/4 or 1/8 scale, no smaller than asked.
+        image.draft('L', (DECODE_SIZE, DECODE_SIZE))
+        image = ImageOps.exif_transpose(image)
+    if image.mode != 'L':
+        if 'A' in image.getbands() or image.mode == 'P':
+            # Flatten transparency onto white like the tagger does.
+            image = image.convert('RGBA')
+            background = Image.new('RGBA', image.size, 'white')
+            image = Image.alpha_composite(background, image)
+        image = image.convert('L')
+    image.thumbnail((DECODE_SIZE, DECODE_SIZE), Image.BILINEAR)
+    return image
+
+
+def hash_file(path: str) -> tuple[int, int]:
+    """ `dhash' and `phash' of the image at `path'. """
+    image = open_reduced(path)
+    return dhash(image), phash(image)
+
+
+def hash_files(
+        root: str,
+        names: list[str]
+) -> list[tuple[str, tuple[int, int], int, int]]:
+    """
+    `(name, (size, mtime), dhash, phash)' of images of `root', the file
+    stat being taken before reading so a later change invalidates the hash.
+    Unreadable images are left out.  Runs in worker processes, so this module
+    does not import Qt.
+    """
+    hashes = []
+    for name in names:
+        path = os.path.join(root, name)
+        try:
+            st = os.stat(path)
+            hashes.append((
+                name, (st.st_size, st.st_mtime_ns), *hash_file(path)
+            ))
+        except (OSError, ValueError, SyntaxError,
+                Image.DecompressionBombError) as e:
+            print(f'Failed to hash {path}: {e}', file=sys.stderr)
+    return hashes
@@ -0,0 +1,39 @@
+import math
+
+from PySide6.QtCore import QSize, Qt
+from PySide6.QtGui import QImage, QImageReader
+
+
+def read_image(path: str, max_pixels: int = None) -> QImage:
+    """
+    Decode an image, asking the decoder for a reduced size when the full
+    image would exceed `max_pixels'.  JPEGs are then decoded directly at the
+    smaller scale, other formats are scaled while reading.
+    """
+    image_reader = QImageReader(path)
+    image_reader.setAutoTransform(True)
+    size = image_reader.size()
+    if max_pixels is not None and size.isValid():
+        pixels = size.width() * size.height()
+        if pixels > max_pixels:
+            ratio = math.sqrt(max_pixels / pixels)
+            image_reader.setScaledSize(QSize(
+                max(1, int(size.width() * ratio)),
+                max(1, int(size.height() * ratio))
+            ))
+    return image_reader.read()
+
+
+def read_thumbnail(path: str, size: int) -> QImage:
+    """
+    Decode an image directly at thumbnail size (fitting in `size' x `size').
+    """
+    image_reader = QImageReader(path)
+    image_reader.setAutoTransform(True)
+    full_size = image_reader.size()
+    if full_size.isValid():
+        image_reader.setScaledSize(full_size.scaled(
+            QSize(size, size).boundedTo(full_size),
+            Qt.AspectRatioMode.KeepAspectRatio
+        ))
+    return image_reader.read()
@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
+import time
+_start_time = time.perf_counter()
+
 import sys
 import os
-from pathlib import Path
+import bisect
+import heapq
+import sqlite3
 from PySide6.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -17,9 +22,11 @@ from PySide6.QtWidgets import (
     QSizePolicy,
     QSplitter,
     QScrollArea,
-    QInputDialog
+    QInputDialog,
+    QTabWidget,
+    QCheckBox
 )
-from PySide6.QtGui import QKeyEvent, QImageReader, QPixmap
+from PySide6.QtGui import QKeyEvent, QImage, QPixmap
 from PySide6.QtCore import (
     Qt,
     QModelIndex,
@@ -29,13 +36,34 @@ from PySide6.QtCore import (
     QPoint,
     QEvent,
     QDir,
-    QObject
+    QObject,
+    QTimer,
+    QFileSystemWatcher
 )
 from tag_area_widget import TagAreaWidget
 from tag_recommendations import TagRecommendationsWidget
 from description_recommendations import DescriptionRecommendationWidget
+from directory_scanner import DirectoryScanner, IMAGE_EXTENSIONS
+from catalog import Catalog, CatalogWorker
+from image_io import read_image
+from prefetch import Prefetcher
+from settings import get_setting, set_setting
+from save_queue import SaveQueue
+from thumbnail_grid import ThumbnailGrid
+from statistics_panel import StatisticsWorker, TagStatisticsWidget
+from duplicates_panel import DuplicatesWidget, DuplicatesWorker
+from similar_panel import SimilarImagesWidget, SimilarWorker
+from sidecars import SidecarStore
+from util import delete_image_files
+
+# Heavy dependencies (torch, transformers, onnxruntime, OpenCV) are imported
+# lazily by the model loaders, keep it that way.
+_import_time = time.perf_counter() - _start_time
 
 class MainImageLabel(QLabel):
+    # Delay before a resize is followed by a smooth rescale, in milliseconds.
+    RESCALE_DELAY = 150
+
     def __init__(self, manager: QWidget, parent=None) -> None:
         super().__init__(parent)
         self.manager = manager
@@ -43,15 +71,63 @@ class MainImageLabel(QLabel):
         self.setSizePolicy(QSizePolicy.Policy.Expanding,
                            QSizePolicy.Policy.Expanding)
         self.setMinimumSize(QSize(100, 100))
+        # Decoded image of the current file, rescaled from on resize.
+        self.source = QImage()
+        # Size of the last smooth rescale, to skip redundant work.
+        self.smooth_size = QSize()
+        self.rescale_timer = QTimer(self)
+        self.rescale_timer.setSingleShot(True)
+        self.rescale_timer.setInterval(self.RESCALE_DELAY)
+        self.rescale_timer.timeout.connect(self.smooth_rescale)
+
+    def target_size(self) -> QSize:
+        """ Size, in device pixels, images are scaled to for display. """
+        return self.size() * self.devicePixelRatio()
+
+    def set_image(self, source: QImage, scaled: QImage = None) -> None:
+        """
+        Show `source', optionally using an already smoothly `scaled' copy
+        when it was made for the current size.
+        """
+        self.rescale_timer.stop()
+        self.source = source
+        self.smooth_size = QSize()
+        if scaled is not None and scaled.size() == source.size().scaled(
+                self.target_size(), Qt.AspectRatioMode.KeepAspectRatio
+        ):
+            self.show_scaled(scaled)
+            self.smooth_size = self.target_size()
+        else:
+            self.smooth_rescale()
+
+    def show_scaled(self, image: QImage) -> None:
+        pixmap = QPixmap.fromImage(image)
+        pixmap.setDevicePixelRatio(self.devicePixelRatio())
+        self.setPixmap(pixmap)
+
+    def rescale(self, mode: Qt.TransformationMode) -> None:
+        if self.source.isNull():
+            return
+        self.show_scaled(self.source.scaled(
+            self.target_size(),
+            Qt.AspectRatioMode.KeepAspectRatio,
+            mode
+        ))
+
+    def smooth_rescale(self) -> None:
+        if self.smooth_size == self.target_size():
+            return
+        self.rescale(Qt.TransformationMode.SmoothTransformation)
+        self.smooth_size = self.target_size()
 
     def resizeEvent(self, event) -> None:
         super().resizeEvent(event)
-        if not self.manager.image_paths:
+        if self.source.isNull():
             return
-        self.manager.load_image(
-            self.manager.current_image_index,
-            image_only=True
-        )
+        # Cheap rescale while the user is dragging, a smooth one once the
+        # size settles.
+        self.rescale(Qt.TransformationMode.FastTransformation)
+        self.rescale_timer.start()
 
 
 class IndexLabel(QWidget):
@@ -99,28 +175,7 @@ class IndexLabel(QWidget):
         if self.index() == None:
             return
 
-        current_image_name = self.manager.image_paths[
-            self.manager.current_image_index
-        ]
-        img_path = Path(self.manager.current_directory) / current_image_name
-        if img_path.is_file():
-            img_path.unlink()
-
-        base_path = os.path.join(
-            self.manager.current_directory,
-            os.path.splitext(current_image_name)[0]
-        )
-        tag_path = Path( base_path + ".txt" )
-        if tag_path.is_file():
-            tag_path.unlink()
-
-        caption_path = Path( base_path + ".caption" )
-        if caption_path.is_file():
-            caption_path.unlink()
-
-        del self.manager.image_paths[self.index() - 1]
-        self.manager.load_image(self.index() - 1)
-        self.update_text()  # Refresh `count'
+        self.manager.delete_images([self.manager.current_image_name()])
 
     def prompt_for_index(self) -> None:
         if self.index() == None:
@@ -192,6 +247,10 @@ class ImageTagManager(QMainWindow):
         self.current_image_index = 0
         self.image_paths = []
         self.current_directory = ""
+        self.first_paint_time = None
+        # Sidecar texts as on disk, and whether the editors were touched since.
+        self.sidecars = SidecarStore()
+        self.dirty = False
 
         # Central widget
         self.central_widget = QWidget(self)
@@ -231,9 +290,31 @@ class ImageTagManager(QMainWindow):
         self.vertical_split = QSplitter(Qt.Vertical)
         self.center_layout.addWidget(self.vertical_split)
 
-        # Add image viewer
+        # Add image viewer, and a thumbnail grid as an alternate view
+        self.view_tabs = QTabWidget(self)
         self.image_nav = ImageNavigationWidget(self, self)
-        self.vertical_split.addWidget(self.image_nav)
+        self.view_tabs.addTab(self.image_nav, "Image")
+        self.thumbnail_grid = ThumbnailGrid(
+            get_setting('thumbnail_size'), self
+        )
+        self.thumbnail_grid.imageSelected.connect(self.on_thumbnail_selected)
+        self.view_tabs.addTab(self.thumbnail_grid, "Grid")
+        self.statistics_panel = TagStatisticsWidget(self)
+        self.view_tabs.addTab(self.statistics_panel, "Statistics")
+        self.duplicates_panel = DuplicatesWidget(self)
+        self.duplicates_panel.findRequested.connect(self.find_duplicates)
+        self.duplicates_panel.deleteRequested.connect(
+            self.delete_duplicates
+        )
+        self.duplicates_panel.imageActivated.connect(self.on_image_activated)
+        self.view_tabs.addTab(self.duplicates_panel, "Duplicates")
+        self.similar_panel = SimilarImagesWidget(self)
+        self.similar_panel.searchRequested.connect(self.find_similar)
+        self.similar_panel.indexRequested.connect(self.index_similar)
+        self.similar_panel.imageActivated.connect(self.on_image_activated)
+        self.similar_panel.tagAdded.connect(self.add_similar_tag)
+        self.view_tabs.addTab(self.similar_panel, "Similar")
+        self.vertical_split.addWidget(self.view_tabs)
 
         # Editors panel
         self.editors_widget = QWidget(self)
@@ -247,6 +328,7 @@ class ImageTagManager(QMainWindow):
         self.tag_edit_label.setText("Tags")
         self.editors_layout.addWidget(self.tag_edit_label)
         self.tag_viewer = TagAreaWidget(parent=self)
+        self.tag_viewer.tagsChanged.connect(self.mark_dirty)
         self.editors_layout.addWidget(self.tag_viewer)
 
         # Description editor
@@ -259,12 +341,22 @@ class ImageTagManager(QMainWindow):
         )
         self.description_edit.setSizePolicy(QSizePolicy.Expanding,
                                             QSizePolicy.Expanding)
+        self.description_edit.textChanged.connect(self.mark_dirty)
         self.editors_layout.addWidget(self.description_edit)
 
         # Save button
+        self.save_layout = QHBoxLayout()
         self.save_button = QPushButton("Save", self)
         self.save_button.clicked.connect(self.save_tags_and_description)
-        self.editors_layout.addWidget(self.save_button)
+        self.save_layout.addWidget(self.save_button)
+        # Save when moving to another image instead of asking
+        self.autosave_check = QCheckBox("Autosave", self)
+        self.autosave_check.setChecked(get_setting('autosave_on_navigate'))
+        self.autosave_check.toggled.connect(
+            lambda checked: set_setting('autosave_on_navigate', checked)
+        )
+        self.save_layout.addWidget(self.autosave_check)
+        self.editors_layout.addLayout(self.save_layout)
 
         # Tag Recommendations
         self.recommendations = QWidget(self)
@@ -284,124 +376,473 @@ class ImageTagManager(QMainWindow):
         self.horizontal_split.setStretchFactor(1, 6)
         self.horizontal_split.setStretchFactor(2, 2)
 
+        # Background decoding of the images around the current one.
+        self.prefetcher = Prefetcher(
+            self.tag_recommendations.worker,
+            self.sidecars,
+            max_bytes=get_setting('prefetch_cache_mb') * 1024 * 1024,
+            max_pixels=get_setting('max_image_pixels'),
+            parent=self
+        )
+        self.prefetcher.start()
+
+        # Directory listing runs in the background, then the directory is
+        # watched and changes are applied as diffs.
+        self.scan_generation = 0
+        # Image shown before the scan finished, when none was asked for.
+        self.provisional_image = None
+        self.scanner = DirectoryScanner(self)
+        self.scanner.imagesFound.connect(self.on_images_found)
+        self.scanner.scanFinished.connect(self.on_scan_finished)
+        self.scanner.imagesChanged.connect(self.on_images_changed)
+        self.scanner.start()
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.on_directory_changed)
+        # Coalesce bursts of change notifications into one rescan.
+        self.rescan_timer = QTimer(self)
+        self.rescan_timer.setSingleShot(True)
+        self.rescan_timer.setInterval(200)
+        self.rescan_timer.timeout.connect(self.rescan_directory)
+
+        # Dataset catalog of the current directory, synced in the background
+        # after each scan and change on disk.
+        self.catalog = None
+        self.catalog_worker = CatalogWorker(self)
+        self.catalog_worker.catalogSynced.connect(self.on_catalog_synced)
+        self.catalog_worker.start()
+
+        # Tag statistics of the catalog, built once in the background then
+        # updated as images are saved.
+        self.statistics = None
+        self.statistics_root = None
+        # Updated since read from, or written to, the disk cache.
+        self.statistics_changed = False
+        self.statistics_worker = StatisticsWorker(self)
+        self.statistics_worker.statisticsReady.connect(self.on_statistics_ready)
+        self.statistics_worker.start()
+
+        # Perceptual hashing and near duplicate search, on request.
+        self.duplicates_worker = DuplicatesWorker(self)
+        self.duplicates_worker.progress.connect(self.on_duplicates_progress)
+        self.duplicates_worker.duplicatesFound.connect(
+            self.on_duplicates_found
+        )
+        self.duplicates_worker.start()
+
+        # Embedding search with the recommendations' model, on request.
+        self.similar_worker = SimilarWorker(
+            self.tag_recommendations.tagger, self
+        )
+        self.similar_worker.progress.connect(self.on_similar_progress)
+        self.similar_worker.similarFound.connect(self.on_similar_found)
+        self.similar_worker.failed.connect(self.on_similar_failed)
+        self.similar_worker.start()
+
+        # Sidecars are written behind the GUI thread.
+        self.save_queue = SaveQueue(self.sidecars, self)
+        self.save_queue.saveFailed.connect(self.on_save_failed)
+        self.save_queue.saved.connect(self.on_image_saved)
+        self.save_queue.start()
+
         self.load_images_in_directory()
 
-    def load_images_in_directory(self) -> None:
+    def load_images_in_directory(self, select: str = None) -> None:
+        """
+        Start listing the current directory.  Images are added as the scan
+        finds them, `select' (a file name) is shown immediately if given,
+        otherwise the first image found is.
+        """
         cancel = self.prompt_for_save_if_dirty()
         if cancel:
             return
         # Get image files from the current directory
         if self.current_directory:
-            self.image_paths = [
-                f for f in os.listdir(
-                    self.current_directory
-                ) if f.lower().endswith(
-                    ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
-                )
-            ]
-            self.image_paths.sort()  # Sort images
+            if self.statistics_root != self.current_directory:
+                self.set_statistics(None, None)
+            if self.duplicates_panel.directory != self.current_directory:
+                self.duplicates_panel.set_groups('', [])
+            if self.similar_panel.directory != self.current_directory:
+                self.similar_panel.clear()
+            if self.watcher.directories():
+                self.watcher.removePaths(self.watcher.directories())
+            self.rescan_timer.stop()
+            self.image_paths = [select] if select else []
+            self.current_image_index = 0
+            self.provisional_image = None
+            self.scan_generation = self.scanner.scan(self.current_directory)
+            self.thumbnail_grid.set_images(
+                self.current_directory, self.image_paths
+            )
             if self.image_paths:
                 self.load_image(0)
+            self.image_nav.image_index.update_text()
+
+    def open_catalog(self) -> None:
+        if self.current_catalog() is not None:
+            return
+        try:
+            self.catalog = Catalog(self.current_directory)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Failed to open catalog: {e}", file=sys.stderr)
+            self.catalog = None
+
+    def current_catalog(self) -> Catalog | None:
+        """ Catalog of the current directory, if it has one open. """
+        if self.catalog is not None and (
+                self.catalog.root == self.current_directory):
+            return self.catalog
+        return None
+
+    def sync_catalog(self) -> None:
+        if (catalog := self.current_catalog()) is not None:
+            self.catalog_worker.sync(catalog)
+
+    def on_catalog_synced(self, root: str, changed: int) -> None:
+        catalog = self.current_catalog()
+        if catalog is None or catalog.root != root:
+            return
+        if (self.current_statistics() is None
+                or self.statistics.generation != catalog.generation()):
+            self.statistics_worker.build(catalog)
+
+    def current_statistics(self):
+        """ Tag statistics of the current directory, once built. """
+        if self.statistics_root == self.current_directory:
+            return self.statistics
+        return None
+
+    def set_statistics(self, statistics, root: str | None) -> None:
+        self.statistics = statistics
+        self.statistics_root = root
+        self.statistics_changed = False
+        self.statistics_panel.set_statistics(statistics)
+        self.tag_recommendations.set_statistics(statistics)
+
+    def on_statistics_ready(self, root: str, statistics) -> None:
+        if root == self.current_directory:
+            self.set_statistics(statistics, root)
+
+    def update_statistics(
+            self,
+            names: list[str],
+            removed: bool = False
+    ) -> None:
+        """
+        Apply the catalog's single change, saving or removing `names', to
+        the statistics.  If the catalog changed otherwise meanwhile, rebuild
+        them instead.
+        """
+        catalog = self.current_catalog()
+        statistics = self.current_statistics()
+        if catalog is None or statistics is None:
+            return
+        generation = catalog.generation()
+        if generation != statistics.generation + 1:
+            self.statistics_worker.build(catalog)
+            return
+        for name in names:
+            if removed:
+                statistics.remove_image(name)
+            else:
+                statistics.update_image(name, catalog.tags(name))
+        statistics.generation = generation
+        self.statistics_changed = True
+        self.statistics_panel.refresh()
+
+    def find_duplicates(self, distance: int, kind: str) -> None:
+        if (catalog := self.current_catalog()) is None:
+            self.duplicates_panel.set_status("No dataset catalog")
+            return
+        self.duplicates_worker.find(catalog, distance, kind)
+
+    def on_duplicates_progress(self, root: str, done: int, total: int) -> None:
+        if root == self.current_directory:
+            self.duplicates_panel.set_progress(done, total)
+
+    def on_duplicates_found(self, root: str, groups: list) -> None:
+        if root != self.current_directory:
+            return
+        self.duplicates_panel.set_groups(root, groups)
+        # The search synced the catalog, the statistics may be behind.
+        self.on_catalog_synced(root, 0)
+
+    def on_image_activated(self, name: str) -> None:
+        index = bisect.bisect_left(self.image_paths, name)
+        if index < len(self.image_paths) and self.image_paths[index] == name:
+            self.on_thumbnail_selected(index)
+
+    def find_similar(self) -> None:
+        if (catalog := self.current_catalog()) is None:
+            self.similar_panel.set_status("No dataset catalog")
+            return
+        if (name := self.current_image_name()) is None:
+            self.similar_panel.set_status("No image")
+            return
+        self.similar_worker.search(
+            catalog, name, get_setting('similar_images'), self.tag_viewer.tags
+        )
+
+    def index_similar(self) -> None:
+        if (catalog := self.current_catalog()) is None:
+            self.similar_panel.set_status("No dataset catalog")
+            return
+        self.similar_worker.index(catalog)
+
+    def on_similar_progress(self, root: str, done: int, total: int) -> None:
+        if root == self.current_directory:
+            self.similar_panel.set_progress(done, total)
+
+    def on_similar_found(
+            self,
+            root: str,
+            name: str,
+            neighbours: list,
+            tags: list
+    ) -> None:
+        if root == self.current_directory:
+            self.similar_panel.set_results(root, name, neighbours, tags)
+
+    def on_similar_failed(self, root: str, message: str) -> None:
+        if root == self.current_directory:
+            self.similar_panel.set_status(message)
+
+    def add_similar_tag(self, tag: str) -> None:
+        self.tag_viewer.add_tag(tag)
+
+    def delete_duplicates(self, names: list[str]) -> None:
+        self.duplicates_panel.remove_images(self.delete_images(names))
+
+    def delete_images(self, names: list[str]) -> list[str]:
+        """
+        Delete images of the current directory with their sidecars, returns
+        the names of those deleted.
+        """
+        # A queued save would bring the sidecars back after deleting them.
+        self.save_queue.flush()
+        deleted = []
+        for name in names:
+            path = os.path.join(self.current_directory, name)
+            try:
+                delete_image_files(path)
+            except OSError as e:
+                print(f"Failed to delete {path}: {e}", file=sys.stderr)
+                continue
+            self.sidecars.invalidate(path)
+            deleted.append(name)
+        if deleted and (catalog := self.current_catalog()) is not None:
+            catalog.remove(deleted)
+            self.update_statistics(deleted, removed=True)
+        self.on_images_changed(self.scan_generation, [], deleted)
+        return deleted
+
+    def current_image_name(self) -> str | None:
+        if not self.image_paths:
+            return None
+        return self.image_paths[self.current_image_index]
+
+    def merge_image_names(self, names: list[str]) -> bool:
+        """
+        Merge names into the sorted `image_paths', keeping the current image
+        selected.  Returns whether anything was added.
+        """
+        new_names = []
+        for name in sorted(names):
+            i = bisect.bisect_left(self.image_paths, name)
+            if i == len(self.image_paths) or self.image_paths[i] != name:
+                new_names.append(name)
+        if not new_names:
+            return False
+        current = self.current_image_name()
+        self.image_paths = list(heapq.merge(self.image_paths, new_names))
+        if current is not None:
+            self.current_image_index = bisect.bisect_left(
+                self.image_paths, current
+            )
+        return True
+
+    def on_images_found(self, generation: int, names: list[str]) -> None:
+        if generation != self.scan_generation:
+            return
+        first = not self.image_paths
+        if not self.merge_image_names(names):
+            return
+        self.thumbnail_grid.set_images(self.current_directory, self.image_paths)
+        if first:
+            # Whatever `scandir' returned first, shown until the scan is done.
+            self.load_image(0)
+            self.provisional_image = self.current_image_name()
+        else:
+            self.thumbnail_grid.set_current_row(self.current_image_index)
+            self.image_nav.image_index.update_text()
 
-    def load_image(self, index: int, image_only: bool = False) -> None:
+    def on_scan_finished(self, generation: int) -> None:
+        if generation != self.scan_generation:
+            return
+        self.watcher.addPath(self.current_directory)
+        # Only directories with images get a catalog.
+        if self.image_paths:
+            self.open_catalog()
+        self.sync_catalog()
+        # Settle on the first image in sorted order, unless the user moved on
+        # or started editing in the meantime.
+        if (self.provisional_image is not None
+                and self.current_image_name() == self.provisional_image
+                and self.current_image_index != 0
+                and not self.is_dirty()):
+            self.load_image(0)
+        else:
+            self.schedule_prefetch()
+        self.provisional_image = None
+
+    def on_directory_changed(self, path: str) -> None:
+        if path == self.current_directory:
+            self.rescan_timer.start()
+
+    def rescan_directory(self) -> None:
+        if self.current_directory:
+            self.scanner.rescan(self.current_directory, set(self.image_paths))
+            # Also catches sidecars edited outside of the application.
+            self.sync_catalog()
+
+    def on_images_changed(
+            self,
+            generation: int,
+            added: list[str],
+            removed: list[str]
+    ) -> None:
+        if generation != self.scan_generation:
+            return
+        current = self.current_image_name()
+        if removed:
+            removed = set(removed)
+            self.image_paths = [
+                name for name in self.image_paths if name not in removed
+            ]
+        self.merge_image_names(added)
+        self.thumbnail_grid.set_images(self.current_directory, self.image_paths)
+        if not self.image_paths:
+            self.current_image_index = 0
+            self.image_nav.image_label.set_image(QImage())
+            self.image_nav.image_label.clear()
+            self.image_nav.image_title.setText("")
+        elif current is None or current in removed:
+            # The image on screen is gone, show its successor.
+            self.load_image(min(
+                bisect.bisect_left(self.image_paths, current or ""),
+                len(self.image_paths) - 1
+            ))
+        else:
+            self.current_image_index = bisect.bisect_left(
+                self.image_paths, current
+            )
+            self.thumbnail_grid.set_current_row(self.current_image_index)
+            self.schedule_prefetch()
+        self.image_nav.image_index.update_text()
+
+    def display_size(self) -> QSize:
+        """ Size, in device pixels, images are scaled to for display. """
+        return self.image_nav.image_label.target_size()
+
+    def load_image(self, index: int) -> None:
         if self.image_paths:
             image_path = os.path.join(
                 self.current_directory, self.image_paths[index]
             )
-            image_reader = QImageReader(str(image_path))
-            image_reader.setAutoTransform(True)
-            pixmap = QPixmap.fromImageReader(image_reader)
-            pixmap.setDevicePixelRatio(self.devicePixelRatio())
-            pixmap = pixmap.scaled(
-                self.image_nav.image_label.size() * pixmap.devicePixelRatio(),
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
-            )
-            if image_only:
-                return
-            self.image_nav.image_label.setPixmap(pixmap)
+            entry = self.prefetcher.take(image_path)
+            if entry is not None:
+                self.image_nav.image_label.set_image(entry.source, entry.image)
+            else:
+                self.image_nav.image_label.set_image(read_image(
+                    image_path, get_setting('max_image_pixels')
+                ))
             self.current_image_index = index
+            self.thumbnail_grid.set_current_row(index)
             self.load_tags_and_description()
+            self.schedule_prefetch()
+
+    def on_thumbnail_selected(self, index: int) -> None:
+        if index != self.current_image_index:
+            cancel = self.prompt_for_save_if_dirty()
+            if cancel:
+                return
+            self.load_image(index)
+        self.view_tabs.setCurrentWidget(self.image_nav)
+
+    def schedule_prefetch(self) -> None:
+        index = self.current_image_index
+        ahead = range(index + 1, index + 1 + get_setting('prefetch_ahead'))
+        behind = range(index - 1, index - 1 - get_setting('prefetch_behind'), -1)
+        paths = [
+            os.path.join(self.current_directory, self.image_paths[i])
+            for i in [*ahead, *behind]
+            if 0 <= i < len(self.image_paths)
+        ]
+        self.prefetcher.schedule(paths, self.display_size())
+        if get_setting('prefetch_captions'):
+            self.desc_recommendations.prefetch(paths[:len(ahead)])
+
+    def current_image_path(self) -> str | None:
+        if not self.image_paths:
+            return None
+        return os.path.join(
+            self.current_directory, self.image_paths[self.current_image_index]
+        )
 
     def load_tags_and_description(self) -> None:
+        """
+        Show the sidecars of the current image.  They come from the in-memory
+        store, which only rereads them if they changed on disk.
+        """
         if not self.image_paths:
             return
         current_image_name = self.image_paths[self.current_image_index]
-        tags_file = os.path.join(
-            self.current_directory,
-            f"{os.path.splitext(current_image_name)[0]}.txt"
-        )
-        description_file = os.path.join(
-            self.current_directory,
-            f"{os.path.splitext(current_image_name)[0]}.caption"
-        )
+        image_path = self.current_image_path()
+        record = self.sidecars.load(image_path)
 
         # Load tags
-        if os.path.exists(tags_file):
-            with open(tags_file, 'r') as f:
-                tags = f.read().replace("\n", " ").strip()
-                self.tag_viewer.setText(tags)
+        if record.tags is not None:
+            self.tag_viewer.setText(record.tags)
         else:
             self.tag_viewer.setTags([])
 
         # Load description
-        if os.path.exists(description_file):
-            with open(description_file, 'r') as f:
-                description = f.read().replace("\n", " ").strip()
-                self.description_edit.setText(description)
-        else:
-            self.description_edit.setText("")
+        self.description_edit.setText(record.caption or "")
+        # Setting the texts above went through the edit signals.
+        self.dirty = False
 
         # Set image title and index
         self.image_nav.image_title.setText(current_image_name)
         self.image_nav.image_index.update_text()
 
         # Load recommendations
-        self.tag_recommendations.set_image(
-            os.path.join(self.current_directory, current_image_name)
-        )
-        self.desc_recommendations.set_image(
-            os.path.join(self.current_directory, current_image_name)
-        )
+        self.tag_recommendations.set_image(image_path)
+        self.desc_recommendations.set_image(image_path)
+
+    def mark_dirty(self) -> None:
+        self.dirty = True
 
     def is_dirty(self) -> bool:
-        if not self.image_paths:
+        """
+        Whether the editors differ from the sidecars.  Only compared, against
+        the in-memory record, once an edit signal fired.
+        """
+        if not self.dirty or not self.image_paths:
             return False
-
-        current_image_name = self.image_paths[self.current_image_index]
-        tags_file = os.path.join(
-            self.current_directory,
-            f"{os.path.splitext(current_image_name)[0]}.txt"
-        )
-        if os.path.exists(tags_file):
-            with open(tags_file, 'r') as f:
-                tags = f.read().strip()
-                have_tags = self.tag_viewer.toPlainText().replace("\n", " ")
-                have_tags = have_tags.strip()
-                if tags != have_tags:
-                    return True
-        elif self.tag_viewer.toPlainText().replace("\n", " ").strip() != "":
+        record = self.sidecars.load(self.current_image_path())
+        have_tags = self.tag_viewer.toPlainText().replace("\n", " ").strip()
+        if have_tags != (record.tags or ""):
             return True
-
-        description_file = os.path.join(
-            self.current_directory,
-            f"{os.path.splitext(current_image_name)[0]}.caption"
-        )
-        if os.path.exists(description_file):
-            with open(description_file, 'r') as f:
-                description = f.read().strip()
-                have_description = self.description_edit.toPlainText()
-                have_description = have_description.replace("\n", " ").strip()
-                return have_description != description
-        else:
-            have_description = self.description_edit.toPlainText()
-            have_description = have_description.replace("\n", " ").strip()
-            return have_description != ""
+        have_description = self.description_edit.toPlainText()
+        have_description = have_description.replace("\n", " ").strip()
+        return have_description != (record.caption or "")
 
     def prompt_for_save_if_dirty(self) -> bool:
         "Returns True if the user wants to cancel an action"
         if not self.is_dirty():
             return False
+        if get_setting('autosave_on_navigate'):
+            self.save_tags_and_description()
+            return False
         reply = QMessageBox.question(
             self,
             "Save",
@@ -425,27 +866,36 @@ class ImageTagManager(QMainWindow):
         self.tag_recommendations.update_tags()
 
     def save_tags_and_description(self) -> None:
+        """
+        Hand the editors' texts to the save queue, they are written in the
+        background.
+        """
         if not self.image_paths:
             return
-        current_image_name = self.image_paths[self.current_image_index]
-        tags_file = os.path.join(
-            self.current_directory,
-            f"{os.path.splitext(current_image_name)[0]}.txt"
-        )
-        description_file = os.path.join(
-            self.current_directory,
-            f"{os.path.splitext(current_image_name)[0]}.caption"
+        tags = self.tag_viewer.toPlainText()
+        description = self.description_edit.toPlainText()
+        description = description.replace('\n', ' ').strip()
+        self.save_queue.save(
+            self.current_image_path(),
+            tags,
+            description,
+            self.current_catalog()
         )
-        # Save tags
-        with open(tags_file, 'w') as f:
-            f.write(self.tag_viewer.toPlainText())
-        # Save description
-        with open(description_file, 'w') as f:
-            f.write(
-                self.description_edit.toPlainText().replace('\n', ' ').strip()
-            )
+        self.dirty = False
         self.clear_redundant_tag_recommendations()
 
+    def on_image_saved(self, image_path: str) -> None:
+        if os.path.dirname(image_path) == self.current_directory:
+            self.update_statistics([os.path.basename(image_path)])
+
+    def on_save_failed(self, image_path: str, error: str) -> None:
+        QMessageBox.warning(
+            self,
+            "Save failed",
+            f"Could not save the tags of {os.path.basename(image_path)}:\n"
+            f"{error}"
+        )
+
     def on_tree_view_changed(self, index: QModelIndex) -> None:
         cancel = self.prompt_for_save_if_dirty()
         if cancel:
@@ -455,18 +905,9 @@ class ImageTagManager(QMainWindow):
             self.current_directory = f
             self.load_images_in_directory()
         else:
-            if str(f).lower().endswith(
-                    ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
-            ):
+            if str(f).lower().endswith(IMAGE_EXTENSIONS):
                 self.current_directory = os.path.dirname(f)
-                self.load_images_in_directory()
-                # Set index accordingly
-                idx = 0
-                for img in self.image_paths:
-                    if os.path.basename(img) == os.path.basename(f):
-                        self.load_image(idx)
-                        break
-                    idx = idx + 1
+                self.load_images_in_directory(select=os.path.basename(f))
 
     def next_image(self) -> None:
         cancel = self.prompt_for_save_if_dirty()
@@ -482,6 +923,63 @@ class ImageTagManager(QMainWindow):
         if self.current_image_index > 0:
             self.load_image(self.current_image_index - 1)
 
+    def paintEvent(self, event) -> None:
+        super().paintEvent(event)
+        if self.first_paint_time is None:
+            self.first_paint_time = time.perf_counter() - _start_time
+            if os.environ.get("TAGGUI_STARTUP_TIMING"):
+                QTimer.singleShot(0, self.report_startup_time)
+
+    def report_startup_time(self) -> None:
+        """
+        Print startup timings, enabled by setting `TAGGUI_STARTUP_TIMING'.
+        With `TAGGUI_STARTUP_TIMING=exit' the process quits right after, which
+        is what `benchmarks/startup_bench.py' uses.
+        """
+        print(
+            f"startup: imports {_import_time * 1000:.1f} ms, "
+            f"first paint {self.first_paint_time * 1000:.1f} ms",
+            file=sys.stderr,
+            flush=True
+        )
+        if os.environ.get("TAGGUI_STARTUP_TIMING") == "exit":
+            # Skip waiting on the model threads, we only wanted the timings.
+            os._exit(0)
+
+    def closeEvent(self, event) -> None:
+        if get_setting('autosave_on_navigate') and self.is_dirty():
+            self.save_tags_and_description()
+        # Pending saves are written before the catalog is closed below.
+        self.save_queue.stop()
+        # Model threads can not be interrupted mid-load, let them finish
+        # instead of destroying running threads.
+        self.prefetcher.stop()
+        self.scanner.stop()
+        self.catalog_worker.stop()
+        self.statistics_worker.stop()
+        self.duplicates_worker.stop()
+        self.similar_worker.stop()
+        self.tag_recommendations.shutdown()
+        self.desc_recommendations.shutdown()
+        self.prefetcher.wait()
+        self.scanner.wait()
+        self.catalog_worker.wait()
+        self.save_queue.wait()
+        self.statistics_worker.wait()
+        self.duplicates_worker.wait()
+        self.similar_worker.wait()
+        if self.catalog is not None:
+            if self.statistics_changed and self.current_statistics() is not None:
+                # Loaded by the statistics worker already.
+                from tag_statistics import statistics_cache_path
+                try:
+                    self.statistics.save(statistics_cache_path(self.catalog))
+                except OSError as e:
+                    print(f"Failed to cache statistics: {e}", file=sys.stderr)
+            self.catalog.close()
+        self.thumbnail_grid.shutdown()
+        super().closeEvent(event)
+
     def keyPressEvent(self, event: QKeyEvent) -> None:
         if event.key() == Qt.Key_Right:
             self.next_image()
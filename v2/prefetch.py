@@ -0,0 +1,169 @@
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from PySide6.QtCore import QThread, QObject, QSize, Qt
+from PySide6.QtGui import QImage
+
+from image_io import read_image
+from sidecars import SidecarStore
+from tag_recommendations import TaggerWorker
+from util import file_mtime
+
+
+class PrefetchEntry():
+    """
+    Everything needed to show an image without touching the disk: the decoded
+    `source' and a copy smoothly scaled to `target_size'.
+    """
+    def __init__(
+            self,
+            source: QImage,
+            image: QImage,
+            target_size: QSize
+    ) -> None:
+        self.source = source
+        self.image = image
+        self.target_size = target_size
+
+    def size_in_bytes(self) -> int:
+        return self.source.sizeInBytes() + self.image.sizeInBytes()
+
+
+class Prefetcher(QThread):
+    """
+    Decodes and scales the neighbours of the current image, loads their
+    sidecars into the `SidecarStore' and has the `TaggerWorker' warm the
+    prediction cache, all in the background.
+
+    Results live in a memory bounded LRU keyed by path and validated against
+    the file's modification time, so an image changed on disk is never served
+    stale.  Scheduling new neighbours replaces whatever was still queued.
+    """
+    def __init__(
+            self,
+            tagger_worker: TaggerWorker = None,
+            sidecars: SidecarStore = None,
+            max_bytes: int = 256 * 1024 * 1024,
+            max_pixels: int = None,
+            parent: QObject = None
+    ) -> None:
+        super().__init__(parent)
+        self.tagger_worker = tagger_worker
+        self.sidecars = sidecars
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self._condition = threading.Condition()
+        self._queue: list[str] = []
+        self._target_size = QSize()
+        self._stopping = False
+        # path -> (mtime, entry)
+        self._cache: OrderedDict[str, tuple[int, PrefetchEntry]] = OrderedDict()
+        self._cached_bytes = 0
+
+    def schedule(self, paths: list[str], target_size: QSize) -> None:
+        with self._condition:
+            self._queue = list(paths)
+            self._target_size = QSize(target_size)
+            self._condition.notify()
+        # Predictions go through the worker, which owns the model session.
+        if self.tagger_worker is not None:
+            self.tagger_worker.prefetch([Path(path) for path in paths])
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopping = True
+            self._queue = []
+            self._condition.notify()
+
+    def take(self, path: str) -> PrefetchEntry | None:
+        """
+        Cached entry for `path' if the file did not change since.  The scaled
+        copy may be for a different size, callers should check.
+        """
+        mtime = file_mtime(path)
+        with self._condition:
+            cached = self._cache.get(path)
+            if cached is None:
+                return None
+            if cached[0] != mtime:
+                self._drop(path)
+                return None
+            self._cache.move_to_end(path)
+            return cached[1]
+
+    def invalidate(self, path: str) -> None:
+        with self._condition:
+            self._drop(path)
+
+    def clear(self) -> None:
+        with self._condition:
+            self._cache.clear()
+            self._cached_bytes = 0
+
+    def _drop(self, path: str) -> None:
+        cached = self._cache.pop(path, None)
+        if cached is not None:
+            self._cached_bytes -= cached[1].size_in_bytes()
+
+    def _store(self, path: str, mtime: int, entry: PrefetchEntry) -> None:
+        with self._condition:
+            self._drop(path)
+            self._cache[path] = (mtime, entry)
+            self._cached_bytes += entry.size_in_bytes()
+            while self._cached_bytes > self.max_bytes and len(self._cache) > 1:
+                self._drop(next(iter(self._cache)))
+
+    def _next(self) -> tuple[str, QSize] | None:
+        with self._condition:
+            while not self._queue and not self._stopping:
+                self._condition.wait()
+            if self._stopping:
+                return None
+            return self._queue.pop(0), QSize(self._target_size)
+
+    def _cached(self, path: str, mtime: int) -> PrefetchEntry | None:
+        with self._condition:
+            cached = self._cache.get(path)
+            if cached is None or cached[0] != mtime:
+                return None
+            return cached[1]
+
+    def run(self) -> None:
+        while (job := self._next()) is not None:
+            path, target_size = job
+            try:
+                self._prefetch(path, target_size)
+            except Exception as e:
+                print(f"Failed to prefetch {path}: {e}", file=sys.stderr)
+
+    def _prefetch(self, path: str, target_size: QSize) -> None:
+        mtime = file_mtime(path)
+        if mtime is None:
+            return
+        entry = self._cached(path, mtime)
+        if entry is not None and entry.target_size != target_size:
+            # Only the scaled copy is out of date, rescale from the source.
+            self._store(path, mtime, PrefetchEntry(
+                entry.source,
+                entry.source.scaled(
+                    target_size,
+                    Qt.AspectRatioMode.KeepAspectRatio,
+                    Qt.TransformationMode.SmoothTransformation
+                ),
+                target_size
+            ))
+        elif entry is None:
+            source = read_image(path, self.max_pixels)
+            if source.isNull():
+                return
+            image = source.scaled(
+                target_size,
+                Qt.AspectRatioMode.KeepAspectRatio,
+                Qt.TransformationMode.SmoothTransformation
+            )
+            self._store(path, mtime, PrefetchEntry(source, image, target_size))
+
+        if self.sidecars is not None:
+            self.sidecars.load(path)
@@ -0,0 +1,120 @@
+import os
+import sys
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from PySide6.QtCore import QThread, Signal, QObject
+
+from catalog import Catalog
+from sidecars import SidecarStore
+from util import atomic_write_text, sidecar_paths
+
+
+class SaveJob():
+    def __init__(
+            self,
+            image_path: str,
+            tags: str,
+            caption: str,
+            catalog: Catalog | None
+    ) -> None:
+        self.image_path = image_path
+        self.tags = tags
+        self.caption = caption
+        self.catalog = catalog
+
+
+class SaveQueue(QThread):
+    """
+    Writes sidecars behind the GUI's back.
+
+    A save is recorded as pending in the `SidecarStore' right away, so the
+    editors see it even before it reaches the disk, and queued per image;
+    saving the same image again before it was written only keeps the latest
+    texts.  Each sidecar is written to a temporary file and renamed into
+    place, a crash never leaves a truncated sidecar behind.
+    """
+    saveFailed = Signal(str, str)
+    # Emitted once an image's sidecars, and its catalog entry, are written.
+    saved = Signal(str)
+
+    def __init__(self, sidecars: SidecarStore, parent: QObject = None) -> None:
+        super().__init__(parent)
+        self.sidecars = sidecars
+        self._condition = threading.Condition()
+        self._jobs: OrderedDict[str, SaveJob] = OrderedDict()
+        self._writing = 0
+        self._stopping = False
+
+    def save(
+            self,
+            image_path: str,
+            tags: str,
+            caption: str,
+            catalog: Catalog = None
+    ) -> None:
+        with self._condition:
+            self.sidecars.saved(image_path, tags, caption, pending=True)
+            self._jobs.pop(image_path, None)
+            self._jobs[image_path] = SaveJob(image_path, tags, caption, catalog)
+            self._condition.notify_all()
+
+    def flush(self) -> None:
+        """ Block until every queued save has been written. """
+        with self._condition:
+            while self._jobs or self._writing:
+                self._condition.wait()
+
+    def stop(self) -> None:
+        """ Finish writing what is queued, then end the thread. """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+
+    def _next(self) -> SaveJob | None:
+        with self._condition:
+            while not self._jobs and not self._stopping:
+                self._condition.wait()
+            if not self._jobs:
+                return None
+            _, job = self._jobs.popitem(last=False)
+            self._writing += 1
+            return job
+
+    def _write(self, job: SaveJob) -> bool:
+        tags_path, caption_path = sidecar_paths(job.image_path)
+        try:
+            atomic_write_text(tags_path, job.tags)
+            atomic_write_text(caption_path, job.caption)
+        except OSError as e:
+            print(f"Failed to save {job.image_path}: {e}", file=sys.stderr)
+            self.saveFailed.emit(job.image_path, str(e))
+            return False
+        if job.catalog is not None:
+            try:
+                job.catalog.update(os.path.basename(job.image_path))
+            except (OSError, sqlite3.Error) as e:
+                print(f"Failed to update catalog: {e}", file=sys.stderr)
+        self.saved.emit(job.image_path)
+        return True
+
+    def _finish(self, job: SaveJob, written: bool) -> None:
+        with self._condition:
+            self._writing -= 1
+            # A newer save of the same image is queued, its texts stay.
+            if job.image_path not in self._jobs:
+                if written:
+                    self.sidecars.saved(job.image_path, job.tags, job.caption)
+                else:
+                    # Forget the texts so the editors show what is on disk.
+                    self.sidecars.invalidate(job.image_path)
+            self._condition.notify_all()
+
+    def run(self) -> None:
+        while (job := self._next()) is not None:
+            written = False
+            try:
+                written = self._write(job)
+            finally:
+                self._finish(job, written)
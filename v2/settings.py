@@ -0,0 +1,62 @@
+from PySide6.QtCore import QSettings
+
+# Defaults for every user configurable setting, the type of each default is
+# also the type the stored value is read back as.
+DEFAULT_SETTINGS = {
+    # Number of images after / before the current one to prefetch.
+    'prefetch_ahead': 3,
+    'prefetch_behind': 1,
+    # Memory cap for prefetched images, in MiB.
+    'prefetch_cache_mb': 256,
+    # Captioning is expensive, only prefetch captions when asked to.
+    'prefetch_captions': False,
+    # Larger images are decoded at a reduced size for display.
+    'max_image_pixels': 16 * 1024 * 1024,
+    # Edge length of thumbnails in the grid view.
+    'thumbnail_size': 128,
+    # Interrogator recommending tags, a key of `tagger.interrogators', INT8
+    # variants made by `python3 -m tagger.quantize' included.
+    'tagger_model': 'wd14-convnextv2.v1',
+    # More interrogators run with it on each image as an ensemble, their
+    # confidences merged by `max', `mean' or `vote'.
+    'tagger_ensemble': [],
+    'ensemble_merge': 'mean',
+    # Save edits when moving to another image instead of asking.
+    'autosave_on_navigate': False,
+    # JSON file of tag groups for filtering redundant recommendations, empty
+    # for the bundled `tagger/tag_groups.json'.
+    'tag_groups_file': '',
+    # Bits perceptual hashes may differ by for images to be near duplicates,
+    # and the hash compared (`phash' or `dhash').
+    'duplicate_distance': 6,
+    'duplicate_hash': 'phash',
+    # What images are embedded by for finding similar ones, the tag
+    # confidences or the model's penultimate layer (`penultimate', needs
+    # the onnx package), and how many similar images to show.
+    'embedding_layer': 'confidences',
+    'similar_images': 24,
+    # ONNX Runtime threads per operator and across independent operators,
+    # 0 for its defaults.  The models of an ensemble share the threads per
+    # operator.  Graph optimization level is `disable', `basic', `extended'
+    # or `all'.  Optimized graphs are cached so later starts skip
+    # optimizing, and the model is run once on a blank image after loading
+    # so the first image does not pay for initialization.
+    'intra_op_threads': 0,
+    'inter_op_threads': 0,
+    'graph_optimization': 'all',
+    'cache_optimized_models': True,
+    'warm_up_model': True,
+}
+
+
+def get_settings() -> QSettings:
+    return QSettings('taggui', 'taggui')
+
+
+def get_setting(key: str):
+    default = DEFAULT_SETTINGS[key]
+    return get_settings().value(key, default, type=type(default))
+
+
+def set_setting(key: str, value) -> None:
+    get_settings().setValue(key, value)
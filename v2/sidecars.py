@@ -0,0 +1,108 @@
+import threading
+from collections import OrderedDict
+
+from util import file_mtime, sidecar_paths, read_sidecar
+
+
+class SidecarRecord():
+    """
+    Tags and caption of an image as last read from (or written to) disk,
+    with the sidecars' modification times at that point.  A missing sidecar
+    has `None' for both its text and its mtime.
+    """
+    def __init__(
+            self,
+            tags: str | None,
+            caption: str | None,
+            mtimes: tuple[int | None, int | None],
+            pending: bool = False
+    ) -> None:
+        self.tags = tags
+        self.caption = caption
+        self.mtimes = mtimes
+        # Saved but not written yet, the disk is behind.
+        self.pending = pending
+
+
+class SidecarStore():
+    """
+    In-memory records of the `.txt' and `.caption' sidecars of images, keyed
+    by image path.  `load' only stats the sidecars of a known image and
+    rereads them when their modification time changed.  Safe to use from the
+    prefetch thread and the GUI thread at once.
+    """
+    def __init__(self, max_entries: int = 10000) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._records: OrderedDict[str, SidecarRecord] = OrderedDict()
+
+    def load(self, image_path: str) -> SidecarRecord:
+        tags_path, caption_path = sidecar_paths(image_path)
+        mtimes = (file_mtime(tags_path), file_mtime(caption_path))
+        with self._lock:
+            old = self._records.get(image_path)
+            if old is not None and (old.pending or old.mtimes == mtimes):
+                self._records.move_to_end(image_path)
+                return old
+        record = SidecarRecord(
+            self._reread(tags_path, mtimes[0], old and old.mtimes[0],
+                         old and old.tags),
+            self._reread(caption_path, mtimes[1], old and old.mtimes[1],
+                         old and old.caption),
+            mtimes
+        )
+        self._store(image_path, record)
+        return record
+
+    @staticmethod
+    def _reread(
+            path: str,
+            mtime: int | None,
+            old_mtime: int | None,
+            old_text: str | None
+    ) -> str | None:
+        if mtime is None:
+            return None
+        if mtime == old_mtime:
+            return old_text
+        return read_sidecar(path)
+
+    def saved(
+            self,
+            image_path: str,
+            tags: str,
+            caption: str,
+            pending: bool = False
+    ) -> SidecarRecord:
+        """
+        Record texts written by us without reading them back, or about to be
+        written when `pending'.  A pending record is served as is until the
+        write is recorded.
+        """
+        tags_path, caption_path = sidecar_paths(image_path)
+        mtimes = (None, None)
+        if not pending:
+            mtimes = (file_mtime(tags_path), file_mtime(caption_path))
+        record = SidecarRecord(
+            tags.replace("\n", " ").strip(),
+            caption.replace("\n", " ").strip(),
+            mtimes,
+            pending
+        )
+        self._store(image_path, record)
+        return record
+
+    def invalidate(self, image_path: str) -> None:
+        with self._lock:
+            self._records.pop(image_path, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+
+    def _store(self, image_path: str, record: SidecarRecord) -> None:
+        with self._lock:
+            self._records[image_path] = record
+            self._records.move_to_end(image_path)
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
@@ -0,0 +1,293 @@
+import os
+import sys
+import threading
+
+from PySide6.QtCore import Qt, QObject, QSize, QThread, Signal
+from PySide6.QtGui import QIcon, QPixmap
+from PySide6.QtWidgets import (
+    QHBoxLayout,
+    QLabel,
+    QListView,
+    QListWidget,
+    QListWidgetItem,
+    QPushButton,
+    QSplitter,
+    QVBoxLayout,
+    QWidget
+)
+
+from catalog import Catalog
+from tag_chips import TagChipView
+from tagger.tagger import Tagger
+from thumbnail_grid import ThumbnailCache
+
+
+class SimilarWorker(QThread):
+    """
+    Embeds images with the tagger model and searches their embedding index
+    in the background.  A search embeds the image searched for if needed,
+    indexing embeds every image of a catalog without a current embedding.
+    Only the most recent request is served, a new one interrupts indexing.
+
+    The tagger is shared with the tag recommendations, whose worker loads
+    its model; requests fail until it is loaded.
+    """
+    progress = Signal(str, int, int)
+    similarFound = Signal(str, str, object, object)
+    failed = Signal(str, str)
+    # Embeddings added to the index at once while indexing.
+    CHUNK_SIZE = 64
+
+    def __init__(self, tagger: Tagger, parent: QObject = None) -> None:
+        super().__init__(parent)
+        self.tagger = tagger
+        self._condition = threading.Condition()
+        self._pending: tuple | None = None
+        self._stopping = False
+        # Index of the last catalog served, saved when another is opened.
+        self._index = None
+
+    def search(
+            self,
+            catalog: Catalog,
+            name: str,
+            k: int,
+            exclude_tags: list[str]
+    ) -> None:
+        with self._condition:
+            self._pending = ('search', catalog, name, k, list(exclude_tags))
+            self._condition.notify()
+
+    def index(self, catalog: Catalog) -> None:
+        with self._condition:
+            self._pending = ('index', catalog)
+            self._condition.notify()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopping = True
+            self._pending = None
+            self._condition.notify()
+
+    def _should_stop(self) -> bool:
+        with self._condition:
+            return self._stopping or self._pending is not None
+
+    def _next(self) -> tuple | None:
+        with self._condition:
+            while self._pending is None and not self._stopping:
+                self._condition.wait()
+            job, self._pending = self._pending, None
+            return job
+
+    def _open_index(self, root: str):
+        from tagger.embeddings import EmbeddingIndex, embedding_index_dir
+        directory = embedding_index_dir(
+            root,
+            self.tagger.interrogator_name,
+            self.tagger.interrogator.embedding_layer
+        )
+        if self._index is None or self._index.directory != directory:
+            if self._index is not None:
+                self._index.save()
+            self._index = EmbeddingIndex.open(directory)
+        return self._index
+
+    def _search(
+            self,
+            catalog: Catalog,
+            name: str,
+            k: int,
+            exclude_tags: list[str]
+    ) -> None:
+        from tagger.embeddings import neighbour_tags
+        index = self._open_index(catalog.root)
+        path = os.path.join(catalog.root, name)
+        st = os.stat(path)
+        stat = (st.st_size, st.st_mtime_ns)
+        query = index.get(name, stat)
+        if query is None:
+            query = self.tagger.embed_image(path)
+            index.add([name], [stat], [query])
+        # Images deleted since indexed are still in the index.
+        neighbours = [
+            (other, similarity)
+            for other, similarity in index.search(query, 2 * k + 1)
+            if other != name
+            and os.path.exists(os.path.join(catalog.root, other))
+        ][:k]
+        tags = neighbour_tags(neighbours, catalog.tags, exclude=exclude_tags)
+        self.similarFound.emit(catalog.root, name, neighbours, tags)
+
+    def _embed_all(self, catalog: Catalog) -> None:
+        index = self._open_index(catalog.root)
+        catalog.sync(should_stop=self._should_stop)
+        stats = {name: (size, mtime) for name, size, mtime
+                 in catalog.image_stats()}
+        index.remove([name for name in index.rows if name not in stats])
+        names = [
+            name for name, stat in stats.items()
+            if not index.is_current(name, stat)
+        ]
+        self.progress.emit(catalog.root, 0, len(names))
+        for start in range(0, len(names), self.CHUNK_SIZE):
+            chunk, embedded, vectors = [], [], []
+            for name in names[start:start + self.CHUNK_SIZE]:
+                try:
+                    vectors.append(self.tagger.embed_image(
+                        os.path.join(catalog.root, name)
+                    ))
+                    embedded.append(name)
+                except Exception as e:
+                    print(f"Failed to embed {name}: {e}", file=sys.stderr)
+                chunk.append(name)
+            index.add(embedded, [stats[name] for name in embedded], vectors)
+            self.progress.emit(
+                catalog.root, start + len(chunk), len(names)
+            )
+            if self._should_stop():
+                break
+        else:
+            if index.needs_training():
+                index.train()
+        index.save()
+
+    def run(self) -> None:
+        try:
+            while (job := self._next()) is not None:
+                kind, catalog = job[:2]
+                if not self.tagger.interrogator.is_loaded():
+                    self.failed.emit(catalog.root, "The model is not loaded yet")
+                    continue
+                try:
+                    if kind == 'search':
+                        self._search(catalog, *job[2:])
+                    else:
+                        self._embed_all(catalog)
+                except Exception as e:
+                    # Model runs fail with ONNX Runtime's own exceptions.
+                    print(f"Failed to find similar images in {catalog.root}: "
+                          f"{e}", file=sys.stderr)
+                    self.failed.emit(catalog.root, str(e))
+        finally:
+            if self._index is not None:
+                try:
+                    self._index.save()
+                except OSError as e:
+                    print(f"Failed to save embeddings: {e}", file=sys.stderr)
+
+
+class SimilarImagesWidget(QWidget):
+    """
+    Images most similar to the current one by their tagger embeddings, and
+    tags common among them which the current image lacks.  Images must be
+    indexed first, or by the bulk tagger with `--embeddings'.
+    """
+    searchRequested = Signal()
+    indexRequested = Signal()
+    imageActivated = Signal(str)
+    tagAdded = Signal(str)
+    THUMBNAIL_SIZE = 128
+
+    def __init__(self, parent: QWidget = None) -> None:
+        super().__init__(parent)
+        self.directory = ''
+        self.thumbnails = ThumbnailCache.shared()
+
+        self.main_layout = QVBoxLayout(self)
+        self.controls_layout = QHBoxLayout()
+        self.find_button = QPushButton("Find similar", self)
+        self.find_button.setToolTip("Images most similar to the current one")
+        self.find_button.clicked.connect(self.on_find)
+        self.controls_layout.addWidget(self.find_button)
+        self.index_button = QPushButton("Index images", self)
+        self.index_button.setToolTip(
+            "Embed every image of the directory not embedded yet"
+        )
+        self.index_button.clicked.connect(self.on_index)
+        self.controls_layout.addWidget(self.index_button)
+        self.status = QLabel(self)
+        self.controls_layout.addWidget(self.status, 1)
+        self.main_layout.addLayout(self.controls_layout)
+
+        self.splitter = QSplitter(Qt.Vertical, self)
+        self.main_layout.addWidget(self.splitter)
+        self.image_list = QListWidget(self)
+        self.image_list.setViewMode(QListView.ViewMode.IconMode)
+        self.image_list.setResizeMode(QListView.ResizeMode.Adjust)
+        self.image_list.setMovement(QListView.Movement.Static)
+        self.image_list.setIconSize(
+            QSize(self.THUMBNAIL_SIZE, self.THUMBNAIL_SIZE)
+        )
+        self.image_list.setGridSize(
+            QSize(self.THUMBNAIL_SIZE + 32, self.THUMBNAIL_SIZE + 40)
+        )
+        self.image_list.setWordWrap(True)
+        self.image_list.itemActivated.connect(
+            lambda item: self.imageActivated.emit(item.data(Qt.UserRole))
+        )
+        self.splitter.addWidget(self.image_list)
+        self.tags_widget = QWidget(self)
+        self.tags_layout = QVBoxLayout(self.tags_widget)
+        self.tags_layout.setContentsMargins(0, 0, 0, 0)
+        self.tags_layout.addWidget(
+            QLabel("Tags common among similar images", self)
+        )
+        self.chip_view = TagChipView("+", self)
+        self.chip_view.buttonClicked.connect(self.on_tag_clicked)
+        self.tags_layout.addWidget(self.chip_view)
+        self.splitter.addWidget(self.tags_widget)
+        self.splitter.setStretchFactor(0, 3)
+        self.splitter.setStretchFactor(1, 1)
+        self.tags: list[str] = []
+
+    def on_find(self) -> None:
+        self.status.setText("Searching...")
+        self.searchRequested.emit()
+
+    def on_index(self) -> None:
+        self.status.setText("Indexing...")
+        self.indexRequested.emit()
+
+    def set_status(self, text: str) -> None:
+        self.status.setText(text)
+
+    def set_progress(self, done: int, total: int) -> None:
+        self.status.setText(
+            f"Embedding images: {done}/{total}" if done < total else
+            f"Indexed {total} new images"
+        )
+
+    def clear(self) -> None:
+        self.set_results('', '', [], [])
+
+    def set_results(
+            self,
+            directory: str,
+            name: str,
+            neighbours: list[tuple[str, float]],
+            tags: list[tuple[str, float]]
+    ) -> None:
+        self.directory = directory
+        self.status.setText(
+            f"{len(neighbours)} images similar to {name}" if name else ""
+        )
+        self.image_list.clear()
+        for other, similarity in neighbours:
+            path = os.path.join(directory, other)
+            thumbnail = self.thumbnails.load(path, self.THUMBNAIL_SIZE)
+            item = QListWidgetItem(
+                QIcon(QPixmap.fromImage(thumbnail)),
+                f"{other}\n{similarity:.2f}"
+            )
+            item.setToolTip(other)
+            item.setData(Qt.UserRole, other)
+            self.image_list.addItem(item)
+        self.tags = [tag for tag, _ in tags]
+        self.chip_view.set_tags(self.tags)
+
+    def on_tag_clicked(self, tag: str) -> None:
+        if tag in self.tags:
+            self.tags.remove(tag)
+            self.chip_view.set_tags(self.tags)
+        self.tagAdded.emit(tag)
@@ -0,0 +1,215 @@
+import sys
+import sqlite3
+import threading
+
+from PySide6.QtCore import (
+    Qt,
+    QAbstractTableModel,
+    QModelIndex,
+    QObject,
+    QSortFilterProxyModel,
+    QThread,
+    Signal
+)
+from PySide6.QtWidgets import (
+    QAbstractItemView,
+    QHeaderView,
+    QLabel,
+    QLineEdit,
+    QSplitter,
+    QTableView,
+    QVBoxLayout,
+    QWidget
+)
+
+from catalog import Catalog
+
+
+class StatisticsWorker(QThread):
+    """
+    Builds the tag statistics of a catalog in the background, from the disk
+    cache when it is current.  Only the most recent request is served.
+    """
+    statisticsReady = Signal(str, object)
+
+    def __init__(self, parent: QObject = None) -> None:
+        super().__init__(parent)
+        self._condition = threading.Condition()
+        self._pending: Catalog | None = None
+        self._stopping = False
+
+    def build(self, catalog: Catalog) -> None:
+        with self._condition:
+            self._pending = catalog
+            self._condition.notify()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopping = True
+            self._pending = None
+            self._condition.notify()
+
+    def _next(self) -> Catalog | None:
+        with self._condition:
+            while self._pending is None and not self._stopping:
+                self._condition.wait()
+            catalog, self._pending = self._pending, None
+            return catalog
+
+    def run(self) -> None:
+        while (catalog := self._next()) is not None:
+            # numpy and scipy are slow to import, keep them off startup.
+            from tag_statistics import TagStatistics
+            try:
+                stats = TagStatistics.for_catalog(catalog)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Failed to build tag statistics of {catalog.root}: {e}",
+                      file=sys.stderr)
+                continue
+            self.statisticsReady.emit(catalog.root, stats)
+
+
+class StatisticsTableModel(QAbstractTableModel):
+    """
+    Read-only rows of a tag followed by numbers.  Numbers are formatted for
+    display and sort by value through `Qt.UserRole'.
+    """
+    def __init__(self, headers: list[str], parent: QObject = None) -> None:
+        super().__init__(parent)
+        self.headers = headers
+        self.rows: list[tuple] = []
+
+    def set_rows(self, rows: list[tuple]) -> None:
+        self.beginResetModel()
+        self.rows = rows
+        self.endResetModel()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section: int, orientation: Qt.Orientation,
+                   role: int = Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        value = self.rows[index.row()][index.column()]
+        if role == Qt.UserRole:
+            return value
+        if role == Qt.DisplayRole:
+            if isinstance(value, float):
+                return f'{value:.3f}'
+            return str(value)
+        if role == Qt.TextAlignmentRole and index.column() > 0:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+
+class TagStatisticsWidget(QWidget):
+    """
+    Tag frequencies of the dataset, and for the selected tag the tags most
+    often seen with it.
+    """
+    # Co-occurring tags listed for the selected tag.
+    COOCCURRING_LIMIT = 500
+
+    def __init__(self, parent: QWidget = None) -> None:
+        super().__init__(parent)
+        self.statistics = None
+        # Statistics changed while the panel was hidden.
+        self.stale = False
+
+        self.main_layout = QVBoxLayout(self)
+        self.summary = QLabel(self)
+        self.main_layout.addWidget(self.summary)
+        self.filter_edit = QLineEdit(self)
+        self.filter_edit.setPlaceholderText("Filter tags")
+        self.main_layout.addWidget(self.filter_edit)
+
+        self.splitter = QSplitter(Qt.Horizontal, self)
+        self.main_layout.addWidget(self.splitter)
+
+        self.tag_model = StatisticsTableModel(["Tag", "Images", "Share"], self)
+        self.tag_proxy = QSortFilterProxyModel(self)
+        self.tag_proxy.setSourceModel(self.tag_model)
+        self.tag_proxy.setSortRole(Qt.UserRole)
+        self.tag_proxy.setFilterKeyColumn(0)
+        self.tag_proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.filter_edit.textChanged.connect(
+            self.tag_proxy.setFilterFixedString
+        )
+        self.tag_view = self._table_view(self.tag_proxy)
+        self.tag_view.selectionModel().currentRowChanged.connect(
+            self.on_tag_selected
+        )
+        self.splitter.addWidget(self.tag_view)
+
+        self.cooccurring_model = StatisticsTableModel(
+            ["With", "Images", "P(with | tag)", "Lift"], self
+        )
+        self.cooccurring_proxy = QSortFilterProxyModel(self)
+        self.cooccurring_proxy.setSourceModel(self.cooccurring_model)
+        self.cooccurring_proxy.setSortRole(Qt.UserRole)
+        self.cooccurring_view = self._table_view(self.cooccurring_proxy)
+        self.splitter.addWidget(self.cooccurring_view)
+
+        self.set_statistics(None)
+
+    def _table_view(self, model: QSortFilterProxyModel) -> QTableView:
+        view = QTableView(self)
+        view.setModel(model)
+        view.setSortingEnabled(True)
+        view.sortByColumn(1, Qt.DescendingOrder)
+        view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        view.setSelectionMode(QAbstractItemView.SingleSelection)
+        view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        view.verticalHeader().hide()
+        view.horizontalHeader().setSectionResizeMode(
+            0, QHeaderView.ResizeMode.Stretch
+        )
+        return view
+
+    def set_statistics(self, statistics) -> None:
+        self.statistics = statistics
+        self.stale = False
+        self.cooccurring_model.set_rows([])
+        if statistics is None:
+            self.summary.setText("No dataset catalog")
+            self.tag_model.set_rows([])
+            return
+        images = max(statistics.image_count, 1)
+        self.summary.setText(
+            f"{statistics.image_count} images, "
+            f"{len(statistics.tag_index)} tags"
+        )
+        self.tag_model.set_rows([
+            (tag, count, count / images)
+            for tag, count in statistics.tag_counts()
+        ])
+
+    def refresh(self) -> None:
+        """ Show updated statistics, now or once the panel is visible. """
+        if self.isVisible():
+            self.set_statistics(self.statistics)
+        else:
+            self.stale = True
+
+    def showEvent(self, event) -> None:
+        if self.stale:
+            self.set_statistics(self.statistics)
+        super().showEvent(event)
+
+    def on_tag_selected(self, current: QModelIndex, _: QModelIndex) -> None:
+        if self.statistics is None or not current.isValid():
+            self.cooccurring_model.set_rows([])
+            return
+        tag = self.tag_proxy.data(current.siblingAtColumn(0), Qt.UserRole)
+        self.cooccurring_model.set_rows(
+            self.statistics.cooccurring(tag, self.COOCCURRING_LIMIT)
+        )
@@ -1,21 +1,21 @@
 import sys
 
-from PySide6.QtCore import QObject
+from PySide6.QtCore import QObject, Signal
 from PySide6.QtWidgets import (
     QApplication,
     QVBoxLayout,
-    QHBoxLayout,
-    QScrollArea,
     QWidget,
-    QLabel,
     QPushButton,
     QTextEdit
 )
 
-from flow_layout import FlowLayout
+from tag_chips import TagChipView
 from util import deduplicate_list
 
 class TagAreaWidget(QWidget):
+    # Emitted on user edits only, not when tags are set programmatically.
+    tagsChanged = Signal()
+
     def __init__(self, tags: list[str] = [], parent: QObject = None) -> None:
         super().__init__(parent)
         self.tags = tags
@@ -24,17 +24,15 @@ class TagAreaWidget(QWidget):
         self.main_layout = QVBoxLayout(self)
         self.setLayout(self.main_layout)
 
-        # Scroll area to hold tags
-        self.scroll_area = QScrollArea(self)
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_widget = QWidget(self)
-        self.scroll_layout = FlowLayout(self.scroll_widget)
-        self.scroll_area.setWidget(self.scroll_widget)
-        self.main_layout.addWidget(self.scroll_area)
+        # Tags as chips, each with a delete button
+        self.chip_view = TagChipView("X", self)
+        self.chip_view.buttonClicked.connect(self.remove_tag)
+        self.main_layout.addWidget(self.chip_view)
 
         # Text edit for editing tags as text
         self.text_edit = QTextEdit(self)
         self.text_edit.setVisible(False) # Initially hidden
+        self.text_edit.textChanged.connect(self._on_text_edited)
         self.main_layout.addWidget(self.text_edit)
 
         # Mode toggle button
@@ -45,48 +43,8 @@ class TagAreaWidget(QWidget):
         self.update_tags()
 
     def update_tags(self) -> None:
-        """Refreshes tag display in tag view mode"""
-        # Clear existing tags
-        for i in reversed(range(self.scroll_layout.count())):
-            widget = self.scroll_layout.itemAt(i).widget()
-            if widget:
-                widget.deleteLater()
-
-        # Add tags with delete button
-        for tag in self.tags:
-            tag_layout = QHBoxLayout()
-
-            # Tag label
-            tag_label = QLabel(tag)
-            tag_layout.addWidget(tag_label)
-
-            # "X" button to delete tag
-            delete_button = QPushButton("X")
-            delete_button.setFixedSize(20, 20)
-            delete_button.clicked.connect(lambda _, t=tag: self.remove_tag(t))
-            delete_button.setStyleSheet("""
-              QPushButton {
-                border: 1px solid black;
-                border-radius: 5px;
-              }
-              QPushButton:hover {
-                background-color: dimgray
-              }
-              QPushButton:pressed {
-                background-color: white
-              }
-            """)
-            tag_layout.addWidget(delete_button)
-
-            # Add to the scroll layout
-            tag_container = QWidget()
-            tag_container.setLayout(tag_layout)
-            tag_container.setStyleSheet("""
-                background-color: gray;
-                color:            black;
-                border-radius:    10px;
-            """)
-            self.scroll_layout.addWidget(tag_container)
+        """Refreshes tag display in tag view mode, only applying changes"""
+        self.chip_view.set_tags(self.tags)
 
     def add_tag(self, tag) -> None:
         """Adds a single tag if it doesn't already exist."""
@@ -97,6 +55,7 @@ class TagAreaWidget(QWidget):
             self.tags.append(tag)
             self.update_tags()
             self._update_text_edit()
+            self.tagsChanged.emit()
 
     def remove_tag(self, tag) -> None:
         """Removes a tag if it exists."""
@@ -104,6 +63,7 @@ class TagAreaWidget(QWidget):
             self.tags.remove(tag)
             self.update_tags()
             self._update_text_edit()
+            self.tagsChanged.emit()
 
     def toggle_edit_mode(self) -> None:
         """Toggles between tag display and text edit modes."""
@@ -114,14 +74,14 @@ class TagAreaWidget(QWidget):
             self.tags = deduplicate_list(new_tags)
             self.update_tags()
             self.text_edit.setVisible(False)
-            self.scroll_area.setVisible(True)
+            self.chip_view.setVisible(True)
             self.edit_button.setText("Edit")
         else:
             # Switch to text edit mode
             tag_string = ', '.join(self.tags)
             self.text_edit.setPlainText(tag_string)
             self.text_edit.setVisible(True)
-            self.scroll_area.setVisible(False)
+            self.chip_view.setVisible(False)
             self.edit_button.setText("Done")
 
     def toPlainText(self) -> str:
@@ -144,6 +104,11 @@ class TagAreaWidget(QWidget):
         self.update_tags()
         self._update_text_edit()
 
+    def _on_text_edited(self) -> None:
+        # The hidden text edit is only ever updated programmatically.
+        if self.text_edit.isVisible():
+            self.tagsChanged.emit()
+
     def _update_text_edit(self) -> None:
         """Update the text edit widget with the current tags."""
         self.text_edit.setPlainText(', '.join(self.tags))
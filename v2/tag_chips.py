@@ -0,0 +1,361 @@
+import bisect
+from difflib import SequenceMatcher
+
+from PySide6.QtCore import (
+    Qt,
+    QAbstractListModel,
+    QEvent,
+    QModelIndex,
+    QObject,
+    QPoint,
+    QRect,
+    QSize,
+    Signal
+)
+from PySide6.QtGui import QColor, QFontMetrics, QPainter, QPen
+from PySide6.QtWidgets import QAbstractScrollArea, QToolTip, QWidget
+
+
+class TagChipModel(QAbstractListModel):
+    """
+    Tags shown as chips.  `set_tags' applies only the difference with the
+    current tags as row insertions and removals, so views only redo the
+    layout from the first changed row.
+    """
+    # Above this share of changed rows a reset is cheaper than the diff.
+    RESET_RATIO = 0.5
+
+    def __init__(self, parent: QObject = None) -> None:
+        super().__init__(parent)
+        self.tags: list[str] = []
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.tags)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole or role == Qt.ToolTipRole:
+            return self.tags[index.row()]
+        return None
+
+    def set_tags(self, tags: list[str]) -> None:
+        if tags == self.tags:
+            return
+        if not self.tags or not tags:
+            self._reset(tags)
+            return
+        opcodes = SequenceMatcher(
+            None, self.tags, tags, autojunk=False
+        ).get_opcodes()
+        changed = sum(
+            max(i2 - i1, j2 - j1)
+            for op, i1, i2, j1, j2 in opcodes if op != 'equal'
+        )
+        if changed > self.RESET_RATIO * max(len(self.tags), len(tags)):
+            self._reset(tags)
+            return
+        # Back to front, so the old indices of earlier opcodes stay valid.
+        for op, i1, i2, j1, j2 in reversed(opcodes):
+            if op in ('replace', 'delete'):
+                self.beginRemoveRows(QModelIndex(), i1, i2 - 1)
+                del self.tags[i1:i2]
+                self.endRemoveRows()
+            if op in ('replace', 'insert'):
+                self.beginInsertRows(QModelIndex(), i1, i1 + j2 - j1 - 1)
+                self.tags[i1:i1] = tags[j1:j2]
+                self.endInsertRows()
+
+    def _reset(self, tags: list[str]) -> None:
+        self.beginResetModel()
+        self.tags = list(tags)
+        self.endResetModel()
+
+
+class TagChipDelegate():
+    """
+    Measures and paints a tag as a rounded chip with a small button on its
+    right, in the colours the chip widgets used to have.
+    """
+    PADDING = 8
+    BUTTON_SIZE = 18
+    HEIGHT = 26
+    RADIUS = 10
+
+    def __init__(self, button_text: str) -> None:
+        self.button_text = button_text
+        # Chip width by tag, measuring text is the costly part of a layout.
+        self._widths: dict[str, int] = {}
+
+    def clear_cache(self) -> None:
+        self._widths.clear()
+
+    def width(self, metrics: QFontMetrics, tag: str) -> int:
+        width = self._widths.get(tag)
+        if width is None:
+            # Advances are rounded, leave room for eliding not to kick in.
+            width = self._widths[tag] = (
+                self.PADDING
+                + metrics.horizontalAdvance(tag) + 2
+                + self.PADDING // 2
+                + self.BUTTON_SIZE
+                + self.PADDING // 2
+            )
+        return width
+
+    def button_rect(self, rect: QRect) -> QRect:
+        return QRect(
+            rect.right() - self.PADDING // 2 - self.BUTTON_SIZE + 1,
+            rect.top() + (rect.height() - self.BUTTON_SIZE) // 2,
+            self.BUTTON_SIZE,
+            self.BUTTON_SIZE
+        )
+
+    def paint(
+            self,
+            painter: QPainter,
+            metrics: QFontMetrics,
+            rect: QRect,
+            tag: str,
+            hovered: bool,
+            pressed: bool
+    ) -> None:
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor('gray'))
+        painter.drawRoundedRect(
+            rect.adjusted(0, 0, -1, -1), self.RADIUS, self.RADIUS
+        )
+
+        button = self.button_rect(rect)
+        text_rect = QRect(
+            rect.left() + self.PADDING, rect.top(),
+            button.left() - rect.left() - self.PADDING - self.PADDING // 2,
+            rect.height()
+        )
+        painter.setPen(QColor('black'))
+        painter.drawText(
+            text_rect,
+            Qt.AlignLeft | Qt.AlignVCenter,
+            metrics.elidedText(tag, Qt.ElideRight, text_rect.width())
+        )
+
+        if hovered and pressed:
+            painter.setBrush(QColor('white'))
+        elif hovered:
+            painter.setBrush(QColor('dimgray'))
+        else:
+            painter.setBrush(Qt.NoBrush)
+        painter.setPen(QPen(QColor('black'), 1))
+        painter.drawRoundedRect(button.adjusted(0, 0, -1, -1), 5, 5)
+        painter.drawText(button, Qt.AlignCenter, self.button_text)
+
+
+class TagChipView(QAbstractScrollArea):
+    """
+    Wrapping view of a `TagChipModel'.
+
+    Chips are painted by a `TagChipDelegate' rather than being widgets, so
+    the view is made of the same few objects whatever the number of tags.
+    Chips all have the same height, the layout is a line number and an x
+    offset per row: a change to the model redoes it from the line of the
+    first changed row only, painting and hit-testing only look at the
+    visible lines.  A click on a chip's button emits `buttonClicked'.
+    """
+    buttonClicked = Signal(str)
+    SPACING = 3
+
+    def __init__(self, button_text: str, parent: QWidget = None) -> None:
+        super().__init__(parent)
+        self.delegate = TagChipDelegate(button_text)
+        self.chip_model = TagChipModel(self)
+        self.chip_model.rowsInserted.connect(
+            lambda _, first, __: self._relayout(first)
+        )
+        self.chip_model.rowsRemoved.connect(
+            lambda _, first, __: self._relayout(first)
+        )
+        self.chip_model.modelReset.connect(lambda: self._relayout(0))
+        # Left edge and line of each chip.
+        self._xs: list[int] = []
+        self._lines: list[int] = []
+        self._layout_width = None
+        # Row whose button is under the mouse, and pressed, or -1.
+        self.hover_row = -1
+        self.pressed_row = -1
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.verticalScrollBar().setSingleStep(
+            self.delegate.HEIGHT + self.SPACING
+        )
+        self.viewport().setMouseTracking(True)
+
+    def set_tags(self, tags: list[str]) -> None:
+        self.chip_model.set_tags(tags)
+
+    def tags(self) -> list[str]:
+        return self.chip_model.tags
+
+    def sizeHint(self) -> QSize:
+        return QSize(300, 3 * (self.delegate.HEIGHT + self.SPACING))
+
+    def _line_top(self, line: int) -> int:
+        return self.SPACING + line * (self.delegate.HEIGHT + self.SPACING)
+
+    def _chip_width(self, row: int) -> int:
+        return min(
+            self.delegate.width(self.fontMetrics(), self.chip_model.tags[row]),
+            max(self._layout_width - 2 * self.SPACING, 0)
+        )
+
+    def _relayout(self, first: int) -> None:
+        self.hover_row = self.pressed_row = -1
+        width = self.viewport().width()
+        if width != self._layout_width:
+            self._layout_width = width
+            first = 0
+        # Rows before `first' are unchanged, restart at the start of the
+        # line holding the last of them.
+        first = min(first, len(self._xs))
+        line = 0
+        if first > 0:
+            line = self._lines[first - 1]
+            first = bisect.bisect_left(self._lines, line, 0, first)
+        del self._xs[first:]
+        del self._lines[first:]
+
+        tags = self.chip_model.tags
+        metrics = self.fontMetrics()
+        chip_width = self.delegate.width
+        right = width - self.SPACING
+        limit = max(width - 2 * self.SPACING, 0)
+        x = self.SPACING
+        xs, lines = self._xs, self._lines
+        for row in range(first, len(tags)):
+            w = min(chip_width(metrics, tags[row]), limit)
+            if x + w > right and x > self.SPACING:
+                line += 1
+                x = self.SPACING
+            xs.append(x)
+            lines.append(line)
+            x += w + self.SPACING
+
+        line_count = self._lines[-1] + 1 if self._lines else 0
+        content_height = self._line_top(line_count)
+        scroll_bar = self.verticalScrollBar()
+        scroll_bar.setPageStep(self.viewport().height())
+        scroll_bar.setRange(
+            0, max(content_height - self.viewport().height(), 0)
+        )
+        self.viewport().update()
+
+    def chip_rect(self, row: int) -> QRect:
+        """ Rect of a chip in viewport coordinates. """
+        return QRect(
+            self._xs[row],
+            self._line_top(self._lines[row])
+            - self.verticalScrollBar().value(),
+            self._chip_width(row),
+            self.delegate.HEIGHT
+        )
+
+    def row_at(self, pos: QPoint) -> int:
+        """ Row of the chip at `pos', in viewport coordinates, or -1. """
+        step = self.delegate.HEIGHT + self.SPACING
+        y = pos.y() + self.verticalScrollBar().value() - self.SPACING
+        line, offset = divmod(y, step)
+        if y < 0 or offset >= self.delegate.HEIGHT:
+            return -1
+        lo = bisect.bisect_left(self._lines, line)
+        hi = bisect.bisect_right(self._lines, line)
+        row = bisect.bisect_right(self._xs, pos.x(), lo, hi) - 1
+        if row < lo or pos.x() >= self._xs[row] + self._chip_width(row):
+            return -1
+        return row
+
+    def button_at(self, pos: QPoint) -> int:
+        """ Row of the chip whose button is at `pos', or -1. """
+        row = self.row_at(pos)
+        if row >= 0 and self.delegate.button_rect(
+                self.chip_rect(row)).contains(pos):
+            return row
+        return -1
+
+    def paintEvent(self, event) -> None:
+        if not self._lines:
+            return
+        painter = QPainter(self.viewport())
+        painter.setRenderHint(QPainter.Antialiasing)
+        metrics = self.fontMetrics()
+        step = self.delegate.HEIGHT + self.SPACING
+        top = self.verticalScrollBar().value() + event.rect().top()
+        bottom = self.verticalScrollBar().value() + event.rect().bottom()
+        first = bisect.bisect_left(self._lines, (top - self.SPACING) // step)
+        last = bisect.bisect_right(self._lines, bottom // step)
+        tags = self.chip_model.tags
+        for row in range(first, last):
+            self.delegate.paint(
+                painter,
+                metrics,
+                self.chip_rect(row),
+                tags[row],
+                row == self.hover_row,
+                row == self.pressed_row
+            )
+        painter.end()
+
+    def _update_row(self, row: int) -> None:
+        if 0 <= row < len(self._xs):
+            self.viewport().update(self.chip_rect(row))
+
+    def _set_hover_row(self, row: int) -> None:
+        if row != self.hover_row:
+            old, self.hover_row = self.hover_row, row
+            self._update_row(old)
+            self._update_row(row)
+
+    def mouseMoveEvent(self, event) -> None:
+        self._set_hover_row(self.button_at(event.position().toPoint()))
+
+    def mousePressEvent(self, event) -> None:
+        row = self.button_at(event.position().toPoint())
+        if event.button() == Qt.LeftButton and row >= 0:
+            self.pressed_row = row
+            self._update_row(row)
+
+    def mouseReleaseEvent(self, event) -> None:
+        if event.button() == Qt.LeftButton and self.pressed_row >= 0:
+            row, self.pressed_row = self.pressed_row, -1
+            self._update_row(row)
+            if self.button_at(event.position().toPoint()) == row:
+                self.buttonClicked.emit(self.chip_model.tags[row])
+
+    def leaveEvent(self, event) -> None:
+        self._set_hover_row(-1)
+        super().leaveEvent(event)
+
+    def viewportEvent(self, event) -> bool:
+        if event.type() == QEvent.ToolTip:
+            row = self.row_at(event.pos())
+            if row >= 0:
+                QToolTip.showText(
+                    event.globalPos(), self.chip_model.tags[row], self
+                )
+            else:
+                QToolTip.hideText()
+            return True
+        return super().viewportEvent(event)
+
+    def resizeEvent(self, event) -> None:
+        super().resizeEvent(event)
+        # A new width redoes the whole layout, a new height only scrolling.
+        self._relayout(len(self._xs))
+
+    def scrollContentsBy(self, dx: int, dy: int) -> None:
+        self.hover_row = -1
+        self.viewport().update()
+
+    def changeEvent(self, event) -> None:
+        if event.type() == QEvent.FontChange:
+            self.delegate.clear_cache()
+            self._layout_width = None
+            self._relayout(0)
+        super().changeEvent(event)
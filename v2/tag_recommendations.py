@@ -1,91 +1,238 @@
 import sys
+import time
+import threading
+import traceback
 from pathlib import Path
 
+from PySide6.QtCore import QThread, Signal, QObject
 from PySide6.QtWidgets import (
     QApplication,
     QVBoxLayout,
-    QHBoxLayout,
-    QScrollArea,
     QWidget,
-    QLabel,
-    QPushButton,
-    QTextEdit
+    QLabel
 )
 
-from flow_layout import FlowLayout
+from tag_chips import TagChipView
 from tagger.tagger import Tagger
+from tagger.interrogators import interrogators
+from tagger.ensemble import MERGE_RULES
+from tagger.cache import PredictionCache
+from tagger.tag_groups import TagGroups
+from settings import DEFAULT_SETTINGS, get_setting
+
+class TaggerWorker(QThread):
+    """
+    Long lived tagging thread.  Loads the model, then serves requests one at a
+    time.  Only the newest request is kept: asking for a new image while one
+    is being tagged replaces whatever was still waiting.
+
+    Prefetched images only warm the prediction cache, at low priority: one is
+    predicted only when no request is waiting.  The model runs on this thread
+    alone, so a request for an image being prefetched waits for it and is
+    then served from the cache.
+    """
+    modelLoaded = Signal()
+    loadFailed = Signal(str)
+    tagsGenerated = Signal(str, list)
+
+    def __init__(
+            self,
+            tagger: Tagger,
+            warm_up: bool = True,
+            parent: QObject = None
+    ) -> None:
+        super().__init__(parent)
+        self.tagger = tagger
+        self.warm_up = warm_up
+        self._condition = threading.Condition()
+        self._request = None
+        self._prefetch: list[Path] = []
+        self._stopping = False
+
+    def request(self, path: Path, exclude_tags: list[str]) -> None:
+        with self._condition:
+            self._request = (path, list(exclude_tags))
+            if path in self._prefetch:
+                self._prefetch.remove(path)
+            self._condition.notify()
+
+    def prefetch(self, paths: list[Path]) -> None:
+        """ Predict `paths' when idle, replacing those not predicted yet. """
+        if self.tagger.cache is None:
+            return
+        with self._condition:
+            self._prefetch = list(paths)
+            self._condition.notify()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopping = True
+            self._request = None
+            self._prefetch = []
+            self._condition.notify()
+
+    def _has_request(self) -> bool:
+        with self._condition:
+            return self._request is not None
+
+    def _next_request(self):
+        """
+        The waiting request, else a path to prefetch as `(path, None)', or
+        None once stopping.
+        """
+        with self._condition:
+            while self._request is None and not self._prefetch \
+                    and not self._stopping:
+                self._condition.wait()
+            if self._request is None and self._prefetch:
+                return self._prefetch.pop(0), None
+            request, self._request = self._request, None
+            return request
+
+    def run(self) -> None:
+        interrogator = self.tagger.interrogator
+        start = time.perf_counter()
+        try:
+            interrogator.load()
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            self.loadFailed.emit(str(e))
+            return
+        # Warming up only helps an image asked for later, not one waiting.
+        if self.warm_up and not self._has_request():
+            try:
+                interrogator.warm_up()
+            except Exception as e:
+                print(f"Failed to warm up {interrogator.name}: {e}",
+                      file=sys.stderr)
+        self.modelLoaded.emit()
+
+        reported = False
+        while (request := self._next_request()) is not None:
+            path, exclude_tags = request
+            if exclude_tags is None:
+                try:
+                    self.tagger.predict_image(path)
+                except Exception as e:
+                    print(f"Failed to prefetch tags for {path}: {e}",
+                          file=sys.stderr)
+                continue
+            try:
+                tags = self.tagger.tag_image(path, exclude_tags=exclude_tags)
+            except Exception as e:
+                print(f"Failed to tag {path}: {e}", file=sys.stderr)
+                tags = {}
+            if not reported:
+                print(interrogator.cold_start_report(
+                    time.perf_counter() - start
+                ), file=sys.stderr)
+                reported = True
+            self.tagsGenerated.emit(str(path), list(tags))
+
 
 class TagRecommendationsWidget(QWidget):
     def __init__(self, manager: QWidget, parent=None) -> None:
         super().__init__(parent)
-        self.tagger = Tagger()
+        # Raw predictions are cached on disk so revisiting an image only costs
+        # a file read.  Recommendations redundant with the image's tags, e.g.
+        # a second eye colour, are left out.
+        models = [get_setting('tagger_model'), *get_setting('tagger_ensemble')]
+        for model in [model for model in models if model not in interrogators]:
+            print(f"Unknown tagger model {model}, skipping it",
+                  file=sys.stderr)
+            models.remove(model)
+        if not models:
+            models = [DEFAULT_SETTINGS['tagger_model']]
+        merge_rule = get_setting('ensemble_merge')
+        if merge_rule not in MERGE_RULES:
+            print(f"Unknown ensemble merge rule {merge_rule}, using the "
+                  f"default", file=sys.stderr)
+            merge_rule = DEFAULT_SETTINGS['ensemble_merge']
+        self.tagger = Tagger(
+            models,
+            cache=PredictionCache(),
+            tag_groups=TagGroups.load_or_default(
+                get_setting('tag_groups_file')
+            ),
+            embedding_layer=get_setting('embedding_layer'),
+            intra_op_threads=get_setting('intra_op_threads'),
+            inter_op_threads=get_setting('inter_op_threads'),
+            graph_optimization=get_setting('graph_optimization'),
+            cache_optimized_model=get_setting('cache_optimized_models'),
+            merge_rule=merge_rule
+        )
         self.tags = []
         self.manager = manager
+        # Image whose recommendations we are waiting for, results for any
+        # other image are stale and dropped.
+        self.current_path = None
+        self.model_ready = False
+        # Dataset tag statistics, when available suggestions are ranked by
+        # how often they go with the image's tags.
+        self.statistics = None
 
         self.main_layout = QVBoxLayout(self)
         self.setLayout(self.main_layout)
-        self.label = QLabel("Recommended Tags")
+        self.label = QLabel("Recommended Tags (loading model...)")
         self.main_layout.addWidget(self.label)
-        # Scroll area to hold tags
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_widget = QWidget(self)
-        self.scroll_layout = FlowLayout(self.scroll_widget)
-        self.scroll_area.setWidget(self.scroll_widget)
-        self.main_layout.addWidget(self.scroll_area)
+        # Recommended tags as chips, each with a button to add it
+        self.chip_view = TagChipView("+", self)
+        self.chip_view.buttonClicked.connect(self.move_tag)
+        self.main_layout.addWidget(self.chip_view)
+
+        # Tag off the GUI thread so navigation never waits on the model.
+        self.worker = TaggerWorker(
+            self.tagger, get_setting('warm_up_model'), self
+        )
+        self.worker.modelLoaded.connect(self.on_model_loaded)
+        self.worker.loadFailed.connect(self.on_model_failed)
+        self.worker.tagsGenerated.connect(self.on_tags_generated)
+        self.worker.start()
+
+    def shutdown(self) -> None:
+        """ Stop the worker, waiting for an in-progress model run. """
+        self.worker.stop()
+        self.worker.wait()
+
+    def on_model_loaded(self) -> None:
+        self.model_ready = True
+        if self.current_path is not None:
+            self.label.setText("Recommended Tags (working...)")
+        else:
+            self.label.setText("Recommended Tags")
+
+    def on_model_failed(self, message: str) -> None:
+        self.label.setText(f"Recommended Tags (failed to load model: {message})")
+
+    def set_statistics(self, statistics) -> None:
+        self.statistics = statistics
 
     def set_image(self, path: str|Path) -> None:
         if not isinstance(path, Path):
             path = Path(path)
-        self.tags = set(self.tagger.tag_image(
-            path,
-            exclude_tags=self.manager.tag_viewer.tags
-        ).keys())
+        self.current_path = path
+        self.tags = []
+        self.update_tags()
+        if not self.worker.isRunning():
+            return
+        if self.model_ready:
+            self.label.setText("Recommended Tags (working...)")
+        self.worker.request(path, self.manager.tag_viewer.tags)
+
+    def on_tags_generated(self, path: str, tags: list[str]) -> None:
+        if self.current_path is None or Path(path) != self.current_path:
+            return
+        self.label.setText("Recommended Tags")
+        # Tags may have been added while the model was running.
+        have = self.manager.tag_viewer.tags
+        self.tags = [tag for tag in tags if tag not in have]
+        if self.statistics is not None:
+            self.tags = self.statistics.rank(have, self.tags)
         self.update_tags()
 
     def update_tags(self) -> None:
-        # Clear existing tags
-        for i in reversed(range(self.scroll_layout.count())):
-            widget = self.scroll_layout.itemAt(i).widget()
-            if widget is not None:
-                widget.deleteLater()
-
-        # Add tags with delete button
-        for tag in self.tags:
-            tag_layout = QHBoxLayout()
-
-            # Tag label
-            tag_label = QLabel(tag)
-            tag_layout.addWidget(tag_label)
-
-            # "+" button to add tag
-            add_button = QPushButton("+")
-            add_button.setFixedSize(20, 20)
-            add_button.clicked.connect(lambda _, t=tag: self.move_tag(t))
-            # TODO: You need to signal the manager
-            add_button.setStyleSheet("""
-              QPushButton {
-                border: 1px solid black;
-                border-radius: 5px;
-              }
-              QPushButton:hover {
-                background-color: dimgray
-              }
-              QPushButton:pressed {
-                background-color: white
-              }
-            """)
-            tag_layout.addWidget(add_button)
-
-            # Add to the scroll layout
-            tag_container = QWidget()
-            tag_container.setLayout(tag_layout)
-            tag_container.setStyleSheet("""
-                background-color: gray;
-                color:            black;
-                border-radius:    10px;
-            """)
-            self.scroll_layout.addWidget(tag_container)
+        # Only the chips which changed are added or removed.
+        self.chip_view.set_tags(self.tags)
 
     def remove_tag(self, tag) -> None:
         if tag in self.tags:
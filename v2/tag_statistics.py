@@ -0,0 +1,285 @@
+import os
+import sys
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import scipy.sparse as sp
+
+from catalog import Catalog
+from tagger.cache import default_cache_dir
+
+# Never part of a file name or a tag, joins lists of either for `.npz'.
+SEPARATOR = '\0'
+
+
+def statistics_cache_path(catalog: Catalog) -> Path:
+    key = hashlib.sha1(os.path.abspath(catalog.path).encode('utf-8'))
+    return default_cache_dir() / 'statistics' / f'{key.hexdigest()}.npz'
+
+
+class TagStatistics():
+    """
+    Tag statistics of a dataset, built from its catalog.
+
+    The dataset is held as a sparse image x tag matrix (CSR, one row per
+    image), from which per-tag counts, co-occurrence counts and conditional
+    probabilities are computed with vectorized sparse operations.  Nothing
+    quadratic in the number of tags is ever materialized: co-occurrence is
+    computed per tag, or for an explicitly given subset of tags.
+
+    `generation' is the catalog generation the statistics reflect.
+    """
+    def __init__(
+            self,
+            names: list[str],
+            vocabulary: list[str],
+            matrix: sp.csr_matrix,
+            generation: int
+    ) -> None:
+        self.names = names
+        self.name_index = {name: i for i, name in enumerate(names)}
+        self.vocabulary = vocabulary
+        self.tag_index = {tag: i for i, tag in enumerate(vocabulary)}
+        self.matrix = matrix
+        self.generation = generation
+        self.counts = np.asarray(matrix.sum(axis=0)).ravel().astype(np.int64)
+        # Rows of removed images stay, empty, so indices remain stable.
+        self.image_count = len(self.name_index)
+        self._csc: sp.csc_matrix | None = None
+
+    @classmethod
+    def from_catalog(cls, catalog: Catalog) -> 'TagStatistics':
+        generation, images, postings = catalog.tag_postings()
+        ids = np.fromiter((i for i, _ in images), dtype=np.int64,
+                          count=len(images))
+        names = [name for _, name in images]
+        vocabulary = []
+        columns = []
+        for tag, image_ids in postings:
+            vocabulary.append(tag)
+            columns.append(np.searchsorted(
+                ids, np.fromstring(image_ids, dtype=np.int64, sep=',')
+            ))
+        lengths = np.fromiter((len(c) for c in columns), dtype=np.int64,
+                              count=len(columns))
+        indptr = np.zeros(len(columns) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = (
+            np.concatenate(columns) if columns else np.zeros(0, np.int64)
+        ).astype(np.int32)
+        csc = sp.csc_matrix(
+            (np.ones(len(indices), dtype=np.int32), indices, indptr),
+            shape=(len(names), len(vocabulary))
+        )
+        csc.sort_indices()
+        return cls(names, vocabulary, csc.tocsr(), generation)
+
+    @classmethod
+    def load(cls, path: Path) -> 'TagStatistics':
+        with np.load(path) as data:
+            names = str(data['names']).split(SEPARATOR)
+            vocabulary = str(data['vocabulary']).split(SEPARATOR)
+            shape = tuple(data['shape'])
+            matrix = sp.csr_matrix((
+                np.ones(len(data['indices']), dtype=np.int32),
+                data['indices'],
+                data['indptr']
+            ), shape=shape)
+            stats = cls(
+                names if shape[0] else [],
+                vocabulary if shape[1] else [],
+                matrix,
+                int(data['generation'])
+            )
+            # A name removed and added again has an empty row, then a live
+            # one, only the latter is indexed.
+            stats.name_index = {
+                stats.names[row]: row for row in data['rows'].tolist()
+            }
+            stats.image_count = len(stats.name_index)
+            return stats
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                names=np.array(SEPARATOR.join(self.names)),
+                vocabulary=np.array(SEPARATOR.join(self.vocabulary)),
+                rows=np.array(sorted(self.name_index.values()),
+                              dtype=np.int64),
+                shape=np.array(self.matrix.shape),
+                indices=self.matrix.indices,
+                indptr=self.matrix.indptr,
+                generation=np.array(self.generation)
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def for_catalog(cls, catalog: Catalog) -> 'TagStatistics':
+        """ Statistics from the disk cache when current, else rebuilt. """
+        path = statistics_cache_path(catalog)
+        generation = catalog.generation()
+        if path.exists():
+            try:
+                stats = cls.load(path)
+                if stats.generation == generation:
+                    return stats
+            except (OSError, ValueError, KeyError) as e:
+                print(f'Ignoring statistics cache: {e}', file=sys.stderr)
+        stats = cls.from_catalog(catalog)
+        try:
+            stats.save(path)
+        except OSError as e:
+            print(f'Failed to cache statistics: {e}', file=sys.stderr)
+        return stats
+
+    def csc(self) -> sp.csc_matrix:
+        """ Column (per tag) form of the matrix, kept until the next update. """
+        if self._csc is None:
+            self._csc = self.matrix.tocsc()
+        return self._csc
+
+    def count(self, tag: str) -> int:
+        i = self.tag_index.get(tag)
+        return 0 if i is None else int(self.counts[i])
+
+    def tag_counts(self) -> list[tuple[str, int]]:
+        """ Tags in use with their image counts, most used first. """
+        order = np.argsort(-self.counts, kind='stable')
+        order = order[:np.count_nonzero(self.counts)]
+        return [
+            (self.vocabulary[i], count)
+            for i, count in zip(order.tolist(), self.counts[order].tolist())
+        ]
+
+    def cooccurring(
+            self,
+            tag: str,
+            limit: int = None
+    ) -> list[tuple[str, int, float, float]]:
+        """
+        Tags seen together with `tag' as `(other, count, P(other | tag),
+        lift)', most frequent first.
+        """
+        i = self.tag_index.get(tag)
+        if i is None or self.counts[i] == 0:
+            return []
+        csc = self.csc()
+        rows = csc.indices[csc.indptr[i]:csc.indptr[i + 1]]
+        together = np.bincount(
+            self.matrix[rows].indices, minlength=len(self.vocabulary)
+        )
+        together[i] = 0
+        order = np.argsort(-together, kind='stable')
+        order = order[:np.count_nonzero(together)]
+        if limit is not None:
+            order = order[:limit]
+        conditional = together[order] / self.counts[i]
+        lift = conditional * self.image_count / np.maximum(
+            self.counts[order], 1
+        )
+        return [
+            (self.vocabulary[j], c, p, l) for j, c, p, l in zip(
+                order.tolist(), together[order].tolist(),
+                conditional.tolist(), lift.tolist()
+            )
+        ]
+
+    def cooccurrence(self, tags: list[str]) -> np.ndarray:
+        """ Dense co-occurrence counts between the given (known) tags. """
+        columns = [self.tag_index[tag] for tag in tags]
+        subset = self.csc()[:, columns]
+        return (subset.T @ subset).toarray()
+
+    def conditional(self, given: list[str], candidates: list[str]) -> np.ndarray:
+        """
+        Mean over `given' tags g of P(candidate | g), or the plain frequency
+        of each candidate when no given tag is known.  Unknown candidates
+        score 0.
+        """
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        known = [
+            (k, self.tag_index[c]) for k, c in enumerate(candidates)
+            if c in self.tag_index
+        ]
+        if not known or self.image_count == 0:
+            return scores
+        slots, columns = map(list, zip(*known))
+        given_columns = [
+            self.tag_index[g] for g in given
+            if g in self.tag_index and self.counts[self.tag_index[g]] > 0
+        ]
+        if not given_columns:
+            scores[slots] = self.counts[columns] / self.image_count
+            return scores
+        csc = self.csc()
+        together = (csc[:, given_columns].T @ csc[:, columns]).toarray()
+        scores[slots] = (
+            together / self.counts[given_columns][:, None]
+        ).mean(axis=0)
+        return scores
+
+    def rank(self, given: list[str], candidates: list[str]) -> list[str]:
+        """
+        `candidates' reordered by how often they go with `given', keeping
+        their original order among equals.
+        """
+        scores = self.conditional(given, candidates)
+        order = np.argsort(-scores, kind='stable')
+        return [candidates[i] for i in order]
+
+    def update_image(self, name: str, tags: list[str]) -> None:
+        """ Replace the tags of one image, adding it if it is new. """
+        for tag in tags:
+            if tag not in self.tag_index:
+                self.tag_index[tag] = len(self.vocabulary)
+                self.vocabulary.append(tag)
+        if len(self.vocabulary) > len(self.counts):
+            self.counts = np.concatenate([
+                self.counts,
+                np.zeros(len(self.vocabulary) - len(self.counts), np.int64)
+            ])
+        row = self.name_index.get(name)
+        if row is None:
+            row = len(self.names)
+            self.names.append(name)
+            self.name_index[name] = row
+            self.image_count += 1
+        columns = np.unique(np.fromiter(
+            (self.tag_index[tag] for tag in tags), dtype=np.int32,
+            count=len(tags)
+        ))
+        self._replace_row(row, columns)
+
+    def remove_image(self, name: str) -> None:
+        row = self.name_index.pop(name, None)
+        if row is None:
+            return
+        self.image_count -= 1
+        self._replace_row(row, np.zeros(0, dtype=np.int32))
+
+    def _replace_row(self, row: int, columns: np.ndarray) -> None:
+        m = self.matrix
+        rows = max(m.shape[0], row + 1)
+        indptr = m.indptr
+        if rows > m.shape[0]:
+            indptr = np.concatenate([
+                indptr, np.full(rows - m.shape[0], indptr[-1], indptr.dtype)
+            ])
+        start, end = indptr[row], indptr[row + 1]
+        np.subtract.at(self.counts, m.indices[start:end], 1)
+        np.add.at(self.counts, columns, 1)
+        indices = np.concatenate([
+            m.indices[:start], columns.astype(m.indices.dtype),
+            m.indices[end:]
+        ])
+        indptr = indptr.copy()
+        indptr[row + 1:] += len(columns) - (end - start)
+        self.matrix = sp.csr_matrix(
+            (np.ones(len(indices), dtype=np.int32), indices, indptr),
+            shape=(rows, len(self.vocabulary))
+        )
+        self._csc = None
@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, TextIO, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from util import IMAGE_EXTENSIONS, atomic_write_text
+
+
+def find_images(root: Path, recursive: bool = False) -> Iterator[Path]:
+    """
+    Yield image paths under `root' in a stable (sorted) order.
+    """
+    try:
+        entries = sorted(os.scandir(root), key=lambda entry: entry.name)
+    except OSError as e:
+        print(f'Skipping {root}: {e}', file=sys.stderr)
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if recursive and not entry.name.startswith('.'):
+                yield from find_images(Path(entry.path), recursive)
+        elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            yield Path(entry.path)
+
+
+class ProgressManifest():
+    """
+    Append-only list of images which have been fully processed, one path
+    (relative to the dataset root) per line.  Used to resume killed runs.
+    """
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.done: Set[str] = set()
+        if path.exists():
+            with open(path, 'r', encoding='utf-8') as f:
+                self.done = {line.rstrip('\n') for line in f if line.strip()}
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.done
+
+    def __len__(self) -> int:
+        return len(self.done)
+
+    def add(self, names: Iterable[str]) -> None:
+        for name in names:
+            self.done.add(name)
+            self.file.write(name + '\n')
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class BulkTagger():
+    """
+    Tags every image under a directory with a single loaded model.
+
+    Decoding and preprocessing run in a thread pool (PIL and OpenCV release
+    the GIL) while the main thread feeds stacked batches to the model.
+    """
+    # Embeddings added between saves of the embedding index.
+    EMBEDDINGS_SAVE_INTERVAL = 4096
+    # Tensors waiting for their batch to fill, in batches.  Models keeping
+    # the aspect ratio preprocess images to many shapes, the largest partial
+    # batch is run once this many batches worth are waiting.
+    MAX_PENDING_BATCHES = 4
+
+    def __init__(
+            self,
+            tagger: 'Tagger',
+            threshold: float = 0.35,
+            tag_escape: bool = True,
+            batch_size: Optional[int] = None,
+            workers: int = os.cpu_count() or 4
+    ) -> None:
+        self.tagger = tagger
+        self.interrogator = tagger.interrogator
+        self.threshold = threshold
+        self.tag_escape = tag_escape
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+
+    def _load(self, path: Path) -> np.ndarray:
+        with Image.open(path) as im:
+            return self.interrogator.preprocess(im)
+
+    def _preprocessed(
+            self,
+            paths: Iterable[Path]
+    ) -> Iterator[Tuple[Path, Optional[np.ndarray], Optional[Exception]]]:
+        """
+        Yield `(path, tensor, error)' in input order, keeping a bounded number
+        of decodes in flight so memory stays flat on huge directories.
+        """
+        max_in_flight = self.workers * 4
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            in_flight: List[Tuple[Path, Future]] = []
+            for path in paths:
+                in_flight.append((path, pool.submit(self._load, path)))
+                if len(in_flight) >= max_in_flight:
+                    yield self._result(*in_flight.pop(0))
+            while in_flight:
+                yield self._result(*in_flight.pop(0))
+
+    @staticmethod
+    def _result(
+            path: Path,
+            future: Future
+    ) -> Tuple[Path, Optional[np.ndarray], Optional[Exception]]:
+        try:
+            return path, future.result(), None
+        except Exception as e:
+            return path, None, e
+
+    def run(
+            self,
+            root: Path,
+            recursive: bool = False,
+            output: TextIO = sys.stdout,
+            manifest: Optional[ProgressManifest] = None,
+            write_txt: bool = False,
+            overwrite: bool = False,
+            embeddings: Optional['EmbeddingIndex'] = None
+    ) -> int:
+        """
+        Tag all images under `root', writing one JSON object per line to
+        `output'.  Returns the number of images tagged by this run.
+
+        Given `embeddings', the embedding of each image is added to it from
+        the same model run; images already tagged but without a current
+        embedding are embedded again, without tagging them.
+        """
+        start = time.perf_counter()
+        if not self.interrogator.is_loaded():
+            self.interrogator.load()
+        limit = self.interrogator.max_batch_size()
+        if self.batch_size is not None:
+            limit = min(limit, self.batch_size)
+
+        def relative(path: Path) -> str:
+            return path.relative_to(root).as_posix()
+
+        # `(size, mtime)' of images to embed and whether to tag them, by
+        # path, while they are being decoded.
+        jobs: Dict[Path, Tuple[Optional[Tuple[int, int]], bool]] = {}
+
+        def pending() -> Iterator[Path]:
+            for path in find_images(root, recursive):
+                tag = manifest is None or relative(path) not in manifest
+                stat = None
+                if embeddings is not None:
+                    try:
+                        st = path.stat()
+                    except OSError:
+                        continue
+                    stat = (st.st_size, st.st_mtime_ns)
+                    if embeddings.is_current(relative(path), stat):
+                        stat = None
+                if tag or stat is not None:
+                    jobs[path] = (stat, tag)
+                    yield path
+
+        tagged = 0
+        embedded = 0
+        batches: Dict[tuple, List[Tuple[Path, np.ndarray]]] = {}
+        waiting = 0
+
+        def flush(shape: tuple) -> None:
+            nonlocal tagged, embedded, waiting
+            entries = batches.pop(shape)
+            waiting -= len(entries)
+            batch = self.interrogator.stack([tensor for _, tensor in entries])
+            if embeddings is None:
+                confidences = self.interrogator.predict(batch)
+            else:
+                confidences, vectors = \
+                    self.interrogator.predict_embeddings(batch)
+                stats = [jobs[path][0] for path, _ in entries]
+                keep = [i for i, stat in enumerate(stats) if stat is not None]
+                embeddings.add(
+                    [relative(entries[i][0]) for i in keep],
+                    [stats[i] for i in keep],
+                    vectors[keep]
+                )
+                if (embedded + len(keep)) // self.EMBEDDINGS_SAVE_INTERVAL \
+                        > embedded // self.EMBEDDINGS_SAVE_INTERVAL:
+                    embeddings.save()
+                embedded += len(keep)
+            names = []
+            ratings = confidences[:, :self.interrogator.rating_count]
+            rating_names = self.interrogator.rating_names.tolist()
+            for (path, _), row, rating in zip(entries, confidences, ratings):
+                if not jobs.pop(path)[1]:
+                    continue
+                tags = self.tagger.postprocess(
+                    row,
+                    threshold=self.threshold,
+                    tag_escape=self.tag_escape
+                )
+                if write_txt:
+                    self._write_txt(path, tags, overwrite)
+                output.write(json.dumps({
+                    'path': relative(path),
+                    'ratings': dict(zip(rating_names, rating.tolist())),
+                    'tags': tags
+                }) + '\n')
+                names.append(relative(path))
+            # Results are flushed before the manifest so that a killed run
+            # repeats at most one batch instead of losing it.
+            output.flush()
+            if manifest is not None:
+                manifest.add(names)
+            if tagged == 0 and names:
+                print(self.interrogator.cold_start_report(
+                    time.perf_counter() - start
+                ), file=sys.stderr)
+            tagged += len(names)
+            print(f'Tagged {tagged} images', file=sys.stderr, end='\r')
+
+        for path, tensor, error in self._preprocessed(pending()):
+            if error is not None:
+                print(f'Failed to read {path}: {error}', file=sys.stderr)
+                jobs.pop(path, None)
+                continue
+            batches.setdefault(tensor.shape, []).append((path, tensor))
+            waiting += 1
+            if len(batches[tensor.shape]) >= limit:
+                flush(tensor.shape)
+            elif waiting >= limit * self.MAX_PENDING_BATCHES:
+                flush(max(batches, key=lambda shape: len(batches[shape])))
+        for shape in list(batches):
+            flush(shape)
+
+        print(f'Tagged {tagged} images', file=sys.stderr)
+        if embeddings is not None:
+            if embedded:
+                print(f'Embedded {embedded} images', file=sys.stderr)
+            if embeddings.needs_training():
+                print(f'Training the index of {len(embeddings)} embeddings',
+                      file=sys.stderr)
+                embeddings.train()
+            embeddings.save()
+        return tagged
+
+    @staticmethod
+    def _write_txt(path: Path, tags: Dict[str, float], overwrite: bool) -> None:
+        txt_path = path.with_suffix('.txt')
+        if txt_path.exists() and not overwrite:
+            return
+        atomic_write_text(str(txt_path), ', '.join(tags))
@@ -0,0 +1,130 @@
+import os
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+
+def default_cache_dir() -> Path:
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'taggui'
+
+
+class PredictionCache():
+    """
+    On-disk cache of raw model confidence vectors, one float16 `.npy' file per
+    (image, interrogator) pair.
+
+    Images are identified by their resolved path, size and modification time
+    so a lookup never has to read the image itself.  Total size is capped at
+    `max_bytes', evicting least recently used entries first; recency is kept
+    in the files' modification times so it survives restarts.
+    """
+    def __init__(
+            self,
+            directory: Path = None,
+            max_bytes: int = 256 * 1024 * 1024
+    ) -> None:
+        self.directory = Path(directory or default_cache_dir() / 'predictions')
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: Optional[OrderedDict[Path, int]] = None
+        self._total = 0
+
+    def _index(self) -> OrderedDict:
+        """ Lazily scan the cache directory, oldest entries first. """
+        if self._entries is None:
+            found = []
+            if self.directory.is_dir():
+                for root, _, files in os.walk(self.directory):
+                    for name in files:
+                        if not name.endswith('.npy'):
+                            continue
+                        path = Path(root) / name
+                        try:
+                            st = path.stat()
+                        except OSError:
+                            continue
+                        found.append((st.st_mtime, path, st.st_size))
+            found.sort()
+            self._entries = OrderedDict((p, size) for _, p, size in found)
+            self._total = sum(self._entries.values())
+        return self._entries
+
+    @staticmethod
+    def key(image_path: Path, interrogator: str) -> Optional[str]:
+        try:
+            image_path = Path(image_path).resolve()
+            st = image_path.stat()
+        except OSError:
+            return None
+        ident = f'{interrogator}\0{image_path}\0{st.st_size}\0{st.st_mtime_ns}'
+        return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f'{key}.npy'
+
+    def get(self, image_path: Path, interrogator: str) -> Optional[np.ndarray]:
+        key = self.key(image_path, interrogator)
+        if key is None:
+            return None
+        path = self._path(key)
+        with self._lock:
+            entries = self._index()
+            if path not in entries:
+                return None
+            try:
+                confidences = np.load(path)
+                os.utime(path)
+            except (OSError, ValueError):
+                self._discard(path)
+                return None
+            entries.move_to_end(path)
+        return confidences.astype(np.float32)
+
+    def put(
+            self,
+            image_path: Path,
+            interrogator: str,
+            confidences: np.ndarray
+    ) -> None:
+        key = self.key(image_path, interrogator)
+        if key is None:
+            return
+        path = self._path(key)
+        with self._lock:
+            entries = self._index()
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_suffix('.tmp')
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, np.asarray(confidences, dtype=np.float16))
+                os.replace(tmp_path, path)
+                size = path.stat().st_size
+            except OSError as e:
+                print(f'Failed to cache predictions: {e}', file=sys.stderr)
+                return
+            self._total += size - entries.pop(path, 0)
+            entries[path] = size
+            self._evict()
+
+    def _discard(self, path: Path) -> None:
+        self._total -= self._entries.pop(path, 0)
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            self._discard(oldest)
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in list(self._index()):
+                self._discard(path)
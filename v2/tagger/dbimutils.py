@@ -4,7 +4,62 @@ import cv2
 import numpy as np
 from PIL import Image
 
+def prescale(
+        image: Image.Image,
+        size: int,
+        edge=max,
+        max_pixels: int = None,
+        oversample: int = 2
+) -> Image.Image:
+    """
+    Cheaply shrink `image' until `edge(image.size)' is no more than
+    `oversample' times `size', before any full resolution conversions.
+
+    JPEGs are decoded at a reduced scale with `draft', so they are never
+    fully decoded.  Other formats are decoded and then box-reduced by an
+    integer factor, palette images expanded first.  Images which would still
+    decode to more than `max_pixels' are refused with a `ValueError'
+    instead.
+    """
+    target = size * oversample
+    ratio = target / edge(image.size)
+    if ratio < 1 and image.format == 'JPEG':
+        image.draft(image.mode, (
+            max(1, int(image.width * ratio + 1)),
+            max(1, int(image.height * ratio + 1))
+        ))
+    if max_pixels is not None and image.width * image.height > max_pixels:
+        raise ValueError(
+            f'{image.width}x{image.height} image exceeds the limit of '
+            f'{max_pixels} pixels'
+        )
+    factor = edge(image.size) // target
+    if factor > 1:
+        image = reducible(image).reduce(factor)
+    return image
+
+def reducible(image: Image.Image) -> Image.Image:
+    """
+    `image' in a mode whose pixels `Image.reduce' can average: palettes are
+    expanded (averaging indices would mix unrelated colours), bilevel and
+    16 bit images widened.
+    """
+    if image.mode in ('P', 'PA'):
+        if image.mode == 'PA' or 'transparency' in image.info:
+            return image.convert('RGBA')
+        return image.convert('RGB')
+    if image.mode == '1':
+        return image.convert('L')
+    if image.mode.startswith('I;16'):
+        return image.convert('I')
+    return image
+
 def fill_transparent(image: Image.Image, color='WHITE'):
+    if image.mode in ('RGB', 'L') or (
+            image.mode == 'P' and 'transparency' not in image.info
+    ):
+        # Nothing to fill, skip the RGBA round trip.
+        return image.convert('RGB')
     image = image.convert('RGBA')
     new_image = Image.new('RGBA', image.size, color)
     new_image.paste(image, mask=image)
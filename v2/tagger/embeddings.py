@@ -0,0 +1,449 @@
+import os
+import sys
+import json
+import math
+import hashlib
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from tagger.cache import default_cache_dir
+
+# Nodes between the final fully connected layer and the model's output.
+_PASS_THROUGH = (
+    'Sigmoid', 'Softmax', 'Add', 'Sub', 'Mul', 'Div', 'Identity', 'Cast',
+    'Reshape', 'Flatten', 'Squeeze', 'Unsqueeze', 'Relu',
+    # Around operators of statically quantized models.
+    'QuantizeLinear', 'DequantizeLinear'
+)
+
+
+def expose_penultimate(model_path: os.PathLike) -> Optional[Tuple[Path, str]]:
+    """
+    Copy of an ONNX model with the input of its final fully connected layer
+    as a second output, and that output's name.  The copy is cached, keyed
+    by the model file.  None if the `onnx' package is missing or the model
+    does not end in a fully connected layer.
+    """
+    st = os.stat(model_path)
+    ident = f'{os.path.abspath(model_path)}\0{st.st_size}\0{st.st_mtime_ns}'
+    key = hashlib.sha1(ident.encode('utf-8')).hexdigest()
+    directory = default_cache_dir() / 'models'
+    exposed_path = directory / f'{key}-penultimate.onnx'
+    info_path = directory / f'{key}-penultimate.json'
+    try:
+        with open(info_path, 'r', encoding='utf-8') as f:
+            output = json.load(f)['output']
+        if exposed_path.exists():
+            return exposed_path, output
+    except (OSError, ValueError, KeyError):
+        pass
+
+    try:
+        import onnx
+    except ImportError:
+        print('Embedding the penultimate layer needs the onnx package, '
+              'using the confidences instead', file=sys.stderr)
+        return None
+    model = onnx.load(str(model_path))
+    graph = model.graph
+    producers = {out: node for node in graph.node for out in node.output}
+    constants = {tensor.name for tensor in graph.initializer} | {
+        out for node in graph.node if node.op_type == 'Constant'
+        for out in node.output
+    }
+    name = graph.output[0].name
+    output = None
+    while (node := producers.get(name)) is not None:
+        inputs = [i for i in node.input if i and i not in constants]
+        if node.op_type in ('MatMul', 'Gemm') and inputs:
+            output = inputs[0]
+            break
+        if node.op_type not in _PASS_THROUGH or len(inputs) != 1:
+            break
+        name = inputs[0]
+    if output is None:
+        print(f'No fully connected layer before the output of {model_path}, '
+              f'using the confidences instead', file=sys.stderr)
+        return None
+
+    graph.output.append(onnx.helper.make_tensor_value_info(
+        output, onnx.TensorProto.FLOAT, None
+    ))
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = exposed_path.with_suffix('.tmp')
+        onnx.save(model, str(tmp_path))
+        os.replace(tmp_path, exposed_path)
+        with open(info_path, 'w', encoding='utf-8') as f:
+            json.dump({'model': str(model_path), 'output': output}, f)
+    except OSError as e:
+        print(f'Failed to cache the model with its penultimate layer: {e}',
+              file=sys.stderr)
+        return None
+    return exposed_path, output
+
+
+def embedding_index_dir(
+        root: os.PathLike,
+        interrogator: str,
+        layer: str
+) -> Path:
+    """ Where the embeddings of a dataset by one model and layer live. """
+    ident = f'{os.path.abspath(root)}\0{interrogator}\0{layer}'
+    key = hashlib.sha1(ident.encode('utf-8')).hexdigest()
+    return default_cache_dir() / 'embeddings' / key
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class EmbeddingIndex():
+    """
+    Embeddings of a dataset's images for nearest neighbour search by cosine
+    similarity.
+
+    Vectors are normalized and stored as a memory-mapped float16 matrix, one
+    row per image, so an index of 200k images is not read into memory.  Once
+    large enough it is trained into an IVF (inverted file) index: k-means
+    splits the vectors in about sqrt(N) lists and rows are rewritten list by
+    list; a search then only scores the vectors of the `nprobe' lists whose
+    centroids are closest to the query.  Rows added later are appended and
+    assigned to their nearest list, replaced or removed rows are only
+    marked dead until the next training.
+
+    Images are identified by name and (size, mtime) so changed images can be
+    embedded again.  Not thread safe.
+    """
+    VECTORS = 'vectors.f16'
+    META = 'index.npz'
+    # Below this many vectors a search scans all of them.
+    MIN_TRAIN = 2048
+    # Lists scanned per search.
+    NPROBE = 8
+    # Rows scored at once by exact scans and assignments.
+    CHUNK_ROWS = 65536
+
+    def __init__(self, directory: os.PathLike) -> None:
+        self.directory = Path(directory)
+        self.dimension: int = None
+        self.names: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.stats = np.zeros((0, 2), dtype=np.int64)
+        self.alive = np.zeros(0, dtype=bool)
+        self.centroids: np.ndarray = None
+        self.assignment = np.zeros(0, dtype=np.int32)
+        self.trained_count = 0
+        # Changed since loaded or saved.
+        self.changed = False
+        self._vectors: np.memmap = None
+        self._lists: Tuple[np.ndarray, np.ndarray] = None
+
+    @classmethod
+    def open(cls, directory: os.PathLike) -> 'EmbeddingIndex':
+        """ The index saved in `directory', or an empty one. """
+        index = cls(directory)
+        try:
+            with np.load(index.directory / cls.META) as meta:
+                index.dimension = int(meta['dimension']) or None
+                names = str(meta['names'])
+                index.names = names.split('\0') if names else []
+                index.stats = meta['stats']
+                index.alive = meta['alive']
+                index.assignment = meta['assignment']
+                centroids = meta['centroids']
+                index.centroids = centroids if len(centroids) else None
+                index.trained_count = int(meta['trained_count'])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print(f'Failed to load embeddings from {index.directory}: {e}',
+                  file=sys.stderr)
+            index = cls(directory)
+        index.rows = {
+            name: row for row, name in enumerate(index.names)
+            if index.alive[row]
+        }
+        # Rows appended after the last save are not in the metadata.
+        index._truncate()
+        return index
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _vectors_path(self) -> Path:
+        return self.directory / self.VECTORS
+
+    def _truncate(self) -> None:
+        path = self._vectors_path()
+        size = len(self.names) * (self.dimension or 0) * 2
+        try:
+            if path.stat().st_size != size:
+                os.truncate(path, size)
+        except FileNotFoundError:
+            pass
+
+    def vectors(self) -> np.ndarray:
+        """ `(rows, dimension)' float16 matrix, memory-mapped. """
+        if self._vectors is None:
+            if not self.names:
+                return np.zeros((0, self.dimension or 0), dtype=np.float16)
+            self._vectors = np.memmap(
+                self._vectors_path(), dtype=np.float16, mode='r',
+                shape=(len(self.names), self.dimension)
+            )
+        return self._vectors
+
+    def is_current(self, name: str, stat: Tuple[int, int]) -> bool:
+        row = self.rows.get(name)
+        return row is not None and tuple(self.stats[row]) == tuple(stat)
+
+    def get(
+            self,
+            name: str,
+            stat: Tuple[int, int] = None
+    ) -> Optional[np.ndarray]:
+        """ Normalized embedding of an image, if current for `stat'. """
+        row = self.rows.get(name)
+        if row is None or (
+                stat is not None and tuple(self.stats[row]) != tuple(stat)):
+            return None
+        return self.vectors()[row].astype(np.float32)
+
+    def add(
+            self,
+            names: List[str],
+            stats: List[Tuple[int, int]],
+            vectors: np.ndarray
+    ) -> None:
+        """ Add or replace the embeddings of images. """
+        if not names:
+            return
+        vectors = _normalize(
+            np.asarray(vectors, dtype=np.float32).reshape(len(names), -1)
+        )
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(
+                f'embeddings have {vectors.shape[1]} dimensions, the index '
+                f'{self.dimension}'
+            )
+        self.remove(names)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self._vectors_path(), 'ab') as f:
+            f.write(vectors.astype(np.float16).tobytes())
+        first = len(self.names)
+        self.names += names
+        self.rows.update(
+            (name, row) for row, name in enumerate(names, first)
+        )
+        self.stats = np.concatenate([
+            self.stats, np.asarray(stats, dtype=np.int64).reshape(-1, 2)
+        ])
+        self.alive = np.concatenate([
+            self.alive, np.ones(len(names), dtype=bool)
+        ])
+        assignment = np.full(len(names), -1, dtype=np.int32)
+        if self.centroids is not None:
+            assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        self.assignment = np.concatenate([
+            self.assignment, assignment.astype(np.int32)
+        ])
+        self._vectors = None
+        self._lists = None
+        self.changed = True
+
+    def remove(self, names: Iterable[str]) -> None:
+        for name in names:
+            row = self.rows.pop(name, None)
+            if row is not None:
+                self.alive[row] = False
+                self.changed = True
+
+    def needs_training(self) -> bool:
+        """ Large enough for lists, and grown a lot since trained. """
+        return len(self) >= self.MIN_TRAIN and (
+            self.centroids is None or len(self) > 2 * self.trained_count
+        )
+
+    def train(self, iterations: int = 10, seed: int = 0) -> None:
+        """
+        Cluster the vectors into lists with spherical k-means on a sample,
+        then rewrite them list by list, dropping dead rows.
+        """
+        live = np.flatnonzero(self.alive)
+        if len(live) == 0:
+            return
+        vectors = self.vectors()
+        rng = np.random.default_rng(seed)
+        clusters = max(1, int(math.sqrt(len(live))))
+        sample = np.sort(rng.choice(
+            live, min(len(live), 32 * clusters), replace=False
+        ))
+        x = vectors[sample].astype(np.float32)
+        centroids = x[rng.choice(len(x), clusters, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(x @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, x)
+            counts = np.bincount(labels, minlength=clusters)
+            # Empty clusters keep their centroid.
+            sums[counts == 0] = centroids[counts == 0]
+            centroids = _normalize(sums)
+
+        assignment = np.concatenate([
+            np.argmax(
+                vectors[live[i:i + self.CHUNK_ROWS]].astype(np.float32)
+                @ centroids.T, axis=1
+            )
+            for i in range(0, len(live), self.CHUNK_ROWS)
+        ]).astype(np.int32)
+        order = np.argsort(assignment, kind='stable')
+        rows = live[order]
+        tmp_path = self._vectors_path().with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            for i in range(0, len(rows), self.CHUNK_ROWS):
+                f.write(np.ascontiguousarray(
+                    vectors[rows[i:i + self.CHUNK_ROWS]]
+                ).tobytes())
+        self._vectors = None
+        os.replace(tmp_path, self._vectors_path())
+        self.names = [self.names[row] for row in rows.tolist()]
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self.stats = self.stats[rows]
+        self.alive = np.ones(len(rows), dtype=bool)
+        self.assignment = assignment[order]
+        self.centroids = centroids
+        self.trained_count = len(rows)
+        self._lists = None
+        self.changed = True
+        # The metadata must match the rewritten vectors.
+        self.save()
+
+    def _inverted_lists(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Where each list starts among the trained rows, which are stored list
+        by list, and the rows added since training.
+        """
+        if self._lists is None:
+            bounds = np.searchsorted(
+                self.assignment[:self.trained_count],
+                np.arange(len(self.centroids) + 1)
+            )
+            added = np.arange(self.trained_count, len(self.names))
+            self._lists = bounds, added
+        return self._lists
+
+    def _score(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        vectors = self.vectors()
+        return np.concatenate([
+            vectors[rows[i:i + self.CHUNK_ROWS]].astype(np.float32) @ query
+            for i in range(0, len(rows), self.CHUNK_ROWS)
+        ]) if len(rows) else np.zeros(0, dtype=np.float32)
+
+    def search(
+            self,
+            query: np.ndarray,
+            k: int = 10,
+            nprobe: int = None
+    ) -> List[Tuple[str, float]]:
+        """
+        `(name, similarity)' of the `k' images most similar to `query', most
+        similar first.  Exact below `MIN_TRAIN' vectors, approximate above.
+        """
+        if not self.rows:
+            return []
+        query = _normalize(np.asarray(query, dtype=np.float32).ravel())
+        if self.centroids is None:
+            candidates = np.flatnonzero(self.alive)
+            scores = self._score(candidates, query)
+        else:
+            bounds, added = self._inverted_lists()
+            nprobe = min(nprobe or self.NPROBE, len(self.centroids))
+            closest = np.sort(np.argpartition(
+                -(self.centroids @ query), nprobe - 1
+            )[:nprobe])
+            # Lists are contiguous, read them as slices of the matrix rather
+            # than gathering rows.
+            vectors = self.vectors()
+            candidates = [
+                np.arange(bounds[c], bounds[c + 1]) for c in closest
+            ]
+            scores = [
+                vectors[bounds[c]:bounds[c + 1]].astype(np.float32) @ query
+                for c in closest
+            ]
+            added = added[np.isin(self.assignment[added], closest)]
+            candidates.append(added)
+            scores.append(self._score(added, query))
+            candidates = np.concatenate(candidates)
+            scores = np.concatenate(scores)
+            alive = self.alive[candidates]
+            candidates, scores = candidates[alive], scores[alive]
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [
+            (self.names[row], float(score))
+            for row, score in zip(candidates[top].tolist(),
+                                  scores[top].tolist())
+        ]
+
+    def save(self) -> None:
+        """ Write the metadata, the vectors are written as they are added. """
+        if not self.changed:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.directory / f'{self.META}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                dimension=np.int64(self.dimension or 0),
+                names=np.array('\0'.join(self.names)),
+                stats=self.stats,
+                alive=self.alive,
+                assignment=self.assignment,
+                centroids=(
+                    self.centroids if self.centroids is not None
+                    else np.zeros((0, self.dimension or 0), np.float32)
+                ),
+                trained_count=np.int64(self.trained_count)
+            )
+        os.replace(tmp_path, self.directory / self.META)
+        self.changed = False
+
+
+def neighbour_tags(
+        neighbours: List[Tuple[str, float]],
+        tags_of: Callable[[str], List[str]],
+        exclude: Iterable[str] = (),
+        min_share: float = 0.25,
+        limit: int = 20
+) -> List[Tuple[str, float]]:
+    """
+    Tags common among `neighbours', `(name, similarity)' pairs, with their
+    share of the neighbours weighted by similarity.  Tags below `min_share'
+    and those in `exclude' are left out.
+    """
+    exclude = set(exclude)
+    weights: Dict[str, float] = {}
+    total = 0.0
+    for name, similarity in neighbours:
+        weight = max(similarity, 0.0)
+        total += weight
+        for tag in tags_of(name):
+            if tag not in exclude:
+                weights[tag] = weights.get(tag, 0.0) + weight
+    if total <= 0:
+        return []
+    shares = sorted(
+        ((tag, weight / total) for tag, weight in weights.items()),
+        key=lambda item: (-item[1], item[0])
+    )
+    return [item for item in shares if item[1] >= min_share][:limit]
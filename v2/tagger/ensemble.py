@@ -0,0 +1,342 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from tagger.interrogator import Interrogator
+
+# How the confidences of an ensemble's models are merged, for each label
+# among the models whose vocabulary has it: the highest, their mean, or
+# their mean where most of them are over the vote threshold and 0 elsewhere.
+MERGE_RULES = ('max', 'mean', 'vote')
+
+
+def ensemble_key(
+    keys: List[str],
+    rule: str,
+    vote_threshold: float = None
+) -> str:
+    """
+    Name of an ensemble of `interrogators' keys, e.g. for caches.  Votes
+    depend on the threshold, which is part of the name for that rule.
+    """
+    if rule == 'vote':
+        return f'{"+".join(keys)}:{rule}@{vote_threshold:g}'
+    return f'{"+".join(keys)}:{rule}'
+
+
+class SharedInputs():
+    """
+    What an ensemble preprocesses an image to: one tensor per distinct
+    preprocessing among its models.  In batches, parts whose tensors differ
+    in shape are lists of them, which their models run by shape.
+    """
+    def __init__(self, parts: List[np.ndarray | List[np.ndarray]]) -> None:
+        self.parts = tuple(parts)
+
+    @property
+    def shape(self) -> tuple:
+        # What batches are grouped by.  Any can be stacked together, models
+        # taking fixed size inputs get full batches whatever the others take.
+        return (len(self.parts),)
+
+
+class EnsembleInterrogator(Interrogator):
+    """
+    Several interrogators run on the same images, their confidences merged by
+    `rule' over the union of their vocabularies.
+
+    Images are decoded once for all models, and models which preprocess
+    alike share the tensor.  The models' sessions run concurrently, each with
+    its share of the intra-op thread budget, so an ensemble takes about as
+    long as its slowest model.
+    """
+    def __init__(
+        self,
+        members: List[Interrogator],
+        rule: str = 'mean',
+        vote_threshold: float = 0.35
+    ) -> None:
+        if len(members) < 2:
+            raise ValueError('an ensemble needs at least two models')
+        self.members = members
+        super().__init__(
+            f'{" + ".join(member.name for member in members)} ({rule})'
+        )
+        self.set_rule(rule, vote_threshold)
+        # Union label index of each member's outputs, filled in with the
+        # labels.
+        self.columns: List[np.ndarray] = []
+        # Members grouped by `preprocess_key', in the order of the parts of
+        # `SharedInputs'.
+        self.groups: List[List[int]] = []
+        self._pool: ThreadPoolExecutor = None
+
+    # The members' setting, which the base class sets in `__init__'.
+    @property
+    def max_pixels(self) -> int:
+        return self.members[0].max_pixels
+
+    @max_pixels.setter
+    def max_pixels(self, max_pixels: int) -> None:
+        for member in self.members:
+            member.max_pixels = max_pixels
+
+    def set_rule(self, rule: str, vote_threshold: float = None) -> None:
+        if rule not in MERGE_RULES:
+            raise ValueError(f'unknown merge rule {rule!r}')
+        self.rule = rule
+        if vote_threshold is not None:
+            self.vote_threshold = vote_threshold
+
+    def use_cpu(self) -> None:
+        super().use_cpu()
+        for member in self.members:
+            member.use_cpu()
+
+    def set_batch_size(self, batch_size: int) -> None:
+        super().set_batch_size(batch_size)
+        for member in self.members:
+            member.set_batch_size(batch_size)
+
+    def set_embedding_layer(self, layer: str) -> None:
+        super().set_embedding_layer(layer)
+        for member in self.members:
+            member.set_embedding_layer(layer)
+
+    def configure_session(
+        self,
+        intra_op_threads: int = None,
+        inter_op_threads: int = None,
+        graph_optimization: str = None,
+        cache_optimized_model: bool = None
+    ) -> None:
+        """
+        Like `Interrogator.configure_session', with `intra_op_threads' the
+        budget shared by all models (0 for one thread per core).  Running
+        concurrently, models each with every core would contend for them.
+        """
+        super().configure_session(
+            intra_op_threads, inter_op_threads,
+            graph_optimization, cache_optimized_model
+        )
+        budget = self.intra_op_threads or os.cpu_count() or 1
+        count = len(self.members)
+        for i, member in enumerate(self.members):
+            member.configure_session(
+                intra_op_threads=max(
+                    1, budget // count + (i < budget % count)
+                ),
+                inter_op_threads=self.inter_op_threads,
+                graph_optimization=self.graph_optimization,
+                cache_optimized_model=self.cache_optimized_model
+            )
+
+    def _map(self, function: Callable, *arguments: list) -> list:
+        """ `function' applied to each member and arguments concurrently. """
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=len(self.members),
+                thread_name_prefix='ensemble'
+            )
+        return list(self._pool.map(function, self.members, *arguments))
+
+    def load(self) -> None:
+        start = time.perf_counter()
+        self._map(lambda member: member.load())
+        self.merge_labels()
+        self.load_timings = {'session': time.perf_counter() - start}
+        print(f'Loaded {self.name}', file=sys.stderr)
+
+    def load_labels(self) -> None:
+        for member in self.members:
+            if member.tag_names is None:
+                member.load_labels()
+        self.merge_labels()
+
+    def merge_labels(self) -> None:
+        """ Union of the members' ratings and tags, in their order. """
+        ratings: Dict[str, int] = {}
+        tags: Dict[str, int] = {}
+        for member in self.members:
+            for name in member.rating_names.tolist():
+                ratings.setdefault(name, len(ratings))
+            categories = member.tag_categories.tolist()
+            for name, category in zip(member.tag_names.tolist(), categories):
+                tags.setdefault(name, category)
+        self.set_labels(
+            [*ratings, *tags],
+            [0] * len(ratings) + list(tags.values()),
+            rating_count=len(ratings)
+        )
+        self.columns = [
+            np.array(
+                [ratings[name] for name in member.rating_names.tolist()]
+                + [len(ratings) + self.tag_index[name]
+                   for name in member.tag_names.tolist()],
+                dtype=np.int64
+            )
+            for member in self.members
+        ]
+
+    def unload(self) -> bool:
+        unloaded = False
+        for member in self.members:
+            unloaded = member.unload() or unloaded
+        self.rating_names = None
+        self.tag_names = None
+        self.tag_categories = None
+        self.tag_index = {}
+        return unloaded
+
+    def is_loaded(self) -> bool:
+        return all(member.is_loaded() for member in self.members) \
+            and self.tag_names is not None
+
+    def max_batch_size(self) -> int:
+        return min(member.max_batch_size() for member in self.members)
+
+    def _group(self) -> List[List[int]]:
+        if not self.groups:
+            groups: Dict[object, List[int]] = {}
+            for i, member in enumerate(self.members):
+                groups.setdefault(member.preprocess_key(), []).append(i)
+            self.groups = list(groups.values())
+        return self.groups
+
+    def preprocess(self, image: Image) -> SharedInputs:
+        """
+        Decode `image' once, at the size the most demanding model needs, then
+        preprocess it once per group of models preprocessing alike.
+        """
+        import tagger.dbimutils as dbimutils
+
+        if not self.is_loaded():
+            self.load()
+        groups = self._group()
+        sizes = [self.members[group[0]].decode_size() for group in groups]
+        size, edge = max(sizes, key=lambda s: s[0] / s[1](image.size))
+        image = dbimutils.prescale(image, size, edge, self.max_pixels)
+        # Members' own `prescale' can no longer draft it, only reduce it.
+        image.load()
+        return SharedInputs([
+            self.members[group[0]].preprocess(image) for group in groups
+        ])
+
+    def stack(self, tensors: List[SharedInputs]) -> SharedInputs:
+        return SharedInputs([
+            np.stack(part) if all(t.shape == part[0].shape for t in part)
+            else list(part)
+            for part in zip(*(t.parts for t in tensors))
+        ])
+
+    def _inputs(self, batch: SharedInputs) -> list:
+        """ The part of `batch' each member takes. """
+        inputs = [None] * len(self.members)
+        for group, part in zip(self._group(), batch.parts):
+            for i in group:
+                inputs[i] = part
+        return inputs
+
+    @staticmethod
+    def _run(
+        member: Interrogator,
+        inputs: np.ndarray | List[np.ndarray],
+        embed: bool
+    ) -> Tuple[np.ndarray, ...]:
+        """
+        `member.predict_embeddings' if `embed', else `member.predict', on
+        a batch or a list of tensors, run a shape at a time.
+        """
+        def run(batch: np.ndarray) -> Tuple[np.ndarray, ...]:
+            if embed:
+                return member.predict_embeddings(batch)
+            return (member.predict(batch),)
+
+        if isinstance(inputs, np.ndarray):
+            return run(inputs)
+        shapes: Dict[tuple, List[int]] = {}
+        for i, tensor in enumerate(inputs):
+            shapes.setdefault(tensor.shape, []).append(i)
+        results = None
+        for rows in shapes.values():
+            outputs = run(np.stack([inputs[i] for i in rows]))
+            if results is None:
+                results = [
+                    np.empty((len(inputs), *output.shape[1:]), output.dtype)
+                    for output in outputs
+                ]
+            for result, output in zip(results, outputs):
+                result[rows] = output
+        return tuple(results)
+
+    def merge(self, confidences: List[np.ndarray]) -> np.ndarray:
+        """ The members' confidences merged by `rule'. """
+        count = len(confidences[0])
+        labels = self.rating_count + len(self.tag_names)
+        stacked = np.full(
+            (len(self.members), count, labels), np.nan, dtype=np.float32
+        )
+        for i, rows in enumerate(confidences):
+            stacked[i][:, self.columns[i]] = rows
+        if self.rule == 'max':
+            return np.nanmax(stacked, axis=0)
+        mean = np.nanmean(stacked, axis=0)
+        if self.rule == 'mean':
+            return mean
+        known = (~np.isnan(stacked)).sum(axis=0)
+        with np.errstate(invalid='ignore'):
+            votes = (stacked >= self.vote_threshold).sum(axis=0)
+        return np.where(2 * votes > known, mean, 0).astype(np.float32)
+
+    def predict(self, batch: SharedInputs) -> np.ndarray:
+        return self.merge([
+            confidences for confidences, in self._map(
+                lambda member, inputs: self._run(member, inputs, False),
+                self._inputs(batch)
+            )
+        ])
+
+    def predict_embeddings(
+        self,
+        batch: SharedInputs
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Like `Interrogator.predict_embeddings'.  Penultimate embeddings are
+        the members', each normalized, side by side.
+        """
+        results = self._map(
+            lambda member, inputs: self._run(member, inputs, True),
+            self._inputs(batch)
+        )
+        confidences = self.merge([result[0] for result in results])
+        if self.embedding_layer == 'confidences':
+            return confidences, confidences[:, self.rating_count:]
+        embeddings = [
+            embedding / np.maximum(
+                np.linalg.norm(embedding, axis=-1, keepdims=True), 1e-12
+            )
+            for _, embedding in results
+        ]
+        return confidences, np.concatenate(embeddings, axis=1)
+
+    def cold_start_report(self, first_tags: float) -> str:
+        return '\n'.join([
+            f'{self.name}: first tags {first_tags:.2f} s after loading '
+            f'(load {self.load_timings["session"]:.2f} s)',
+            *(f'  {member.cold_start_report(first_tags)}'
+              for member in self.members)
+        ])
+
+    def warm_up(self) -> float:
+        """ Warm up each member, concurrently. """
+        if not self.is_loaded():
+            self.load()
+        start = time.perf_counter()
+        self._map(lambda member: member.warm_up())
+        self.load_timings['warm_up'] = time.perf_counter() - start
+        return self.load_timings['warm_up']
@@ -1,21 +1,27 @@
 import sys
 import os
-import pandas as pd
+import csv
+import time
+import hashlib
 import numpy as np
 
-from typing import Iterable, Tuple, List, Dict
+from typing import Callable, Hashable, Iterable, Tuple, List, Dict
 from PIL import Image
 
 from pathlib import Path
-from huggingface_hub import hf_hub_download
 import re
 import json
 
-from numpy import asarray, float32, expand_dims, exp
+from numpy import asarray, float32, exp
 
 tag_escape_pattern = re.compile(r'([\\()])')
 
-import tagger.dbimutils as dbimutils
+# What `predict_embeddings' returns as an image's embedding: the tag
+# confidences, or the input of the model's final fully connected layer.
+EMBEDDING_LAYERS = ('confidences', 'penultimate')
+
+# ONNX Runtime graph optimization levels, from none to all.
+GRAPH_OPTIMIZATIONS = ('disable', 'basic', 'extended', 'all')
 
 
 class Interrogator:
@@ -70,13 +76,130 @@ class Interrogator:
 
         return tags
 
-    def __init__(self, name: str) -> None:
+    def postprocess_confidences(
+        self,
+        confidences: np.ndarray,
+        threshold=0.35,
+        top_k: int = None,
+        additional_tags: List[str] = [],
+        exclude_tags: Iterable[str] = [],
+        sort_by_alphabetical_order=False,
+        add_confident_as_weight=False,
+        replace_underscore=False,
+        replace_underscore_excludes: List[str] = [],
+        escape_tag=False,
+        exclude_mask: np.ndarray = None
+    ) -> Dict[str, float]:
+        """
+        Vectorized equivalent of `postprocess_tags' operating directly on a
+        row of model output.  Thresholding, exclusion and top-k selection are
+        done with array operations; only surviving tags become Python strings.
+        `exclude_mask', a boolean array over the tags, excludes more tags.
+        """
+        if self.tag_names is None:
+            self.load_labels()
+        scores = np.asarray(confidences)[self.rating_count:]
+
+        keep = np.flatnonzero(scores >= threshold)
+        excluded = [
+            self.tag_index[tag] for tag in exclude_tags if tag in self.tag_index
+        ]
+        if excluded and len(keep) > 0:
+            keep = keep[~np.isin(keep, excluded)]
+        if exclude_mask is not None:
+            keep = keep[~exclude_mask[keep]]
+        if top_k is not None and len(keep) > top_k:
+            keep = keep[np.argpartition(-scores[keep], top_k - 1)[:top_k]]
+
+        if sort_by_alphabetical_order:
+            keep = keep[np.argsort(self.tag_names[keep], kind='stable')]
+        else:
+            keep = keep[np.argsort(-scores[keep], kind='stable')]
+
+        tags = {t: 1.0 for t in additional_tags}
+        for tag, c in zip(self.tag_names[keep].tolist(), scores[keep].tolist()):
+            if tag in tags:
+                continue
+
+            new_tag = tag
+
+            if replace_underscore and tag not in replace_underscore_excludes:
+                new_tag = new_tag.replace('_', ' ')
+
+            if escape_tag:
+                new_tag = tag_escape_pattern.sub(r'\\\1', new_tag)
+
+            if add_confident_as_weight:
+                new_tag = f'({new_tag}:{c})'
+
+            tags[new_tag] = c
+
+        return tags
+
+    def __init__(
+        self,
+        name: str,
+        batch_size: int = 8,
+        max_pixels: int = 64 * 1024 * 1024
+    ) -> None:
         self.name = name
         self.providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+        # Upper limit on the number of images stacked into a single
+        # `InferenceSession.run' call by `large_batch_interrogate'.
+        self.batch_size = batch_size
+        # Images that can not be decoded below this many pixels are refused,
+        # keeping memory bounded regardless of the input (`None' disables).
+        self.max_pixels = max_pixels
+        # Label vocabulary, filled in by `load_labels'.  The first
+        # `rating_count' model outputs are ratings, the rest are tags.
+        self.rating_count = 0
+        self.rating_names: np.ndarray = None
+        self.tag_names: np.ndarray = None
+        self.tag_categories: np.ndarray = None
+        self.tag_index: Dict[str, int] = {}
+        self.embedding_layer = 'confidences'
+        # Model output holding the penultimate layer, set by `create_session'.
+        self.embedding_output: str = None
+        # Session configuration, see `configure_session'.
+        self.intra_op_threads = 0
+        self.inter_op_threads = 0
+        self.graph_optimization = 'all'
+        self.cache_optimized_model = True
+        # INT8 variant of the model loaded instead of it, `dynamic' or
+        # `static', see `tagger.quantize'.
+        self.quantization: str = None
+        # Seconds taken by the last load: `session' to create the session,
+        # `warm_up' for the first model run if `warm_up' was called.
+        self.load_timings: Dict[str, float] = {}
 
     def load(self):
         raise NotImplementedError()
 
+    def load_labels(self):
+        """
+        Load only the label vocabulary, without creating a session.
+        """
+        raise NotImplementedError()
+
+    def set_labels(
+        self,
+        names: List[str],
+        categories: List[int] = None,
+        rating_count: int = 0
+    ) -> None:
+        names = np.asarray(names, dtype=object)
+        if categories is None:
+            categories = np.zeros(len(names), dtype=np.int32)
+        self.rating_count = rating_count
+        self.rating_names = names[:rating_count]
+        self.tag_names = names[rating_count:]
+        self.tag_categories = np.asarray(categories, dtype=np.int32)[
+            rating_count:
+        ]
+        self.tag_index = {
+            name: i for i, name in enumerate(self.tag_names.tolist())
+        }
+
     def unload(self) -> bool:
         unloaded = False
 
@@ -85,14 +208,291 @@ class Interrogator:
             unloaded = True
             print(f'Unloaded {self.name}', file=sys.stderr)
 
-        if hasattr(self, 'tags'):
-            del self.tags
+        self.rating_names = None
+        self.tag_names = None
+        self.tag_categories = None
+        self.tag_index = {}
 
         return unloaded
 
     def use_cpu(self) -> None:
         self.providers = ['CPUExecutionProvider']
 
+    def set_embedding_layer(self, layer: str) -> None:
+        """ Takes effect when the model is next loaded. """
+        if layer not in EMBEDDING_LAYERS:
+            raise ValueError(f'unknown embedding layer {layer!r}')
+        self.embedding_layer = layer
+
+    def configure_session(
+        self,
+        intra_op_threads: int = None,
+        inter_op_threads: int = None,
+        graph_optimization: str = None,
+        cache_optimized_model: bool = None
+    ) -> None:
+        """
+        Threads running each operator and independent operators (0 for ONNX
+        Runtime's defaults), how far the graph is optimized and whether the
+        optimized graph is cached for the next load.  Arguments left None
+        are unchanged.  Takes effect when the model is next loaded.
+        """
+        if graph_optimization is not None:
+            if graph_optimization not in GRAPH_OPTIMIZATIONS:
+                raise ValueError(
+                    f'unknown graph optimization {graph_optimization!r}'
+                )
+            self.graph_optimization = graph_optimization
+        if intra_op_threads is not None:
+            self.intra_op_threads = max(0, intra_op_threads)
+        if inter_op_threads is not None:
+            self.inter_op_threads = max(0, inter_op_threads)
+        if cache_optimized_model is not None:
+            self.cache_optimized_model = cache_optimized_model
+
+    def session_options(self):
+        from onnxruntime import (
+            ExecutionMode,
+            GraphOptimizationLevel,
+            SessionOptions
+        )
+        options = SessionOptions()
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        if self.inter_op_threads > 1:
+            # Inter-op threads are only used by the parallel executor.
+            options.execution_mode = ExecutionMode.ORT_PARALLEL
+        options.graph_optimization_level = {
+            'disable': GraphOptimizationLevel.ORT_DISABLE_ALL,
+            'basic': GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            'extended': GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            'all': GraphOptimizationLevel.ORT_ENABLE_ALL
+        }[self.graph_optimization]
+        return options
+
+    def optimized_model_path(self, model_path: os.PathLike) -> Path:
+        """
+        Where the model optimized for the current providers and optimization
+        level is cached.  Optimized graphs may hold operators specific to the
+        providers, ONNX Runtime version and CPU, which are part of the key;
+        the host stands for the CPU as caches may be on shared home
+        directories.
+        """
+        import platform
+        import onnxruntime
+        from tagger.cache import default_cache_dir
+        st = os.stat(model_path)
+        ident = '\0'.join([
+            os.path.abspath(model_path), str(st.st_size),
+            str(st.st_mtime_ns), onnxruntime.__version__,
+            ','.join(self.providers), self.graph_optimization,
+            platform.node(), platform.machine()
+        ])
+        key = hashlib.sha1(ident.encode('utf-8')).hexdigest()
+        return default_cache_dir() / 'models' / f'{key}-optimized.onnx'
+
+    def create_session(self, model_path: os.PathLike):
+        """
+        ONNX Runtime session of the model, with the penultimate layer as an
+        extra output when it is the embedding layer.
+
+        The graph optimized by the first load is cached and later loads read
+        it with optimizations off, skipping the optimization passes.
+        """
+        from onnxruntime import GraphOptimizationLevel, InferenceSession
+        start = time.perf_counter()
+        if self.quantization is not None:
+            from tagger.quantize import quantized_model_path
+            model_path = quantized_model_path(model_path, self.quantization)
+            if not model_path.exists():
+                raise FileNotFoundError(
+                    f'{self.name}: no quantized model at {model_path}, make '
+                    f'it with `python3 -m tagger.quantize\''
+                )
+        self.embedding_output = None
+        if self.embedding_layer == 'penultimate':
+            from tagger.embeddings import expose_penultimate
+            exposed = expose_penultimate(model_path)
+            if exposed is not None:
+                model_path, self.embedding_output = exposed
+
+        options = self.session_options()
+        how = f'graph optimization {self.graph_optimization}'
+        cached_path = tmp_path = None
+        if self.cache_optimized_model and self.graph_optimization != 'disable':
+            cached_path = self.optimized_model_path(model_path)
+            if cached_path.exists():
+                options.graph_optimization_level = \
+                    GraphOptimizationLevel.ORT_DISABLE_ALL
+                try:
+                    session = InferenceSession(
+                        str(cached_path),
+                        sess_options=options,
+                        providers=self.providers
+                    )
+                    self.load_timings = {
+                        'session': time.perf_counter() - start
+                    }
+                    print(f'Created {self.name} session in '
+                          f'{self.load_timings["session"]:.2f} s, optimized '
+                          f'graph from {cached_path}', file=sys.stderr)
+                    return session
+                except Exception as e:
+                    print(f'Failed to load the optimized graph {cached_path},'
+                          f' optimizing again: {e}', file=sys.stderr)
+                    options = self.session_options()
+            cached_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cached_path.with_suffix(f'.{os.getpid()}.tmp')
+            options.optimized_model_filepath = str(tmp_path)
+            how += ', cached'
+
+        session = InferenceSession(
+            str(model_path), sess_options=options, providers=self.providers
+        )
+        if tmp_path is not None:
+            try:
+                os.replace(tmp_path, cached_path)
+            except OSError as e:
+                print(f'Failed to cache the optimized graph: {e}',
+                      file=sys.stderr)
+        self.load_timings = {'session': time.perf_counter() - start}
+        print(f'Created {self.name} session in '
+              f'{self.load_timings["session"]:.2f} s, {how}', file=sys.stderr)
+        return session
+
+    def cold_start_report(self, first_tags: float) -> str:
+        """ Load timings, given the seconds from loading to first tags. """
+        report = f'{self.name}: first tags {first_tags:.2f} s after loading'
+        timings = ', '.join(
+            f'{step.replace("_", "-")} {seconds:.2f} s'
+            for step, seconds in self.load_timings.items()
+        )
+        threads = (
+            f'{self.intra_op_threads or "default"} intra-op, '
+            f'{self.inter_op_threads or "default"} inter-op threads, '
+            f'graph optimization {self.graph_optimization}'
+        )
+        return f'{report} ({timings}; {threads})'
+
+    def warm_up(self) -> float:
+        """
+        Run the model once on a blank image, so the first image tagged does
+        not pay for allocating buffers and initializing kernels.  Returns
+        the seconds taken.
+        """
+        if not self.is_loaded():
+            self.load()
+        start = time.perf_counter()
+        blank = Image.new('RGB', (64, 64), 'white')
+        self.predict_embeddings(self.stack([self.preprocess(blank)]))
+        self.load_timings['warm_up'] = time.perf_counter() - start
+        return self.load_timings['warm_up']
+
+    def set_batch_size(self, batch_size: int) -> None:
+        if batch_size < 1:
+            raise ValueError(f'batch size must be positive, got {batch_size}')
+        self.batch_size = batch_size
+
+    def is_loaded(self) -> bool:
+        return getattr(self, 'model', None) is not None
+
+    def max_batch_size(self) -> int:
+        """
+        Largest batch the loaded model accepts, capped by `batch_size'.
+        Models exported with a fixed batch dimension are run one at a time.
+        """
+        if not self.is_loaded():
+            self.load()
+        batch_dim = self.model.get_inputs()[0].shape[0]
+        if isinstance(batch_dim, int) and batch_dim > 0:
+            return min(batch_dim, self.batch_size)
+        return self.batch_size
+
+    def decode_size(self) -> Tuple[int, Callable]:
+        """
+        Size `preprocess' prescales images to and the edge measured against
+        it, as passed to `dbimutils.prescale'.
+        """
+        raise NotImplementedError()
+
+    def preprocess_key(self) -> Hashable:
+        """
+        Interrogators with equal keys preprocess images to the same tensors,
+        which an ensemble of them computes once.
+        """
+        try:
+            return (type(self), *self.decode_size())
+        except NotImplementedError:
+            return id(self)
+
+    def preprocess(self, image: Image) -> np.ndarray:
+        """
+        Convert a single image to a model input tensor without the batch axis.
+        """
+        raise NotImplementedError()
+
+    def stack(self, tensors: List[np.ndarray]) -> np.ndarray:
+        """ Batch of tensors from `preprocess', for `predict'. """
+        return np.stack(tensors)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Run the model on a stacked batch of preprocessed images, returning a
+        `(N, labels)' array of confidences.
+        """
+        input_name = self.model.get_inputs()[0].name
+        label_name = self.model.get_outputs()[0].name
+        return self.to_confidences(
+            self.model.run([label_name], {input_name: batch})[0]
+        )
+
+    def to_confidences(self, output: np.ndarray) -> np.ndarray:
+        """ Confidences from the model's raw output. """
+        return output
+
+    def predict_embeddings(
+        self,
+        batch: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Like `predict', also returning an `(N, dimension)' array with the
+        embedding of each image from the same model run: the penultimate
+        layer if exposed, otherwise the tag confidences.
+        """
+        if self.embedding_output is None:
+            confidences = self.predict(batch)
+            return confidences, confidences[:, self.rating_count:]
+        input_name = self.model.get_inputs()[0].name
+        label_name = self.model.get_outputs()[0].name
+        output, embeddings = self.model.run(
+            [label_name, self.embedding_output], {input_name: batch}
+        )
+        return (
+            self.to_confidences(output),
+            embeddings.reshape(len(batch), -1)
+        )
+
+    def split_confidences(
+        self,
+        confidences: np.ndarray
+    ) -> Tuple[
+        Dict[str, float],  # rating confidents
+        Dict[str, float]  # tag confidents
+    ]:
+        """
+        Map a single row of confidences back to rating and tag names.
+        """
+        if self.tag_names is None:
+            self.load_labels()
+        confidences = np.asarray(confidences).tolist()
+        ratings = dict(zip(
+            self.rating_names.tolist(), confidences[:self.rating_count]
+        ))
+        tags = dict(zip(
+            self.tag_names.tolist(), confidences[self.rating_count:]
+        ))
+        return ratings, tags
+
     def interrogate(
         self,
         image: Image
@@ -100,7 +500,70 @@ class Interrogator:
         Dict[str, float],  # rating confidents
         Dict[str, float]  # tag confidents
     ]:
-        raise NotImplementedError()
+        return self.batch_interrogate([image])[0]
+
+    def batch_interrogate(
+        self,
+        images: List[Image.Image]
+    ) -> List[Tuple[Dict[str, float], Dict[str, float]]]:
+        """
+        Interrogate `images' with a single model run.
+        All images must preprocess to the same shape.
+        """
+        if not images:
+            return []
+        if not self.is_loaded():
+            self.load()
+        batch = self.stack([self.preprocess(image) for image in images])
+        return [self.split_confidences(row) for row in self.predict(batch)]
+
+    def large_batch_interrogate(
+        self,
+        images: Iterable[Image.Image],
+        batch_size: int = None
+    ) -> List[Tuple[Dict[str, float], Dict[str, float]]]:
+        """
+        Interrogate any number of images, stacking up to `batch_size' (default
+        `self.batch_size') preprocessed tensors of matching shape into each
+        model run.  Results are returned in the same order as `images'.
+        """
+        return [
+            self.split_confidences(row)
+            for row in self.large_batch_predict(images, batch_size)
+        ]
+
+    def large_batch_predict(
+        self,
+        images: Iterable[Image.Image],
+        batch_size: int = None
+    ) -> List[np.ndarray]:
+        """
+        Like `large_batch_interrogate' but returns the raw confidence rows.
+        """
+        if not self.is_loaded():
+            self.load()
+        limit = min(batch_size or self.batch_size, self.max_batch_size())
+
+        results = []
+        # Pending tensors grouped by shape, each entry is `(index, tensor)'.
+        pending: Dict[tuple, List[Tuple[int, np.ndarray]]] = {}
+
+        def flush(shape: tuple) -> None:
+            entries = pending.pop(shape)
+            batch = self.stack([tensor for _, tensor in entries])
+            for (index, _), row in zip(entries, self.predict(batch)):
+                results.append((index, row))
+
+        for index, image in enumerate(images):
+            tensor = self.preprocess(image)
+            pending.setdefault(tensor.shape, []).append((index, tensor))
+            if len(pending[tensor.shape]) >= limit:
+                flush(tensor.shape)
+        for shape in list(pending):
+            flush(shape)
+
+        results.sort(key=lambda result: result[0])
+        return [row for _, row in results]
 
 class WaifuDiffusionInterrogator(Interrogator):
     def __init__(
@@ -119,45 +582,63 @@ class WaifuDiffusionInterrogator(Interrogator):
         print(f"Loading {self.name} model file from {self.kwargs['repo_id']}",
               file=sys.stderr)
 
+        from huggingface_hub import hf_hub_download
         model_path = Path(hf_hub_download(
             **self.kwargs, filename=self.model_path))
-        tags_path = Path(hf_hub_download(
-            **self.kwargs, filename=self.tags_path))
+        tags_path = self.download_labels()
         return model_path, tags_path
 
+    def download_labels(self) -> os.PathLike:
+        from huggingface_hub import hf_hub_download
+        return Path(hf_hub_download(**self.kwargs, filename=self.tags_path))
+
     def load(self) -> None:
         model_path, tags_path = self.download()
 
-        from onnxruntime import InferenceSession
-        self.model = InferenceSession(str(model_path), providers=self.providers)
+        self.model = self.create_session(model_path)
 
         print(f'Loaded {self.name} model from {model_path}', file=sys.stderr)
 
-        self.tags = pd.read_csv(tags_path)
+        self.read_labels(tags_path)
 
-    def interrogate(
-        self,
-        image: Image
-    ) -> Tuple[
-        Dict[str, float],  # rating confidents
-        Dict[str, float]  # tag confidents
-    ]:
+    def load_labels(self) -> None:
+        self.read_labels(self.download_labels())
+
+    def read_labels(self, tags_path: os.PathLike) -> None:
+        with open(tags_path, 'r', encoding='utf-8', newline='') as f:
+            rows = list(csv.DictReader(f))
+        # first 4 items are for rating (general, sensitive, questionable, explicit)
+        self.set_labels(
+            [row['name'] for row in rows],
+            [int(row.get('category') or 0) for row in rows],
+            rating_count=4
+        )
+
+    def decode_size(self) -> Tuple[int, Callable]:
         # init model
-        if not hasattr(self, 'model') or self.model is None:
+        if not self.is_loaded():
             self.load()
 
+        # the longest side is what `make_square' and `smart_resize' reduce
+        _, height, _, _ = self.model.get_inputs()[0].shape
+        return height, max
+
+    def preprocess(self, image: Image) -> np.ndarray:
+        # OpenCV is only needed once we actually tag something.
+        import tagger.dbimutils as dbimutils
+
         # code for converting the image and running the model is taken from the link below
         # thanks, SmilingWolf!
         # https://huggingface.co/spaces/SmilingWolf/wd-v1-4-tags/blob/main/app.py
 
         # convert an image to fit the model
-        _, height, _, _ = self.model.get_inputs()[0].shape
+        height, edge = self.decode_size()
+
+        # shrink huge images before any full size copies are made
+        image = dbimutils.prescale(image, height, edge, self.max_pixels)
 
         # alpha to white
-        image = image.convert('RGBA')
-        new_image = Image.new('RGBA', image.size, 'WHITE')
-        new_image.paste(image, mask=image)
-        image = new_image.convert('RGB')
+        image = dbimutils.fill_transparent(image)
         image = np.asarray(image)
 
         # PIL RGB to OpenCV BGR
@@ -165,24 +646,7 @@ class WaifuDiffusionInterrogator(Interrogator):
 
         image = dbimutils.make_square(image, height)
         image = dbimutils.smart_resize(image, height)
-        image = image.astype(np.float32)
-        image = np.expand_dims(image, 0)
-
-        # evaluate model
-        input_name = self.model.get_inputs()[0].name
-        label_name = self.model.get_outputs()[0].name
-        confidents = self.model.run([label_name], {input_name: image})[0]
-
-        tags = self.tags[:][['name']]
-        tags['confidents'] = confidents[0]
-
-        # first 4 items are for rating (general, sensitive, questionable, explicit)
-        ratings = dict(tags[:4].values)
-
-        # rest are regular tags
-        tags = dict(tags[4:].values)
-
-        return ratings, tags
+        return image.astype(np.float32)
 
 class MLDanbooruInterrogator(Interrogator):
     """ Interrogator for the MLDanbooru model. """
@@ -197,63 +661,58 @@ class MLDanbooruInterrogator(Interrogator):
         self.model_path = model_path
         self.tags_path = tags_path
         self.repo_id = repo_id
-        self.tags = None
         self.model = None
 
     def download(self) -> Tuple[str, str]:
         print(f"Loading {self.name} model file from {self.repo_id}",
               file=sys.stderr)
 
+        from huggingface_hub import hf_hub_download
         model_path = hf_hub_download(
             repo_id=self.repo_id,
             filename=self.model_path
         )
-        tags_path = hf_hub_download(
+        tags_path = self.download_labels()
+        return model_path, tags_path
+
+    def download_labels(self) -> str:
+        from huggingface_hub import hf_hub_download
+        return hf_hub_download(
             repo_id=self.repo_id,
             filename=self.tags_path,
         )
-        return model_path, tags_path
 
     def load(self) -> None:
         model_path, tags_path = self.download()
 
-        from onnxruntime import InferenceSession
-        self.model = InferenceSession(model_path,
-                                        providers=self.providers)
+        self.model = self.create_session(model_path)
         print(f'Loaded {self.name} model from {model_path}', file=sys.stderr)
 
+        self.read_labels(tags_path)
+
+    def load_labels(self) -> None:
+        self.read_labels(self.download_labels())
+
+    def read_labels(self, tags_path: str) -> None:
         with open(tags_path, 'r', encoding='utf-8') as filen:
-            self.tags = json.load(filen)
+            self.set_labels(json.load(filen))
 
-    def interrogate(
-        self,
-        image: Image
-    ) -> Tuple[
-        Dict[str, float],  # rating confidents
-        Dict[str, float]  # tag confidents
-    ]:
-        # init model
-        if self.model is None:
-            self.load()
+    def decode_size(self) -> Tuple[int, Callable]:
+        # `resize' scales the shortest side to the model size
+        return 448, min  # TODO CUSTOMIZE
 
+    def preprocess(self, image: Image) -> np.ndarray:
+        import tagger.dbimutils as dbimutils
+
+        size, edge = self.decode_size()
+        image = dbimutils.prescale(image, size, edge, self.max_pixels)
         image = dbimutils.fill_transparent(image)
-        image = dbimutils.resize(image, 448)  # TODO CUSTOMIZE
+        image = dbimutils.resize(image, size)
 
         x = asarray(image, dtype=float32) / 255
-        # HWC -> 1CHW
-        x = x.transpose((2, 0, 1))
-        x = expand_dims(x, 0)
-
-        input_ = self.model.get_inputs()[0]
-        output = self.model.get_outputs()[0]
-        # evaluate model
-        y, = self.model.run([output.name], {input_.name: x})
+        # HWC -> CHW
+        return x.transpose((2, 0, 1))
 
+    def to_confidences(self, output: np.ndarray) -> np.ndarray:
         # Softmax
-        y = 1 / (1 + exp(-y))
-
-        tags = {tag: float(conf) for tag, conf in zip(self.tags, y.flatten())}
-        return {}, tags
-
-    def large_batch_interrogate(self, images: List, dry_run=False) -> str:
-        raise NotImplementedError()
+        return 1 / (1 + exp(-output.reshape(len(output), -1)))
@@ -5,6 +5,7 @@ from tagger.interrogator import (
     WaifuDiffusionInterrogator,
     MLDanbooruInterrogator
 )
+from tagger.quantize import register_saved_variants
 
 interrogators: Dict[str, Interrogator] = {
     'wd14-vit.v1': WaifuDiffusionInterrogator(
@@ -78,3 +79,6 @@ interrogators: Dict[str, Interrogator] = {
         model_path='TResnet-D-FLq_ema_6-30000.onnx'
     ),
 }
+
+# INT8 variants made by `python3 -m tagger.quantize', as `MODEL.int8-MODE'.
+register_saved_variants(interrogators)
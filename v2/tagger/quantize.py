@@ -0,0 +1,430 @@
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from tagger.cache import default_cache_dir
+from tagger.interrogator import Interrogator
+
+# Dynamic quantization stores weights as INT8 and quantizes activations on
+# the fly, it needs no data and suits transformers (ViT, EVA02).  Static
+# quantization also fixes the activations' ranges from calibration images,
+# which suits convolutional models (ConvNeXt).
+QUANTIZATION_MODES = ('dynamic', 'static')
+
+
+def variant_key(key: str, mode: str) -> str:
+    """ Registry key of a quantized variant of the model at `key'. """
+    return f'{key}.int8-{mode}'
+
+
+def quantized_model_path(model_path: os.PathLike, mode: str) -> Path:
+    """ Where the INT8 variant of a model file is stored: next to it. """
+    path = Path(model_path)
+    return path.with_name(f'{path.stem}.int8-{mode}{path.suffix}')
+
+
+def variants_path() -> Path:
+    """ List of the variants made, registered on start. """
+    return default_cache_dir() / 'quantized.json'
+
+
+def register_variant(
+        interrogators: Dict[str, Interrogator],
+        key: str,
+        mode: str
+) -> Interrogator:
+    """
+    Add the INT8 variant of `interrogators[key]' to the registry: a copy
+    which loads the quantized model file instead of the original.
+    """
+    base = interrogators[key]
+    variant = copy.copy(base)
+    variant.name = f'{base.name} INT8 {mode}'
+    variant.quantization = mode
+    variant.model = None
+    variant.load_timings = {}
+    interrogators[variant_key(key, mode)] = variant
+    return variant
+
+
+def _read_variants() -> List[dict]:
+    try:
+        with open(variants_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        print(f'Failed to read quantized models: {e}', file=sys.stderr)
+        return []
+
+
+def register_saved_variants(interrogators: Dict[str, Interrogator]) -> None:
+    """ Register the variants made by `quantize' so far. """
+    for entry in _read_variants():
+        key, mode = entry.get('model'), entry.get('mode')
+        if key in interrogators and mode in QUANTIZATION_MODES:
+            register_variant(interrogators, key, mode)
+
+
+def _save_variant(key: str, mode: str) -> None:
+    entries = _read_variants()
+    if {'model': key, 'mode': mode} in entries:
+        return
+    entries.append({'model': key, 'mode': mode})
+    path = variants_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def _preprocessed(
+        interrogator: Interrogator,
+        paths: Iterable[Path]
+) -> Iterator[tuple[Path, np.ndarray]]:
+    """ `(path, tensor)' of the readable images of `paths'. """
+    for path in paths:
+        try:
+            with Image.open(path) as image:
+                yield path, interrogator.preprocess(image)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            print(f'Skipping {path}: {e}', file=sys.stderr)
+
+
+def _batches(
+        interrogator: Interrogator,
+        paths: Iterable[Path],
+        batch_size: int
+) -> Iterator[List[tuple[Path, np.ndarray]]]:
+    """
+    `_preprocessed' images in batches of one tensor shape, as models keeping
+    the aspect ratio preprocess to several.  At most a few batches worth of
+    tensors wait for their batch to fill, the largest partial one is run
+    when there are more.
+    """
+    pending: Dict[tuple, List[tuple[Path, np.ndarray]]] = {}
+    waiting = 0
+    for path, tensor in _preprocessed(interrogator, paths):
+        pending.setdefault(tensor.shape, []).append((path, tensor))
+        waiting += 1
+        if len(pending[tensor.shape]) >= batch_size:
+            shape = tensor.shape
+        elif waiting >= 4 * batch_size:
+            shape = max(pending, key=lambda shape: len(pending[shape]))
+        else:
+            continue
+        waiting -= len(pending[shape])
+        yield pending.pop(shape)
+    yield from pending.values()
+
+
+def _calibration_reader(interrogator: Interrogator, paths: List[Path]):
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class ImageReader(CalibrationDataReader):
+        """ Preprocessed images, one per model run. """
+        def __init__(self) -> None:
+            self.input_name = interrogator.model.get_inputs()[0].name
+            self.images = _preprocessed(interrogator, paths)
+
+        def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+            for _, tensor in self.images:
+                return {self.input_name: np.expand_dims(tensor, 0)}
+            return None
+
+    return ImageReader()
+
+
+def quantize(
+        interrogators: Dict[str, Interrogator],
+        key: str,
+        mode: str = 'dynamic',
+        calibration: List[Path] = ()
+) -> Path:
+    """
+    Make the INT8 variant of the model at `key' and register it.  Static
+    quantization calibrates on the images `calibration'.  Returns the path
+    of the quantized model.
+
+    Dynamic quantization is limited to MatMul and Gemm operators: ONNX
+    Runtime's dynamically quantized convolutions are slower than float
+    ones on CPUs, and the pointwise layers of the WD ConvNeXt models are
+    already MatMuls.
+    """
+    from onnxruntime.quantization import (
+        QuantType,
+        quantize_dynamic,
+        quantize_static
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f'unknown quantization mode {mode!r}')
+    if mode == 'static' and not calibration:
+        raise ValueError('static quantization needs calibration images')
+    interrogator = interrogators[key]
+    model_path, _ = interrogator.download()
+    output_path = quantized_model_path(model_path, mode)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Shape inference and graph fusions first, as ONNX Runtime
+        # recommends, for more operators to be quantized.
+        prepared = Path(directory) / 'prepared.onnx'
+        try:
+            quant_pre_process(str(model_path), str(prepared))
+        except Exception as e:
+            print(f'Quantizing {model_path} without preprocessing it: {e}',
+                  file=sys.stderr)
+            prepared = Path(model_path)
+        quantized = Path(directory) / 'quantized.onnx'
+        start = time.perf_counter()
+        if mode == 'dynamic':
+            quantize_dynamic(
+                prepared,
+                quantized,
+                op_types_to_quantize=['MatMul', 'Gemm'],
+                weight_type=QuantType.QInt8
+            )
+        else:
+            if not interrogator.is_loaded():
+                interrogator.load()
+            quantize_static(
+                prepared,
+                quantized,
+                _calibration_reader(interrogator, list(calibration)),
+                per_channel=True,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8
+            )
+        print(f'Quantized {model_path} ({mode}) in '
+              f'{time.perf_counter() - start:.1f} s', file=sys.stderr)
+        tmp_path = output_path.with_suffix('.tmp')
+        shutil.copyfile(quantized, tmp_path)
+        os.replace(tmp_path, output_path)
+
+    _save_variant(key, mode)
+    register_variant(interrogators, key, mode)
+    return output_path
+
+
+class TagCounts():
+    """ Per tag true positives, false positives and false negatives. """
+    def __init__(self, tags: int) -> None:
+        self.tp = np.zeros(tags, dtype=np.int64)
+        self.fp = np.zeros(tags, dtype=np.int64)
+        self.fn = np.zeros(tags, dtype=np.int64)
+
+    def add(self, predicted: np.ndarray, expected: np.ndarray) -> None:
+        self.tp += (predicted & expected).sum(axis=0)
+        self.fp += (predicted & ~expected).sum(axis=0)
+        self.fn += (~predicted & expected).sum(axis=0)
+
+    def precision(self) -> np.ndarray:
+        return self.tp / np.maximum(self.tp + self.fp, 1)
+
+    def recall(self) -> np.ndarray:
+        return self.tp / np.maximum(self.tp + self.fn, 1)
+
+    def micro(self) -> tuple[float, float]:
+        tp, fp, fn = self.tp.sum(), self.fp.sum(), self.fn.sum()
+        return tp / max(tp + fp, 1), tp / max(tp + fn, 1)
+
+
+def _truth(interrogator: Interrogator, paths: List[Path]) -> np.ndarray:
+    """ Tags of the images' `.txt' sidecars, over the model's tags. """
+    from tagger.tagger import escape_tag
+    from util import read_sidecar, sidecar_paths, split_tags
+
+    truth = np.zeros((len(paths), len(interrogator.tag_names)), dtype=bool)
+    for row, path in enumerate(paths):
+        for tag in split_tags(read_sidecar(sidecar_paths(str(path))[0])):
+            index = interrogator.tag_index.get(escape_tag(tag))
+            if index is not None:
+                truth[row, index] = True
+    return truth
+
+
+def compare(
+        reference: Interrogator,
+        variant: Interrogator,
+        paths: List[Path],
+        threshold: float = 0.35,
+        batch_size: int = 8,
+        ground_truth: bool = False
+) -> dict:
+    """
+    Tag `paths' with both models.  Per tag precision and recall of each
+    against the images' `.txt' tags when `ground_truth', otherwise of the
+    variant against the reference's tags; model run times are measured on
+    the same preprocessed batches.
+    """
+    for interrogator in (reference, variant):
+        if not interrogator.is_loaded():
+            interrogator.load()
+    tags = len(reference.tag_names)
+    counts = {'reference': TagCounts(tags), 'variant': TagCounts(tags)}
+    seconds = {'reference': 0.0, 'variant': 0.0}
+    images = 0
+    max_difference = 0.0
+    total_difference = 0.0
+    paths = list(paths)
+    for loaded in _batches(reference, paths, batch_size):
+        batch = reference.stack([tensor for _, tensor in loaded])
+        predictions = {}
+        for role, interrogator in (('reference', reference),
+                                   ('variant', variant)):
+            start = time.perf_counter()
+            confidences = interrogator.predict(batch)
+            seconds[role] += time.perf_counter() - start
+            predictions[role] = confidences[:, reference.rating_count:]
+        difference = np.abs(predictions['variant'] - predictions['reference'])
+        max_difference = max(max_difference, float(difference.max()))
+        total_difference += float(difference.mean()) * len(loaded)
+        predicted = {
+            role: confidences >= threshold
+            for role, confidences in predictions.items()
+        }
+        if ground_truth:
+            expected = _truth(reference, [path for path, _ in loaded])
+        else:
+            expected = predicted['reference']
+        for role in counts:
+            counts[role].add(predicted[role], expected)
+        images += len(loaded)
+    return {
+        'images': images,
+        'counts': counts,
+        'seconds': seconds,
+        'mean_difference': total_difference / max(images, 1),
+        'max_difference': max_difference
+    }
+
+
+def print_report(
+        report: dict,
+        tag_names: np.ndarray,
+        min_support: int = 5,
+        top: int = 20,
+        file=sys.stdout
+) -> None:
+    """ Overall and worst per tag precision and recall deltas, speed up. """
+    images = report['images']
+    reference, variant = report['counts']['reference'], \
+        report['counts']['variant']
+    seconds = report['seconds']
+    print(f'{images} images', file=file)
+    for role in ('reference', 'variant'):
+        p, r = report['counts'][role].micro()
+        rate = images / seconds[role] if seconds[role] else 0
+        print(f'  {role:9}  precision {p:.3f}  recall {r:.3f}  '
+              f'{rate:7.1f} images/s', file=file)
+    if seconds['variant']:
+        print(f'  speed up {seconds["reference"] / seconds["variant"]:.2f}x, '
+              f'confidence difference mean {report["mean_difference"]:.4f} '
+              f'max {report["max_difference"]:.4f}', file=file)
+
+    support = reference.tp + reference.fn
+    precision = variant.precision() - reference.precision()
+    recall = variant.recall() - reference.recall()
+    tags = np.flatnonzero(support >= min_support)
+    drop = np.minimum(precision, recall)[tags]
+    worst = tags[np.argsort(drop, kind='stable')][:min(top, (drop < 0).sum())]
+    print(f'  {(drop < 0).sum()} of {len(tags)} tags with at least '
+          f'{min_support} images lose precision or recall', file=file)
+    if len(worst) == 0:
+        return
+    print(f'    {"tag":32} {"images":>6} {"precision":>10} {"recall":>8}',
+          file=file)
+    for tag in worst.tolist():
+        print(f'    {tag_names[tag]:32} {support[tag]:6} '
+              f'{precision[tag]:+10.3f} {recall[tag]:+8.3f}', file=file)
+
+
+def main(argv: List[str] = None) -> None:
+    import argparse
+    from tagger.bulk import find_images
+    from tagger.interrogators import interrogators
+
+    parser = argparse.ArgumentParser(
+        description='Make an INT8 variant of a tagger model, registered as '
+                    'MODEL.int8-MODE, and compare its tags to the original '
+                    'model\'s.'
+    )
+    parser.add_argument('model', choices=sorted(
+        key for key, interrogator in interrogators.items()
+        if getattr(interrogator, 'quantization', None) is None
+    ))
+    parser.add_argument('--mode', choices=QUANTIZATION_MODES,
+                        default='dynamic')
+    parser.add_argument('--images', type=Path, default=None,
+                        help='directory of images to calibrate static '
+                             'quantization on and compare tags on')
+    parser.add_argument('--calibration-images', type=int, default=200,
+                        help='images used for calibration (default: '
+                             '%(default)s)')
+    parser.add_argument('--compare-images', type=int, default=500,
+                        help='images compared (default: %(default)s)')
+    parser.add_argument('--compare-only', action='store_true',
+                        help='compare an existing variant')
+    parser.add_argument('--ground-truth', action='store_true',
+                        help='score both models against the images\' .txt '
+                             'tags instead of the variant against the '
+                             'original')
+    parser.add_argument('-t', '--threshold', type=float, default=0.35)
+    parser.add_argument('--min-support', type=int, default=5,
+                        help='images a tag needs to be listed')
+    parser.add_argument('--cpu', action='store_true',
+                        help='only use the CPU execution provider')
+    args = parser.parse_args(argv)
+
+    paths = []
+    if args.images is not None:
+        paths = list(find_images(args.images))
+        # Calibrate and compare on different images.
+        rng = np.random.default_rng(0)
+        paths = [paths[i] for i in rng.permutation(len(paths))]
+    reference = interrogators[args.model]
+    if args.cpu:
+        reference.use_cpu()
+    calibration = paths[:args.calibration_images]
+    if args.compare_only:
+        key = variant_key(args.model, args.mode)
+        if key not in interrogators:
+            parser.error(f'no {args.mode} variant of {args.model} yet')
+        variant = interrogators[key]
+    else:
+        path = quantize(interrogators, args.model, args.mode, calibration)
+        size = os.path.getsize(path)
+        original = os.path.getsize(reference.download()[0])
+        print(f'Saved {path}, {size / 2 ** 20:.1f} MiB from '
+              f'{original / 2 ** 20:.1f} MiB', file=sys.stderr)
+        variant = interrogators[variant_key(args.model, args.mode)]
+    if args.mode != 'static':
+        calibration = []
+    if args.cpu:
+        variant.use_cpu()
+    if not paths:
+        return
+    compared = paths[len(calibration):][:args.compare_images]
+    if not compared:
+        compared = paths[:args.compare_images]
+    report = compare(
+        reference, variant, compared,
+        threshold=args.threshold,
+        ground_truth=args.ground_truth
+    )
+    print_report(report, reference.tag_names, min_support=args.min_support)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import sys
+import json
+from pathlib import Path
+from typing import Iterable, List
+
+import numpy as np
+
+DEFAULT_TAG_GROUPS = Path(__file__).with_name('tag_groups.json')
+
+
+def normalize_tag(tag: str) -> str:
+    """ Common form of a tag as written by the user or the model. """
+    return tag.replace('_', ' ').replace('\\(', '(').replace('\\)', ')')
+
+
+class TagGroups():
+    """
+    Rules for recommendations which would be redundant with an image's tags.
+
+    A group is a set of mutually exclusive tags (hair lengths, eye colours,
+    ...): once an image has one of them the others are not recommended,
+    unless it also has one of the group's `unless' tags ("multicolored
+    hair").  A general tag ("simple background") is not recommended next to
+    one of its more specific tags, whether the image has it or it is itself
+    recommended.
+
+    Loaded from a JSON file, see `tag_groups.json' for the format.
+    """
+    def __init__(
+            self,
+            groups: List[dict] = (),
+            general: List[dict] = ()
+    ) -> None:
+        self.groups = [
+            (
+                group.get('name', ''),
+                [normalize_tag(t) for t in group['tags']],
+                [normalize_tag(t) for t in group.get('unless', [])]
+            )
+            for group in groups
+        ]
+        self.general = [
+            (
+                normalize_tag(rule['tag']),
+                [normalize_tag(t) for t in rule['specific']]
+            )
+            for rule in general
+        ]
+
+    @classmethod
+    def load(cls, path: str | Path = None) -> 'TagGroups':
+        with open(path or DEFAULT_TAG_GROUPS, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        return cls(config.get('groups', []), config.get('general', []))
+
+    @classmethod
+    def load_or_default(cls, path: str | Path = None) -> 'TagGroups':
+        """ `load', falling back to the bundled rules if `path' is broken. """
+        if path:
+            try:
+                return cls.load(path)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f'Failed to load tag groups from {path}: {e}',
+                      file=sys.stderr)
+        return cls.load()
+
+    def compile(self, tag_names: np.ndarray) -> 'RedundancyFilter':
+        return RedundancyFilter(self, tag_names)
+
+
+class RedundancyFilter():
+    """
+    `TagGroups' compiled against a model's tag vocabulary: each group and
+    each general tag's specific tags become a boolean mask over the
+    vocabulary, so filtering a confidence vector is a few array operations.
+    Tags of the rules missing from the vocabulary are ignored.
+    """
+    def __init__(self, tag_groups: TagGroups, tag_names: np.ndarray) -> None:
+        self.tag_names = tag_names
+        size = len(tag_names)
+        index = {
+            normalize_tag(name): i
+            for i, name in enumerate(np.asarray(tag_names).tolist())
+        }
+
+        def mask(tags: Iterable[str]) -> np.ndarray:
+            m = np.zeros(size, dtype=bool)
+            m[[index[t] for t in tags if t in index]] = True
+            return m
+
+        groups = tag_groups.groups
+        self.members = np.stack(
+            [mask(tags) for _, tags, _ in groups]
+        ) if groups else np.zeros((0, size), dtype=bool)
+        # Tags the user may have, to the groups they activate or suspend.
+        self.member_of: dict[str, list[int]] = {}
+        self.exception_of: dict[str, list[int]] = {}
+        for g, (_, tags, unless) in enumerate(groups):
+            for tag in tags:
+                self.member_of.setdefault(tag, []).append(g)
+            for tag in unless:
+                self.exception_of.setdefault(tag, []).append(g)
+
+        rules = [
+            (index[tag], specific) for tag, specific in tag_groups.general
+            if tag in index
+        ]
+        self.general = np.array([i for i, _ in rules], dtype=np.int64)
+        self.specific = np.stack(
+            [mask(specific) for _, specific in rules]
+        ) if rules else np.zeros((0, size), dtype=bool)
+        self.specific_of: dict[str, list[int]] = {}
+        for r, (_, specific) in enumerate(rules):
+            for tag in specific:
+                self.specific_of.setdefault(tag, []).append(r)
+
+    def exclusion_mask(
+            self,
+            tags: Iterable[str],
+            scores: np.ndarray,
+            threshold: float
+    ) -> np.ndarray:
+        """
+        Tags of the vocabulary not to recommend to an image having `tags',
+        given the model's `scores' for it.
+        """
+        active, suspended, present = set(), set(), set()
+        for tag in tags:
+            tag = normalize_tag(tag)
+            active.update(self.member_of.get(tag, ()))
+            suspended.update(self.exception_of.get(tag, ()))
+            present.update(self.specific_of.get(tag, ()))
+        active -= suspended
+        if active:
+            excluded = self.members[sorted(active)].any(axis=0)
+        else:
+            excluded = np.zeros(self.members.shape[1], dtype=bool)
+        if len(self.general):
+            fired = np.zeros(len(self.general), dtype=bool)
+            fired[list(present)] = True
+            recommended = scores >= threshold
+            fired |= (self.specific & recommended).any(axis=1)
+            excluded[self.general[fired]] = True
+        return excluded
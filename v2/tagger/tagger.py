@@ -1,9 +1,12 @@
 import sys
 import json
-from typing import Generator, Iterable
-from tagger.interrogator import Interrogator
+from typing import Iterable, List
+from tagger.ensemble import EnsembleInterrogator, ensemble_key
+from tagger.cache import PredictionCache
+from tagger.tag_groups import TagGroups, RedundancyFilter
 from PIL import Image
 from pathlib import Path
+import numpy as np
 
 from tagger.interrogators import interrogators
 
@@ -19,12 +22,55 @@ def add_escaped_tags(tags: Iterable[str]) -> set[str]:
 class Tagger():
     def __init__(
             self,
-            interrogator: str = 'wd14-convnextv2.v1',
-            use_cpu: bool = False
+            interrogator: str | List[str] = 'wd14-convnextv2.v1',
+            use_cpu: bool = False,
+            batch_size: int = None,
+            cache: PredictionCache = None,
+            max_pixels: int = None,
+            tag_groups: TagGroups = None,
+            embedding_layer: str = None,
+            intra_op_threads: int = None,
+            inter_op_threads: int = None,
+            graph_optimization: str = None,
+            cache_optimized_model: bool = None,
+            merge_rule: str = 'mean',
+            vote_threshold: float = None
     ):
-        self.interrogator = interrogators[interrogator]
+        # Several interrogators make an ensemble, their confidences merged
+        # by `merge_rule'.
+        keys = [interrogator] if isinstance(interrogator, str) \
+            else list(dict.fromkeys(interrogator))
+        if len(keys) == 1:
+            self.interrogator_name = keys[0]
+            self.interrogator = interrogators[keys[0]]
+        else:
+            self.interrogator = EnsembleInterrogator(
+                [interrogators[key] for key in keys], merge_rule
+            )
+            if vote_threshold is not None:
+                self.interrogator.set_rule(merge_rule, vote_threshold)
+            self.interrogator_name = ensemble_key(
+                keys, merge_rule, self.interrogator.vote_threshold
+            )
+        self.cache = cache
+        # Recommendations redundant with the tags passed as `exclude_tags'
+        # are dropped according to `tag_groups', when given.
+        self.tag_groups = tag_groups
+        self._redundancy_filter: RedundancyFilter = None
         if use_cpu:
             self.interrogator.use_cpu()
+        if batch_size is not None:
+            self.interrogator.set_batch_size(batch_size)
+        if max_pixels is not None:
+            self.interrogator.max_pixels = max_pixels
+        if embedding_layer is not None:
+            self.interrogator.set_embedding_layer(embedding_layer)
+        self.interrogator.configure_session(
+            intra_op_threads=intra_op_threads,
+            inter_op_threads=inter_op_threads,
+            graph_optimization=graph_optimization,
+            cache_optimized_model=cache_optimized_model
+        )
 
     def tag_image(
             self,
@@ -36,24 +82,237 @@ class Tagger():
         """
         Predictions from a image path
         """
-        im = Image.open(image_path)
-        result = self.interrogator.interrogate(im)
+        confidences = self.predict_image(image_path)
+        return self.postprocess(
+            confidences, threshold, tag_escape, exclude_tags
+        )
+
+    def predict_image(self, image_path: Path) -> np.ndarray:
+        """
+        Raw confidence vector for an image, served from the prediction cache
+        when possible.
+        """
+        if self.cache is not None:
+            confidences = self.cache.get(image_path, self.interrogator_name)
+            if confidences is not None:
+                if self.interrogator.tag_names is None:
+                    self.interrogator.load_labels()
+                return confidences
+        if not self.interrogator.is_loaded():
+            self.interrogator.load()
+        with Image.open(image_path) as im:
+            batch = self.interrogator.stack([self.interrogator.preprocess(im)])
+        confidences = self.interrogator.predict(batch)[0]
+        if self.cache is not None:
+            self.cache.put(image_path, self.interrogator_name, confidences)
+        return confidences
 
+    def embed_image(self, image_path: Path) -> np.ndarray:
+        """
+        Embedding of an image for similarity search.  Confidence embeddings
+        are the tag confidences, served from the prediction cache.
+        """
+        if self.interrogator.embedding_layer == 'confidences':
+            confidences = self.predict_image(image_path)
+            return confidences[self.interrogator.rating_count:]
+        if not self.interrogator.is_loaded():
+            self.interrogator.load()
+        with Image.open(image_path) as im:
+            batch = self.interrogator.stack([self.interrogator.preprocess(im)])
+        confidences, embeddings = self.interrogator.predict_embeddings(batch)
+        if self.cache is not None:
+            self.cache.put(image_path, self.interrogator_name, confidences[0])
+        return embeddings[0]
+
+    def tag_images(
+            self,
+            image_paths: Iterable[Path],
+            threshold: float = 0.35,
+            tag_escape: bool = True,
+            exclude_tags: Iterable[str] = [],
+            batch_size: int = None
+    ) -> List[dict[str, float]]:
+        """
+        Predictions for many image paths, batched into as few model runs as
+        the interrogator's batch size allows.
+        """
+        images = (Image.open(image_path) for image_path in image_paths)
+        results = self.interrogator.large_batch_predict(
+            images,
+            batch_size=batch_size
+        )
+        return [
+            self.postprocess(confidences, threshold, tag_escape, exclude_tags)
+            for confidences in results
+        ]
+
+    def redundancy_filter(self) -> RedundancyFilter | None:
+        """ `tag_groups' compiled for the interrogator's vocabulary. """
+        if self.tag_groups is None:
+            return None
+        if self.interrogator.tag_names is None:
+            self.interrogator.load_labels()
+        tag_names = self.interrogator.tag_names
+        if (self._redundancy_filter is None
+                or self._redundancy_filter.tag_names is not tag_names):
+            self._redundancy_filter = self.tag_groups.compile(tag_names)
+        return self._redundancy_filter
+
+    def postprocess(
+            self,
+            confidences: np.ndarray,
+            threshold: float = 0.35,
+            tag_escape: bool = True,
+            exclude_tags: Iterable[str] = [],
+            top_k: int = None
+    ) -> dict[str, float]:
         excludes = []
         if tag_escape:
             excludes = add_escaped_tags(exclude_tags)
         else:
             excludes = exclude_tags
 
-        return Interrogator.postprocess_tags(
-            result[1],
+        exclude_mask = None
+        if (redundancy := self.redundancy_filter()) is not None:
+            exclude_mask = redundancy.exclusion_mask(
+                exclude_tags,
+                np.asarray(confidences)[self.interrogator.rating_count:],
+                threshold
+            )
+
+        return self.interrogator.postprocess_confidences(
+            confidences,
             threshold=threshold,
+            top_k=top_k,
             escape_tag=tag_escape,
             replace_underscore=tag_escape,
-            exclude_tags=excludes
+            exclude_tags=excludes,
+            exclude_mask=exclude_mask
+        )
+
+def main(argv: List[str] = None) -> None:
+    import argparse
+    from tagger.bulk import BulkTagger, ProgressManifest
+    from tagger.interrogator import EMBEDDING_LAYERS, GRAPH_OPTIMIZATIONS
+    from tagger.ensemble import MERGE_RULES
+    from tagger.embeddings import EmbeddingIndex, embedding_index_dir
+
+    parser = argparse.ArgumentParser(
+        description='Tag an image, or every image in a directory.'
+    )
+    parser.add_argument('path', type=Path,
+                        help='an image file or a directory of images')
+    parser.add_argument('-m', '--model', action='append',
+                        choices=sorted(interrogators),
+                        help='interrogator to use, repeat it to run an '
+                             'ensemble of several (default: '
+                             'wd14-convnextv2.v1)')
+    parser.add_argument('--merge', choices=MERGE_RULES, default='mean',
+                        help="how an ensemble's confidences are merged "
+                             '(default: %(default)s)')
+    parser.add_argument('--vote-threshold', type=float, default=None,
+                        help='confidence counted as a vote for a tag by '
+                             '--merge vote (default: 0.35)')
+    parser.add_argument('-t', '--threshold', type=float, default=0.35)
+    parser.add_argument('--cpu', action='store_true',
+                        help='only use the CPU execution provider')
+    parser.add_argument('-b', '--batch-size', type=int, default=None,
+                        help='maximum number of images per model run')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of image decoding threads')
+    parser.add_argument('--intra-op-threads', type=int, default=None,
+                        help='threads running each model operator, shared '
+                             'by the models of an ensemble (default: one per '
+                             'core)')
+    parser.add_argument('--inter-op-threads', type=int, default=None,
+                        help='threads running independent operators '
+                             '(default: 1)')
+    parser.add_argument('--graph-optimization', choices=GRAPH_OPTIMIZATIONS,
+                        default=None,
+                        help='ONNX Runtime graph optimization level '
+                             '(default: all)')
+    parser.add_argument('--no-model-cache', action='store_true',
+                        help='optimize the model graph again instead of '
+                             'reading the cached one')
+    parser.add_argument('--max-pixels', type=int, default=None,
+                        help='refuse images that can not be decoded below '
+                             'this many pixels')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='descend into subdirectories')
+    parser.add_argument('-o', '--output', type=Path, default=None,
+                        help='append JSONL results here instead of stdout')
+    parser.add_argument('--manifest', type=Path, default=None,
+                        help='progress file used to resume interrupted runs '
+                             '(default: PATH/.taggui-progress)')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='ignore and truncate an existing manifest')
+    parser.add_argument('--write-txt', action='store_true',
+                        help='write a comma separated .txt sidecar per image')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='replace existing .txt sidecars')
+    parser.add_argument('--embeddings', action='store_true',
+                        help='also store an embedding per image for finding '
+                             'similar images')
+    parser.add_argument('--embedding-layer', choices=EMBEDDING_LAYERS,
+                        default='confidences',
+                        help='what to embed images by (default: '
+                             '%(default)s)')
+    args = parser.parse_args(argv)
+
+    tagger = Tagger(
+        args.model or ['wd14-convnextv2.v1'],
+        use_cpu=args.cpu,
+        batch_size=args.batch_size,
+        max_pixels=args.max_pixels,
+        embedding_layer=args.embedding_layer,
+        intra_op_threads=args.intra_op_threads,
+        inter_op_threads=args.inter_op_threads,
+        graph_optimization=args.graph_optimization,
+        cache_optimized_model=False if args.no_model_cache else None,
+        merge_rule=args.merge,
+        vote_threshold=args.vote_threshold
+    )
+
+    if not args.path.is_dir():
+        tags = tagger.tag_image(args.path, threshold=args.threshold)
+        print(json.dumps(tags, indent=2))
+        return
+
+    manifest_path = args.manifest or args.path / '.taggui-progress'
+    if args.no_resume and manifest_path.exists():
+        manifest_path.unlink()
+    manifest = ProgressManifest(manifest_path)
+    if len(manifest) > 0:
+        print(f'Resuming, {len(manifest)} images already tagged',
+              file=sys.stderr)
+
+    bulk = BulkTagger(tagger, threshold=args.threshold)
+    if args.workers is not None:
+        bulk.workers = max(1, args.workers)
+    embeddings = None
+    if args.embeddings:
+        embeddings = EmbeddingIndex.open(embedding_index_dir(
+            args.path, tagger.interrogator_name, args.embedding_layer
+        ))
+    output = sys.stdout
+    if args.output is not None:
+        output = open(args.output, 'a', encoding='utf-8')
+    try:
+        bulk.run(
+            args.path,
+            recursive=args.recursive,
+            output=output,
+            manifest=manifest,
+            write_txt=args.write_txt,
+            overwrite=args.overwrite,
+            embeddings=embeddings
         )
+    finally:
+        manifest.close()
+        if embeddings is not None:
+            embeddings.save()
+        if output is not sys.stdout:
+            output.close()
 
 if __name__ == "__main__":
-    tagger = Tagger()
-    tags = tagger.tag_image(Path(sys.argv[1]))
-    print(json.dumps(tags, indent=2))
+    main()
@@ -0,0 +1,309 @@
+import os
+import sys
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from PySide6.QtCore import (
+    Qt,
+    QAbstractListModel,
+    QModelIndex,
+    QObject,
+    QRunnable,
+    QSize,
+    QThreadPool,
+    Signal
+)
+from PySide6.QtGui import QColor, QImage, QPainter, QPixmap
+from PySide6.QtWidgets import QListView, QWidget
+
+from image_io import read_thumbnail
+from tagger.cache import default_cache_dir
+
+_shared_cache = None
+
+
+class ThumbnailCache():
+    """
+    Persistent on-disk thumbnails, one JPEG per (path, size, mtime, thumbnail
+    size) so a changed image gets a new thumbnail automatically.  Total size
+    is capped at `max_bytes', evicting least recently used thumbnails first,
+    which also drops those of changed images; recency is kept in the files'
+    modification times like `PredictionCache' does.
+    """
+    def __init__(
+            self,
+            directory: Path = None,
+            max_bytes: int = 256 * 1024 * 1024
+    ) -> None:
+        self.directory = Path(directory or default_cache_dir() / 'thumbnails')
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Path, int] | None = None
+        self._total = 0
+
+    @classmethod
+    def shared(cls) -> 'ThumbnailCache':
+        """ The cache of the default directory, one index for all views. """
+        global _shared_cache
+        if _shared_cache is None:
+            _shared_cache = cls()
+        return _shared_cache
+
+    def _index(self) -> OrderedDict:
+        """ Lazily scan the cache directory, oldest entries first. """
+        if self._entries is None:
+            found = []
+            if self.directory.is_dir():
+                for root, _, files in os.walk(self.directory):
+                    for name in files:
+                        if not name.endswith('.jpg'):
+                            continue
+                        path = Path(root) / name
+                        try:
+                            st = path.stat()
+                        except OSError:
+                            continue
+                        found.append((st.st_mtime, path, st.st_size))
+            found.sort()
+            self._entries = OrderedDict((p, size) for _, p, size in found)
+            self._total = sum(self._entries.values())
+        return self._entries
+
+    def _discard(self, path: Path) -> None:
+        self._total -= self._entries.pop(path, 0)
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            self._discard(next(iter(self._entries)))
+
+    def path(self, image_path: str, thumbnail_size: int) -> Path | None:
+        try:
+            st = os.stat(image_path)
+        except OSError:
+            return None
+        ident = (
+            f'{os.path.abspath(image_path)}\0{st.st_size}\0'
+            f'{st.st_mtime_ns}\0{thumbnail_size}'
+        )
+        key = hashlib.sha1(ident.encode('utf-8')).hexdigest()
+        return self.directory / key[:2] / f'{key}.jpg'
+
+    def load(self, image_path: str, thumbnail_size: int) -> QImage:
+        """ Cached thumbnail, generating and storing it on a miss. """
+        cache_path = self.path(image_path, thumbnail_size)
+        if cache_path is None:
+            return QImage()
+        with self._lock:
+            cached = cache_path in self._index()
+        if cached:
+            image = QImage(str(cache_path))
+            with self._lock:
+                if image.isNull():
+                    self._discard(cache_path)
+                else:
+                    try:
+                        os.utime(cache_path)
+                    except OSError:
+                        pass
+                    self._entries.move_to_end(cache_path)
+                    return image
+
+        image = read_thumbnail(image_path, thumbnail_size)
+        if image.isNull():
+            return image
+        if image.hasAlphaChannel():
+            # JPEG has no alpha, flatten onto white like the tagger does.
+            flat = QImage(image.size(), QImage.Format.Format_RGB32)
+            flat.fill(QColor('white'))
+            painter = QPainter(flat)
+            painter.drawImage(0, 0, image)
+            painter.end()
+            image = flat
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_suffix('.tmp')
+            if not image.save(str(tmp_path), 'JPG', 85):
+                return image
+            os.replace(tmp_path, cache_path)
+            size = cache_path.stat().st_size
+        except OSError as e:
+            print(f'Failed to cache thumbnail: {e}', file=sys.stderr)
+            return image
+        with self._lock:
+            self._total += size - self._entries.pop(cache_path, 0)
+            self._entries[cache_path] = size
+            self._evict()
+        return image
+
+
+class ThumbnailSignals(QObject):
+    # QRunnable is not a QObject, so results are emitted from here.
+    loaded = Signal(str, QImage)
+
+
+class ThumbnailTask(QRunnable):
+    def __init__(
+            self,
+            cache: ThumbnailCache,
+            image_path: str,
+            thumbnail_size: int,
+            signals: ThumbnailSignals
+    ) -> None:
+        super().__init__()
+        self.cache = cache
+        self.image_path = image_path
+        self.thumbnail_size = thumbnail_size
+        self.signals = signals
+
+    def run(self) -> None:
+        try:
+            image = self.cache.load(self.image_path, self.thumbnail_size)
+        except Exception as e:
+            print(f'Failed to load thumbnail for {self.image_path}: {e}',
+                  file=sys.stderr)
+            image = QImage()
+        self.signals.loaded.emit(self.image_path, image)
+
+
+class ThumbnailModel(QAbstractListModel):
+    """
+    List model over the images of a directory.  Thumbnails are only requested
+    when a view asks for a row's decoration, i.e. when the cell is visible,
+    and are produced by a background thread pool.
+    """
+    # Thumbnails kept in memory as pixmaps.
+    MEMORY_CACHE_SIZE = 2000
+    # Queued requests beyond this are dropped, oldest (scrolled away) first.
+    MAX_PENDING = 256
+
+    def __init__(
+            self,
+            thumbnail_size: int = 128,
+            cache: ThumbnailCache = None,
+            parent: QObject = None
+    ) -> None:
+        super().__init__(parent)
+        self.thumbnail_size = thumbnail_size
+        self.cache = cache or ThumbnailCache.shared()
+        self.directory = ''
+        self.image_paths: list[str] = []
+        self.rows: dict[str, int] = {}
+        self.pixmaps: OrderedDict[str, QPixmap] = OrderedDict()
+        self.pending: OrderedDict[str, ThumbnailTask] = OrderedDict()
+        self.priority = 0
+        self.pool = QThreadPool(self)
+        self.signals = ThumbnailSignals(self)
+        self.signals.loaded.connect(self.on_thumbnail_loaded)
+        self.placeholder = QPixmap(thumbnail_size, thumbnail_size)
+        self.placeholder.fill(QColor('dimgray'))
+
+    def set_images(self, directory: str, image_paths: list[str]) -> None:
+        self.beginResetModel()
+        for task in self.pending.values():
+            self.pool.tryTake(task)
+        self.pending.clear()
+        self.directory = directory
+        self.image_paths = list(image_paths)
+        self.rows = {
+            os.path.join(directory, name): row
+            for row, name in enumerate(self.image_paths)
+        }
+        self.endResetModel()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self.image_paths)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.image_paths):
+            return None
+        name = self.image_paths[index.row()]
+        if role == Qt.DisplayRole or role == Qt.ToolTipRole:
+            return name
+        if role == Qt.DecorationRole:
+            path = os.path.join(self.directory, name)
+            pixmap = self.pixmaps.get(path)
+            if pixmap is not None:
+                self.pixmaps.move_to_end(path)
+                return pixmap
+            self.request(path)
+            return self.placeholder
+        return None
+
+    def request(self, path: str) -> None:
+        if path in self.pending:
+            return
+        task = ThumbnailTask(self.cache, path, self.thumbnail_size,
+                             self.signals)
+        task.setAutoDelete(False)
+        self.pending[path] = task
+        # Most recently requested cells are the ones on screen, run them first.
+        self.priority += 1
+        self.pool.start(task, self.priority)
+        while len(self.pending) > self.MAX_PENDING:
+            _, stale = self.pending.popitem(last=False)
+            self.pool.tryTake(stale)
+
+    def on_thumbnail_loaded(self, path: str, image: QImage) -> None:
+        self.pending.pop(path, None)
+        row = self.rows.get(path)
+        if row is None or image.isNull():
+            return
+        self.pixmaps[path] = QPixmap.fromImage(image)
+        while len(self.pixmaps) > self.MEMORY_CACHE_SIZE:
+            self.pixmaps.popitem(last=False)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def shutdown(self) -> None:
+        for task in self.pending.values():
+            self.pool.tryTake(task)
+        self.pending.clear()
+        self.pool.waitForDone()
+
+
+class ThumbnailGrid(QListView):
+    """ Virtualized grid of thumbnails, emits the row of a chosen image. """
+    imageSelected = Signal(int)
+
+    def __init__(self, thumbnail_size: int = 128, parent: QWidget = None):
+        super().__init__(parent)
+        self.thumbnail_model = ThumbnailModel(thumbnail_size, parent=self)
+        self.setModel(self.thumbnail_model)
+        self.setViewMode(QListView.ViewMode.IconMode)
+        self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.setMovement(QListView.Movement.Static)
+        # Uniform sizes and batched layout keep 50k+ rows cheap, only the
+        # visible cells are ever asked for their thumbnail.
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QListView.LayoutMode.Batched)
+        self.setBatchSize(500)
+        self.setIconSize(QSize(thumbnail_size, thumbnail_size))
+        self.setGridSize(QSize(thumbnail_size + 16, thumbnail_size + 32))
+        self.setWordWrap(False)
+        self.setTextElideMode(Qt.TextElideMode.ElideMiddle)
+        self.activated.connect(lambda index: self.imageSelected.emit(index.row()))
+
+    def set_images(self, directory: str, image_paths: list[str]) -> None:
+        # Resetting the model scrolls back to the top, keep the position
+        # when the same directory is only being updated.
+        same_directory = directory == self.thumbnail_model.directory
+        scroll = self.verticalScrollBar().value()
+        self.thumbnail_model.set_images(directory, image_paths)
+        if same_directory:
+            self.verticalScrollBar().setValue(scroll)
+
+    def set_current_row(self, row: int) -> None:
+        index = self.thumbnail_model.index(row)
+        self.setCurrentIndex(index)
+        self.scrollTo(index)
+
+    def shutdown(self) -> None:
+        self.thumbnail_model.shutdown()
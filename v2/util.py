@@ -1,3 +1,9 @@
+import os
+import tempfile
+
+# Files of a dataset treated as images.
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
 def deduplicate_list(input_list) -> list[any]:
     seen = set()  # Create a set to keep track of seen elements
     deduplicated_list = []  # List to hold deduplicated elements
@@ -6,3 +12,66 @@ def deduplicate_list(input_list) -> list[any]:
             seen.add(item)  # Add the item to the seen set
             deduplicated_list.append(item)  # Append it to the result list
     return deduplicated_list
+
+def sidecar_paths(image_path: str) -> tuple[str, str]:
+    """Return the `.txt' tags and `.caption' description paths of an image."""
+    base_path = os.path.splitext(image_path)[0]
+    return f"{base_path}.txt", f"{base_path}.caption"
+
+def delete_image_files(image_path: str) -> None:
+    """Delete an image along with its `.txt' and `.caption' sidecars."""
+    for path in (image_path, *sidecar_paths(image_path)):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+def file_mtime(path: str) -> int | None:
+    """Modification time in nanoseconds, or None if the file doesn't exist."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def read_sidecar(path: str) -> str | None:
+    """Read a sidecar as a single line, or None if it doesn't exist."""
+    try:
+        with open(path, 'r') as f:
+            return f.read().replace("\n", " ").strip()
+    except FileNotFoundError:
+        return None
+
+def split_tags(text: str | None) -> list[str]:
+    """Tags of a `.txt' sidecar, split and deduplicated like the editor does."""
+    if not text:
+        return []
+    return deduplicate_list(
+        tag.strip() for tag in text.split(',') if tag.strip()
+    )
+
+# Read once, setting the umask to query it is not thread safe.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def atomic_write_text(path: str, text: str) -> None:
+    """
+    Replace the file at `path' with `text' so readers see either the old or
+    the new content, never a partial write.
+    """
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or '.', prefix=f'.{name}.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        try:
+            # mkstemp creates the file private, keep the original's mode.
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise